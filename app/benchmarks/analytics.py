@@ -0,0 +1,118 @@
+'''
+Latency of the admin analytics statements over the precomputed tables
+versus the same aggregations over the raw transactions
+
+    python -m app.benchmarks.analytics --transactions 10000000
+
+Seeding 10M rows takes minutes; --database keeps the file so later runs
+can reuse it.
+'''
+
+import argparse
+import json
+import os
+import resource
+import time
+
+from .common import latency_summary, use_temporary_database
+from .indexes import generate_ledger
+
+RANGES = {
+    'all': {},
+    'year': {'date_from': '2020-01-01', 'date_to': '2020-12-31'},
+}
+
+LEDGER_QUERIES = {
+    'top_spenders':
+        'SELECT user_id, sum(amount) AS expense FROM transactions '
+        'WHERE amount < 0 {range} GROUP BY user_id '
+        'ORDER BY expense LIMIT 10',
+    'categories':
+        'SELECT category, sum(CASE WHEN amount >= 0 THEN amount ELSE 0 END), '
+        'sum(CASE WHEN amount < 0 THEN amount ELSE 0 END), count(*) '
+        'FROM transactions WHERE 1 {range} GROUP BY category',
+    'daily_volume':
+        'SELECT date, sum(CASE WHEN amount >= 0 THEN amount ELSE 0 END), '
+        'sum(CASE WHEN amount < 0 THEN amount ELSE 0 END), count(*) '
+        'FROM transactions WHERE 1 {range} GROUP BY date',
+}
+
+
+def timed(run, repeat: int) -> dict:
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = run()
+        latencies.append(time.perf_counter() - started)
+    return {'rows': len(rows), **latency_summary(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--transactions', type=int, default=10_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--database',
+                        help='SQLite file to seed once and reuse')
+    args = parser.parse_args()
+
+    if args.database:
+        seeded = os.path.exists(args.database)
+        os.environ['DB_URL'] = f'sqlite:///{args.database}'
+    else:
+        seeded = False
+        use_temporary_database()
+    from sqlalchemy import text
+
+    from ..database.aggregates import rebuild_statistics
+    from ..database.db import engine
+    from ..database.migrations import upgrade
+    from ..routes.analytics import (
+        categories_statement,
+        daily_volume_statement,
+        top_spenders_statement,
+    )
+    from ..schemas.analytics import TopSpendersQuery
+
+    upgrade(engine)
+    if not seeded:
+        generate_ledger(engine, args.users, args.transactions)
+        with engine.begin() as connection:
+            rebuild_statistics(connection)
+
+    statements = {
+        'top_spenders': top_spenders_statement,
+        'categories': categories_statement,
+        'daily_volume': daily_volume_statement,
+    }
+    results = {}
+    with engine.connect() as connection:
+        for range_name, bounds in RANGES.items():
+            analytics = TopSpendersQuery(**bounds)
+            condition = (f"AND date >= '{bounds['date_from']}' "
+                         f"AND date <= '{bounds['date_to']}'"
+                         if bounds else '')
+            for name, build in statements.items():
+                ledger_sql = text(LEDGER_QUERIES[name].format(
+                    range=condition))
+                stmt = build(analytics)
+                results[f'{name}/{range_name}'] = {
+                    'ledger': timed(
+                        lambda: connection.execute(ledger_sql).all(),
+                        args.repeat),
+                    'precomputed': timed(
+                        lambda: connection.execute(stmt).all(),
+                        args.repeat),
+                }
+
+    print(json.dumps({
+        'benchmark': 'analytics',
+        'transactions': args.transactions,
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF)
+                            .ru_maxrss / 1024, 1),
+        'queries': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
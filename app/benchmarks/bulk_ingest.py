@@ -0,0 +1,68 @@
+'''
+Rows per second through POST /transactions/ versus POST /transactions/bulk
+
+    python -m app.benchmarks.bulk_ingest --single 500 --bulk 20000
+'''
+
+import argparse
+import json
+import time
+
+from .common import use_temporary_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--single', type=int, default=500,
+                        help='rows sent one request each')
+    parser.add_argument('--bulk', type=int, default=20_000,
+                        help='rows sent through the bulk endpoint')
+    parser.add_argument('--batch', type=int, default=1000,
+                        help='rows per bulk request')
+    args = parser.parse_args()
+
+    use_temporary_database()
+    from fastapi.testclient import TestClient
+
+    from ..main import app
+
+    with TestClient(app) as client:
+        user = client.post('/users/register',
+                           json={'login': 'bench', 'password': 'bench'}).json()
+        token = client.get('/users/get-token',
+                           auth=('bench', 'bench')).json()['access_token']
+        headers = {'Authorization': f'Bearer {token}'}
+        account = client.post('/accounts/', headers=headers, json={
+            'account_name': 'bench', 'amount': 0,
+            'user_id': user['id']}).json()
+
+        def item(number: int) -> dict:
+            return {'amount': 1 + number % 7, 'category': 'Salary',
+                    'user_id': user['id'], 'account_id': account['id']}
+
+        started = time.perf_counter()
+        for number in range(args.single):
+            response = client.post('/transactions/', json=item(number),
+                                   headers=headers)
+            assert response.status_code == 201, response.text
+        single_rate = args.single / (time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for offset in range(0, args.bulk, args.batch):
+            batch = [item(number) for number in
+                     range(offset, min(offset + args.batch, args.bulk))]
+            response = client.post('/transactions/bulk', json=batch,
+                                   headers=headers)
+            assert response.json()['failed'] == 0, response.text
+        bulk_rate = args.bulk / (time.perf_counter() - started)
+
+    print(json.dumps({
+        'benchmark': 'bulk_ingest',
+        'single_rows_per_s': round(single_rate, 1),
+        'bulk_rows_per_s': round(bulk_rate, 1),
+        'speedup': round(bulk_rate / single_rate, 1),
+    }))
+
+
+if __name__ == '__main__':
+    main()
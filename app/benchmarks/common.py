@@ -0,0 +1,35 @@
+'''Helpers shared by the benchmark scripts'''
+
+import os
+import tempfile
+
+
+def use_temporary_database(name: str = 'bench.db') -> str:
+    '''
+    Point the application at a fresh SQLite file
+    Must be called before anything from the app package is imported.
+    Rate limiting is turned off unless set in the environment: every
+    load generator is a single client sending far beyond the limits
+    '''
+    path = os.path.join(tempfile.mkdtemp(prefix='wallet-bench-'), name)
+    os.environ['DB_URL'] = f'sqlite:///{path}'
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+    return path
+
+
+def percentile(values: list, q: float) -> float:
+    '''Nearest-rank percentile, q in [0, 100]'''
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1,
+                      round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def latency_summary(latencies: list) -> dict:
+    '''p50/p95/p99 in milliseconds'''
+    return {
+        f'p{q}_ms': round(percentile(latencies, q) * 1000, 3)
+        for q in (50, 95, 99)
+    }
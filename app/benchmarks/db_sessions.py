@@ -0,0 +1,147 @@
+'''
+Blocking Session versus AsyncSession inside async handlers under concurrency
+
+    python -m app.benchmarks.db_sessions --transactions 200000 --concurrency 32
+
+Both probes run the same per-user aggregate as /stats/user-balances. The
+blocking one is how every handler worked before the async port: the query
+runs on the event loop, so requests (and the cheap / probe) queue behind it.
+'''
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import date, timedelta
+
+from .common import latency_summary, use_temporary_database
+
+
+def seed(users: int, transactions: int) -> None:
+    from sqlalchemy import insert
+
+    from ..database.db import engine, session_local
+    from ..database.models import Account, Base, Transaction, User
+
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(0)
+    start = date(2020, 1, 1)
+    with session_local() as db:
+        db.execute(insert(User), [
+            {'id': i, 'login': f'user{i}', 'is_admin': False, 'password': ''}
+            for i in range(1, users + 1)
+        ])
+        db.execute(insert(Account), [
+            {'id': i, 'account_name': 'main', 'amount': 0.0, 'user_id': i}
+            for i in range(1, users + 1)
+        ])
+        rows = []
+        for _ in range(transactions):
+            user_id = rng.randint(1, users)
+            rows.append({
+                'category': 'Other expenses',
+                'amount': -round(rng.uniform(1, 100), 2),
+                'date': start + timedelta(days=rng.randint(0, 1500)),
+                'user_id': user_id,
+                'account_id': user_id,
+            })
+        db.execute(insert(Transaction), rows)
+        db.commit()
+
+
+def build_app():
+    from fastapi import FastAPI
+    from sqlalchemy import func, select
+
+    from ..database.db import async_session_local, session_local
+    from ..database.models import Transaction
+
+    def stats_query(user_id: int):
+        return select(
+            func.sum(Transaction.amount),
+            func.count(Transaction.id),
+            func.min(Transaction.date),
+            func.max(Transaction.date),
+        ).filter(Transaction.user_id == user_id)
+
+    bench_app = FastAPI()
+
+    @bench_app.get('/')
+    async def ping():
+        return 'ok'
+
+    @bench_app.get('/sync/{user_id}')
+    async def sync_stats(user_id: int):
+        with session_local() as db:
+            return list(db.execute(stats_query(user_id)).first())
+
+    @bench_app.get('/async/{user_id}')
+    async def async_stats(user_id: int):
+        async with async_session_local() as db:
+            return list((await db.execute(stats_query(user_id))).first())
+
+    return bench_app
+
+
+async def drive(bench_app, mode: str, users: int, concurrency: int,
+                requests: int) -> dict:
+    import httpx
+
+    transport = httpx.ASGITransport(app=bench_app)
+    async with httpx.AsyncClient(transport=transport,
+                                 base_url='http://bench') as client:
+        rng = random.Random(1)
+        query_latencies, probe_latencies = [], []
+        done = asyncio.Event()
+
+        async def worker(count: int):
+            for _ in range(count):
+                begin = time.perf_counter()
+                await client.get(f'/{mode}/{rng.randint(1, users)}')
+                query_latencies.append(time.perf_counter() - begin)
+
+        async def probe():
+            while not done.is_set():
+                begin = time.perf_counter()
+                await client.get('/')
+                probe_latencies.append(time.perf_counter() - begin)
+                await asyncio.sleep(0.002)
+
+        prober = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(requests // concurrency)
+                               for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await prober
+
+    return {
+        'mode': mode,
+        'requests': len(query_latencies),
+        'throughput_rps': round(len(query_latencies) / elapsed, 1),
+        'query': latency_summary(query_latencies),
+        'root_probe_samples': len(probe_latencies),
+        'root_probe': latency_summary(probe_latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--transactions', type=int, default=200_000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=640)
+    args = parser.parse_args()
+
+    use_temporary_database()
+    seed(args.users, args.transactions)
+    bench_app = build_app()
+    for mode in ('sync', 'async'):
+        result = asyncio.run(drive(bench_app, mode, args.users,
+                                   args.concurrency, args.requests))
+        print(json.dumps({'benchmark': 'db_sessions', **result}))
+
+
+if __name__ == '__main__':
+    main()
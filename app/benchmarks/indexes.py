@@ -0,0 +1,145 @@
+'''
+Query plans and timings of the hot per-user queries without and with the
+indexes added by migration 2
+
+    python -m app.benchmarks.indexes --transactions 2000000
+'''
+
+import argparse
+import json
+import random
+import time
+from datetime import date, timedelta
+
+from .common import use_temporary_database
+
+CATEGORIES = ['Products', 'Clothing', 'Subscriptions', 'Other expenses']
+
+HOT_QUERIES = {
+    'transactions_by_user':
+        'SELECT id, category, amount, date FROM transactions '
+        'WHERE user_id = :user_id',
+    'accounts_by_user':
+        'SELECT id, amount FROM accounts WHERE user_id = :user_id',
+    'balance_stats':
+        'SELECT sum(amount), count(id), min(date), max(date) '
+        'FROM transactions WHERE user_id = :user_id',
+    'monthly_category_spent':
+        'SELECT category, sum(amount) FROM transactions '
+        'WHERE user_id = :user_id AND date >= :first AND date <= :last '
+        'GROUP BY category ORDER BY sum(amount)',
+    'login_lookup':
+        'SELECT id FROM users WHERE login = :login',
+}
+
+HOT_INDEXES = [
+    ('users', 'ix_users_login'),
+    ('accounts', 'ix_accounts_user_id'),
+    ('transactions', 'ix_transactions_user_date'),
+    ('transactions', 'ix_transactions_account_id'),
+]
+
+
+def generate_ledger(engine, users: int, transactions: int,
+                    batch: int = 100_000) -> None:
+    '''Fill the tables with a synthetic ledger through executemany'''
+    rng = random.Random(0)
+    start = date(2018, 1, 1)
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.executemany(
+            'INSERT INTO users (id, login, is_admin, password, token_version) '
+            'VALUES (?, ?, 0, \'\', 0)',
+            [(i, f'user{i}') for i in range(1, users + 1)])
+        cursor.executemany(
+            'INSERT INTO accounts (id, account_name, amount, user_id) '
+            'VALUES (?, \'main\', 0, ?)',
+            [(i, i) for i in range(1, users + 1)])
+        for offset in range(0, transactions, batch):
+            rows = []
+            for _ in range(min(batch, transactions - offset)):
+                user_id = rng.randint(1, users)
+                rows.append((
+                    rng.choice(CATEGORIES),
+                    -rng.randint(100, 50_000),  # minor units
+                    (start + timedelta(days=rng.randint(0, 2500))).isoformat(),
+                    user_id,
+                    user_id,
+                ))
+            cursor.executemany(
+                'INSERT INTO transactions '
+                '(category, amount, date, user_id, account_id) '
+                'VALUES (?, ?, ?, ?, ?)', rows)
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def measure(connection, users: int, repeat: int) -> dict:
+    from sqlalchemy import text
+
+    rng = random.Random(1)
+    results = {}
+    for name, sql in HOT_QUERIES.items():
+        def params():
+            user_id = rng.randint(1, users)
+            return {'user_id': user_id, 'login': f'user{user_id}',
+                    'first': '2021-03-01', 'last': '2021-03-31'}
+
+        plan = [row[-1] for row in connection.execute(
+            text('EXPLAIN QUERY PLAN ' + sql), params())]
+        started = time.perf_counter()
+        for _ in range(repeat):
+            connection.execute(text(sql), params()).fetchall()
+        results[name] = {
+            'plan': plan,
+            'avg_ms': round((time.perf_counter() - started)
+                            / repeat * 1000, 3),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--transactions', type=int, default=2_000_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    use_temporary_database()
+    from sqlalchemy import text
+
+    from ..database.db import engine
+    from ..database.migrations import recreate_index
+    from ..database.models import Base
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        for table, index in HOT_INDEXES:
+            connection.execute(text(f'DROP INDEX IF EXISTS {index}'))
+
+    started = time.perf_counter()
+    generate_ledger(engine, args.users, args.transactions)
+    seeded = time.perf_counter() - started
+
+    with engine.connect() as connection:
+        before = measure(connection, args.users, args.repeat)
+    with engine.begin() as connection:
+        for table, index in HOT_INDEXES:
+            recreate_index(connection, table, index)
+        connection.execute(text('ANALYZE'))
+    with engine.connect() as connection:
+        after = measure(connection, args.users, args.repeat)
+
+    print(json.dumps({
+        'benchmark': 'indexes',
+        'transactions': args.transactions,
+        'seed_s': round(seeded, 1),
+        'queries': {name: {'before': before[name], 'after': after[name]}
+                    for name in HOT_QUERIES},
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+'''
+Latency of the cheap root endpoint while argon2 load runs in parallel
+
+    python -m app.benchmarks.password_pool --workers 0   # hashing inline
+    python -m app.benchmarks.password_pool --workers 4   # hashing on the pool
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from .common import latency_summary, use_temporary_database
+
+
+async def run(concurrency: int, probes: int) -> dict:
+    import httpx
+
+    from ..main import app
+    from ..utils.authorisation_password import password_service
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport,
+                              base_url='http://bench') as client:
+        await client.post('/users/register',
+                          json={'login': 'bench', 'password': 'bench'})
+        stop = asyncio.Event()
+
+        async def login_storm(worker: int):
+            attempt = 0
+            while not stop.is_set():
+                attempt += 1
+                # Wrong passwords are never cached, so every call hits argon2
+                await client.get('/users/authorise-with-password',
+                                 auth=('bench', f'wrong-{worker}-{attempt}'))
+
+        storm = [asyncio.create_task(login_storm(i))
+                 for i in range(concurrency)]
+        await asyncio.sleep(0.2)
+
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(probes):
+            begin = time.perf_counter()
+            await client.get('/')
+            latencies.append(time.perf_counter() - begin)
+            await asyncio.sleep(0.005)
+        elapsed = time.perf_counter() - started
+
+        stop.set()
+        await asyncio.gather(*storm)
+
+    return {
+        'benchmark': 'password_pool',
+        'password_workers': password_service.workers,
+        'storm_concurrency': concurrency,
+        'probes': probes,
+        'elapsed_s': round(elapsed, 3),
+        **latency_summary(latencies),
+        'password_service': password_service.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=4,
+                        help='PASSWORD_WORKERS, 0 hashes on the event loop')
+    parser.add_argument('--max-queue', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='parallel failing logins')
+    parser.add_argument('--probes', type=int, default=200,
+                        help='requests to / to measure')
+    args = parser.parse_args()
+
+    use_temporary_database()
+    os.environ['PASSWORD_WORKERS'] = str(args.workers)
+    os.environ['PASSWORD_MAX_QUEUE'] = str(args.max_queue)
+    print(json.dumps(asyncio.run(run(args.concurrency, args.probes))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+'''
+Write throughput of concurrent writers: the default rollback journal
+with synchronous=FULL versus the WAL + synchronous=NORMAL profile of
+Settings
+
+    python -m app.benchmarks.sqlite_wal --writers 8 --transactions 300
+
+Every writer is a process with its own engine built by engine_options,
+committing what POST /transactions/ writes: a balance update and a
+ledger row. Each profile gets a fresh database file, as the journal
+mode is stored in the file.
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import time
+from datetime import date
+
+from .common import latency_summary, use_temporary_database
+
+ROLLBACK_PROFILE = {
+    'journal_mode': 'DELETE',
+    'synchronous': 'FULL',
+    'busy_timeout': 5000,
+}
+
+
+def seed(url: str, pragmas: dict, accounts: int) -> None:
+    from sqlalchemy import create_engine, insert
+
+    from ..database.db import engine_options, set_sqlite_pragmas
+    from ..database.models import Account, Base, User
+
+    engine = create_engine(url, **engine_options(url))
+    set_sqlite_pragmas(engine, pragmas)
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(User), [
+            {'id': i, 'login': f'user{i}', 'is_admin': False, 'password': ''}
+            for i in range(1, accounts + 1)])
+        connection.execute(insert(Account), [
+            {'id': i, 'account_name': 'main', 'amount': 0, 'user_id': i}
+            for i in range(1, accounts + 1)])
+    engine.dispose()
+
+
+def writer(task: tuple) -> tuple:
+    url, pragmas, accounts, count, number = task
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.exc import OperationalError
+
+    from ..database.db import engine_options, set_sqlite_pragmas
+
+    engine = create_engine(url, **engine_options(url))
+    set_sqlite_pragmas(engine, pragmas)
+    rng = random.Random(number)
+    today = date.today().isoformat()
+    latencies, errors = [], 0
+    for _ in range(count):
+        account_id = rng.randint(1, accounts)
+        started = time.perf_counter()
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(
+                    'UPDATE accounts SET amount = amount + 100 '
+                    'WHERE id = :id'), {'id': account_id})
+                connection.execute(text(
+                    'INSERT INTO transactions '
+                    '(category, amount, date, user_id, account_id) '
+                    "VALUES ('Salary', 100, :date, :id, :id)"),
+                    {'date': today, 'id': account_id})
+        except OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+    engine.dispose()
+    return latencies, errors
+
+
+def run(directory: str, name: str, pragmas: dict, writers: int,
+        transactions: int, accounts: int) -> dict:
+    url = f'sqlite:///{os.path.join(directory, name + ".db")}'
+    seed(url, pragmas, accounts)
+    tasks = [(url, pragmas, accounts, transactions, number)
+             for number in range(writers)]
+    with multiprocessing.get_context('fork').Pool(writers) as pool:
+        started = time.perf_counter()
+        results = pool.map(writer, tasks)
+        elapsed = time.perf_counter() - started
+    latencies = [value for result, _ in results for value in result]
+    return {
+        'pragmas': pragmas,
+        'commits': len(latencies),
+        'errors': sum(errors for _, errors in results),
+        'commits_per_s': round(len(latencies) / elapsed, 1),
+        'commit': latency_summary(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--transactions', type=int, default=300,
+                        help='commits per writer')
+    parser.add_argument('--accounts', type=int, default=100)
+    args = parser.parse_args()
+
+    directory = os.path.dirname(use_temporary_database())
+    from ..database.db import sqlite_pragmas
+
+    results = {
+        name: run(directory, name, pragmas, args.writers,
+                  args.transactions, args.accounts)
+        for name, pragmas in (('rollback', ROLLBACK_PROFILE),
+                              ('wal', sqlite_pragmas()))
+    }
+    results['speedup'] = round(results['wal']['commits_per_s']
+                               / results['rollback']['commits_per_s'], 2)
+    print(json.dumps({'benchmark': 'sqlite_wal', 'writers': args.writers,
+                      **results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+'''
+Latency of the statistics endpoints computed from the ledger (indexed
+aggregate scans) versus read from the precomputed tables of migration 4
+
+    python -m app.benchmarks.statistics --users 100 --transactions 1000000
+'''
+
+import argparse
+import json
+import random
+import time
+
+from .common import latency_summary, use_temporary_database
+from .indexes import HOT_QUERIES, generate_ledger
+
+PRECOMPUTED_QUERIES = {
+    'balance_stats':
+        'SELECT account_total, account_count, transaction_total, '
+        'transaction_count, first_date, last_date '
+        'FROM user_stats WHERE user_id = :user_id',
+    'monthly_category_spent':
+        'SELECT category, amount FROM category_month_stats '
+        'WHERE user_id = :user_id AND year = 2021 AND month = 3 '
+        'AND count > 0 ORDER BY amount',
+}
+
+
+def measure(connection, queries: dict, users: int, repeat: int) -> dict:
+    from sqlalchemy import text
+
+    rng = random.Random(1)
+    results = {}
+    for name, sql in queries.items():
+        latencies = []
+        for _ in range(repeat):
+            params = {'user_id': rng.randint(1, users),
+                      'first': '2021-03-01', 'last': '2021-03-31'}
+            started = time.perf_counter()
+            connection.execute(text(sql), params).fetchall()
+            latencies.append(time.perf_counter() - started)
+        results[name] = latency_summary(latencies)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--transactions', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    use_temporary_database()
+    from ..database.aggregates import rebuild_statistics
+    from ..database.db import engine
+    from ..database.migrations import upgrade
+
+    upgrade(engine)
+    generate_ledger(engine, args.users, args.transactions)
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        rebuild_statistics(connection)
+    rebuilt = time.perf_counter() - started
+
+    with engine.connect() as connection:
+        ledger = measure(connection,
+                         {name: HOT_QUERIES[name]
+                          for name in PRECOMPUTED_QUERIES},
+                         args.users, args.repeat)
+        precomputed = measure(connection, PRECOMPUTED_QUERIES,
+                              args.users, args.repeat)
+
+    print(json.dumps({
+        'benchmark': 'statistics',
+        'transactions': args.transactions,
+        'rebuild_s': round(rebuilt, 2),
+        'queries': {name: {'ledger': ledger[name],
+                           'precomputed': precomputed[name]}
+                    for name in PRECOMPUTED_QUERIES},
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+'''
+Throughput, latency and statements per request of the hot endpoints,
+driven through the real application in-process
+
+    python -m app.benchmarks.suite --transactions 1000000 --output base.json
+    python -m app.benchmarks.suite --transactions 1000000 --compare base.json
+
+The ledger is seeded with generate_ledger before the application is
+imported, then every scenario sends --requests requests from
+--concurrency clients over the httpx ASGI transport, after --warmup
+unmeasured ones. Statements are counted on the request engine.
+Cold start is timed in --cold-starts fresh interpreters: importing
+app.main, then running the lifespan and answering GET /.
+
+--output writes the result as a baseline; --compare prints the ratios
+against one and exits with 1 when a scenario lost more than --tolerance
+of its throughput, gained more than --tolerance of p95 latency or
+cold start time, or runs more statements per request. Timings of runs on one machine vary by
+10-25%, statement counts do not.
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from .common import latency_summary, use_temporary_database
+from .indexes import generate_ledger
+
+PASSWORD = 'bench'
+# Balance updates retried on a busy database add a fraction of a statement
+STATEMENT_SLACK = 0.5
+
+COLD_START = '''
+import time
+started = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app) as client:
+    client.get('/')
+    print(imported - started, time.perf_counter() - started)
+'''
+
+
+def seed(users: int, transactions: int) -> None:
+    from sqlalchemy import text
+
+    from ..database.aggregates import rebuild_statistics
+    from ..database.db import engine
+    from ..database.migrations import upgrade
+    from ..utils.authorisation_password import get_password_hash
+
+    upgrade(engine)
+    generate_ledger(engine, users, transactions)
+    with engine.begin() as connection:
+        # One argon2 hash for everybody, seeding stays fast
+        connection.execute(text('UPDATE users SET password = :password'),
+                           {'password': get_password_hash(PASSWORD)})
+        connection.execute(text('UPDATE accounts SET amount = 10000000'))
+        rebuild_statistics(connection)
+
+
+def scenarios(user_id: int, bearer: dict, basic: tuple) -> dict:
+    '''Name to (method, url, keyword arguments) of one request'''
+    return {
+        'auth': ('GET', '/users/authorise-with-password', {'auth': basic}),
+        'token_login': ('GET', '/users/get-token', {'auth': basic}),
+        'create_transaction': ('POST', '/transactions/', {
+            'headers': bearer,
+            'json': {'amount': 12.5, 'category': 'Salary',
+                     'user_id': user_id, 'account_id': user_id}}),
+        'list_transactions': ('GET', f'/transactions/{user_id}', {
+            'headers': bearer, 'params': {'limit': 100}}),
+        'balance_stats': ('GET', f'/stats/user-balances/{user_id}',
+                          {'headers': bearer}),
+        'monthly_stats': ('GET', f'/stats/monthly-category-spent/{user_id}', {
+            'headers': bearer,
+            'params': {'month_trans': 3, 'year_trans': 2021}}),
+    }
+
+
+async def drive(app, name: str, clients: list, concurrency: int,
+                requests: int, warmup: int) -> dict:
+    import httpx
+    from sqlalchemy import event
+
+    from ..database.db import async_engine
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport,
+                                 base_url='http://bench') as client:
+        rng = random.Random(name)
+
+        async def send():
+            method, url, options = rng.choice(clients)[name]
+            return await client.request(method, url, **options)
+
+        for _ in range(warmup):
+            await send()
+
+        latencies, errors, statements = [], 0, 0
+
+        def count(*_):
+            nonlocal statements
+            statements += 1
+
+        async def worker(count_: int):
+            nonlocal errors
+            for _ in range(count_):
+                begin = time.perf_counter()
+                response = await send()
+                latencies.append(time.perf_counter() - begin)
+                errors += response.status_code >= 400
+
+        event.listen(async_engine.sync_engine, 'before_cursor_execute', count)
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(requests // concurrency)
+                                   for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+        finally:
+            event.remove(async_engine.sync_engine, 'before_cursor_execute',
+                         count)
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        **latency_summary(latencies),
+        'statements_per_request': round(statements / len(latencies), 2),
+    }
+
+
+async def run(users: int, concurrency: int, requests: int,
+              warmup: int) -> dict:
+    import httpx
+
+    from ..main import app
+
+    clients = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport,
+                                 base_url='http://bench') as client:
+        for user_id in random.Random(0).sample(range(1, users + 1),
+                                               min(users, concurrency * 2)):
+            basic = (f'user{user_id}', PASSWORD)
+            token = (await client.get('/users/get-token', auth=basic)
+                     ).json()['access_token']
+            clients.append(scenarios(
+                user_id, {'Authorization': f'Bearer {token}'}, basic))
+
+    return {name: await drive(app, name, clients, concurrency, requests,
+                              warmup)
+            for name in clients[0]}
+
+
+def cold_start(repeat: int) -> dict:
+    '''Medians over fresh interpreters on the seeded database'''
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    imports, readies, processes = [], [], []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', COLD_START], cwd=root,
+                                capture_output=True, text=True,
+                                check=True).stdout
+        processes.append(time.perf_counter() - started)
+        imported, ready = map(float, output.split()[-2:])
+        imports.append(imported)
+        readies.append(ready)
+    return {
+        'import_ms': round(statistics.median(imports) * 1000, 1),
+        'ready_ms': round(statistics.median(readies) * 1000, 1),
+        'process_ms': round(statistics.median(processes) * 1000, 1),
+    }
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> dict:
+    '''Ratios of current to baseline and the regressions beyond tolerance'''
+    ratios, regressions = {}, []
+    for name, now in current['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        ratios[name] = {
+            'throughput': round(now['throughput_rps']
+                                / before['throughput_rps'], 2),
+            'p95': round(now['p95_ms'] / before['p95_ms'], 2)
+            if before['p95_ms'] else None,
+            'statements_per_request': round(
+                now['statements_per_request']
+                - before['statements_per_request'], 2),
+        }
+        if ratios[name]['throughput'] < 1 - tolerance:
+            regressions.append(f'{name}: throughput '
+                               f'x{ratios[name]["throughput"]}')
+        if ratios[name]['p95'] and ratios[name]['p95'] > 1 + tolerance:
+            regressions.append(f'{name}: p95 x{ratios[name]["p95"]}')
+        if ratios[name]['statements_per_request'] > STATEMENT_SLACK:
+            regressions.append(
+                f'{name}: {now["statements_per_request"]} statements '
+                f'per request, {before["statements_per_request"]} before')
+    if 'cold_start' in baseline:
+        ratios['cold_start'] = round(current['cold_start']['ready_ms']
+                                     / baseline['cold_start']['ready_ms'], 2)
+        if ratios['cold_start'] > 1 + tolerance:
+            regressions.append(f'cold start x{ratios["cold_start"]}')
+    return {'ratios': ratios, 'regressions': regressions}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--transactions', type=int, default=1_000_000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=800,
+                        help='measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--cold-starts', type=int, default=5)
+    parser.add_argument('--output', help='write the result to this file')
+    parser.add_argument('--compare', help='baseline written by --output')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    use_temporary_database()
+    started = time.perf_counter()
+    seed(args.users, args.transactions)
+    result = {
+        'benchmark': 'suite',
+        'users': args.users,
+        'transactions': args.transactions,
+        'concurrency': args.concurrency,
+        'seed_s': round(time.perf_counter() - started, 1),
+        'cold_start': cold_start(args.cold_starts),
+        'scenarios': asyncio.run(run(args.users, args.concurrency,
+                                     args.requests, args.warmup)),
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            result['comparison'] = compare(json.load(file), result,
+                                           args.tolerance)
+    print(json.dumps(result, indent=2))
+    if args.compare and result['comparison']['regressions']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''
+Latency of GET /stats/timeseries for one user with a multi-year history:
+the statement the endpoint runs over category_day_stats versus the same
+grouping over the raw transactions
+
+    python -m app.benchmarks.timeseries --transactions 1000000
+'''
+
+import argparse
+import json
+import time
+
+from .common import latency_summary, use_temporary_database
+from .indexes import generate_ledger
+
+LEDGER_QUERY = (
+    "SELECT {period} AS period, category, "
+    "sum(CASE WHEN amount >= 0 THEN amount ELSE 0 END), "
+    "sum(CASE WHEN amount < 0 THEN amount ELSE 0 END), count(*) "
+    "FROM transactions WHERE user_id = 1 "
+    "GROUP BY period, category ORDER BY period, category"
+)
+
+
+def timed(run, repeat: int) -> dict:
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = run()
+        latencies.append(time.perf_counter() - started)
+    return {'points': len(rows), **latency_summary(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--transactions', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    use_temporary_database()
+    from sqlalchemy import text
+
+    from ..database.aggregates import rebuild_statistics
+    from ..database.db import engine
+    from ..database.migrations import upgrade
+    from ..routes.statistic import SQLITE_PERIOD_START, time_series_statement
+    from ..schemas.statistic import TimeSeriesQuery
+
+    upgrade(engine)
+    generate_ledger(engine, 1, args.transactions)
+    with engine.begin() as connection:
+        rebuild_statistics(connection)
+
+    results = {}
+    with engine.connect() as connection:
+        for granularity in ('day', 'week', 'month', 'year'):
+            modifiers = ', '.join(
+                f"'{modifier}'"
+                for modifier in SQLITE_PERIOD_START.get(granularity, ()))
+            period = f'date(date, {modifiers})' if modifiers else 'date'
+            ledger_sql = text(LEDGER_QUERY.format(period=period))
+            stmt = time_series_statement(
+                1, TimeSeriesQuery(granularity=granularity), 'sqlite')
+            results[granularity] = {
+                'ledger': timed(
+                    lambda: connection.execute(ledger_sql).all(),
+                    args.repeat),
+                'precomputed': timed(
+                    lambda: connection.execute(stmt).all(), args.repeat),
+            }
+
+    print(json.dumps({
+        'benchmark': 'timeseries',
+        'transactions': args.transactions,
+        'granularity': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
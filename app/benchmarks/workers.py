@@ -0,0 +1,132 @@
+'''
+Throughput of `manage serve` with a growing number of worker processes
+
+    python -m app.benchmarks.workers --workers 1 2 4 --concurrency 32
+
+Every run starts the real launcher on a seeded database, with the shared
+sqlite stores even for one worker so only the process count changes, and
+sends --requests requests over TCP from
+--concurrency clients: balance statistics, a page of transactions and a
+token check, for users picked at random. The load generator runs on the
+same machine; the scaling it shows is bounded by the free cores.
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from .common import latency_summary, use_temporary_database
+from .suite import PASSWORD, seed
+
+
+def start(workers: int, port: int, directory: str) -> subprocess.Popen:
+    from ..manage import SHARED_BACKENDS
+
+    environment = {
+        **os.environ,
+        **{name: 'sqlite' for name in SHARED_BACKENDS},
+        'STATS_CACHE_PATH': os.path.join(directory, 'stats_cache.db'),
+        'IDEMPOTENCY_PATH': os.path.join(directory, 'idempotency.db'),
+        'SHARED_STATE_PATH': os.path.join(directory, 'shared_state.db'),
+        'RATE_LIMIT_PATH': os.path.join(directory, 'rate_limit.db'),
+    }
+    return subprocess.Popen(
+        [sys.executable, '-m', 'app.manage', 'serve', '--port', str(port),
+         '--workers', str(workers)],
+        env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_ready(client, timeout: float = 60) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get('/')).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError('the server did not start')
+
+
+async def drive(port: int, users: int, concurrency: int,
+                requests: int) -> dict:
+    import httpx
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}',
+                                 limits=limits, timeout=60) as client:
+        await wait_ready(client)
+        rng = random.Random(0)
+        bearers = {}
+        for user_id in rng.sample(range(1, users + 1), min(users, 50)):
+            token = (await client.get(
+                '/users/get-token', auth=(f'user{user_id}', PASSWORD))
+            ).json()['access_token']
+            bearers[user_id] = {'Authorization': f'Bearer {token}'}
+        urls = ['/stats/user-balances/{}', '/transactions/{}?limit=20',
+                '/users/authorise-with-token']
+
+        latencies, errors = [], 0
+
+        async def worker(count: int):
+            nonlocal errors
+            for _ in range(count):
+                user_id = rng.choice(list(bearers))
+                url = rng.choice(urls).format(user_id)
+                begin = time.perf_counter()
+                response = await client.get(url, headers=bearers[user_id])
+                latencies.append(time.perf_counter() - begin)
+                errors += response.status_code != 200
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(requests // concurrency)
+                               for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        **latency_summary(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--transactions', type=int, default=200_000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=3200)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    directory = os.path.dirname(use_temporary_database())
+    seed(args.users, args.transactions)
+
+    results = {}
+    for workers in args.workers:
+        server = start(workers, args.port, directory)
+        try:
+            results[workers] = asyncio.run(drive(
+                args.port, args.users, args.concurrency, args.requests))
+        finally:
+            server.terminate()
+            server.wait()
+    single = results[args.workers[0]]['throughput_rps']
+    for result in results.values():
+        result['scaling'] = round(result['throughput_rps'] / single, 2)
+    print(json.dumps({'benchmark': 'workers', 'cpus': os.cpu_count(),
+                      'concurrency': args.concurrency,
+                      'workers': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
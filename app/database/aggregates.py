@@ -0,0 +1,323 @@
+'''
+Precomputed statistics
+
+user_stats keeps per-user account and transaction totals,
+category_month_stats per (user, year, month, category) sums,
+category_day_stats per (user, date, category) income and expense and
+day_stats the same per (date, category) over all users. The write paths
+apply their changes to them in the same database transaction as the
+ledger change itself, so the statistics endpoints read a few rows
+instead of scanning accounts and transactions. The legs of transfers
+are internal moves, neither income nor expense, and are left out.
+
+rebuild_statistics and verify_statistics recompute everything from the
+raw ledger (python -m app.manage rebuild-stats / verify-stats).
+'''
+
+from decimal import Decimal
+
+from sqlalchemy import (
+    case,
+    delete,
+    extract,
+    func,
+    insert,
+    inspect,
+    select,
+    update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .models import (
+    Account,
+    CategoryDayStats,
+    CategoryMonthStats,
+    DayStats,
+    Transaction,
+    UserStats,
+)
+
+UPSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+USER_TOTALS = ['account_total', 'account_count',
+               'transaction_total', 'transaction_count']
+
+# Key and summed columns of the category tables
+SUMMED_TABLES = {
+    CategoryMonthStats: (['user_id', 'year', 'month', 'category'],
+                         ['amount', 'count']),
+    CategoryDayStats: (['user_id', 'date', 'category'],
+                       ['income', 'expense', 'count']),
+    DayStats: (['date', 'category'], ['income', 'expense', 'count']),
+}
+
+
+def _upsert_user_stats(dialect: str):
+    '''Insert user_stats rows, adding to the totals of existing ones'''
+    stmt = UPSERTS[dialect](UserStats)
+    new = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=[UserStats.user_id],
+        set_={
+            **{name: getattr(UserStats, name) + getattr(new, name)
+               for name in USER_TOTALS},
+            'first_date': case(
+                (UserStats.first_date.is_(None), new.first_date),
+                (new.first_date < UserStats.first_date, new.first_date),
+                else_=UserStats.first_date),
+            'last_date': case(
+                (UserStats.last_date.is_(None), new.last_date),
+                (new.last_date > UserStats.last_date, new.last_date),
+                else_=UserStats.last_date),
+        }
+    )
+
+
+def _upsert_summed(dialect: str, model):
+    '''Insert rows of a category table, adding to existing ones'''
+    keys, values = SUMMED_TABLES[model]
+    stmt = UPSERTS[dialect](model)
+    return stmt.on_conflict_do_update(
+        index_elements=[getattr(model, name) for name in keys],
+        set_={name: getattr(model, name) + getattr(stmt.excluded, name)
+              for name in values}
+    )
+
+
+def _user_row(user_id: int, **values) -> dict:
+    row = dict.fromkeys(USER_TOTALS, 0)
+    row.update(user_id=user_id, first_date=None, last_date=None)
+    row.update(values)
+    return row
+
+
+def _add(rows: dict, model, key: tuple, **values) -> None:
+    '''Add values to the row of a category table collected in rows'''
+    keys, names = SUMMED_TABLES[model]
+    row = rows.setdefault(key, {**dict(zip(keys, key)),
+                                **dict.fromkeys(names, 0)})
+    for name, value in values.items():
+        row[name] += value
+
+
+async def apply_account(db, user_id: int, amount: Decimal,
+                        sign: int = 1) -> None:
+    '''Add (sign=1) or remove (sign=-1) an account of the user'''
+    await db.execute(_upsert_user_stats(db.bind.dialect.name),
+                     [_user_row(user_id, account_total=sign * amount,
+                                account_count=sign)])
+
+
+async def apply_balances(db, changes: dict) -> None:
+    '''Add {user_id: amount} to the account totals'''
+    if changes:
+        await db.execute(_upsert_user_stats(db.bind.dialect.name),
+                         [_user_row(user_id, account_total=amount)
+                          for user_id, amount in changes.items()])
+
+
+async def apply_transactions(db, transactions, sign: int = 1) -> None:
+    '''
+    Add (sign=1) or remove (sign=-1) ledger rows
+    ``transactions`` are (user_id, date, category, amount) tuples
+
+    Rows are grouped first, so a bulk insert costs one upsert per user
+    and per row of each category table. Removing rows re-reads the first
+    and last dates of the affected users, hence the ledger change must
+    already be applied to the session.
+    '''
+    users = {}
+    tables = {model: {} for model in SUMMED_TABLES}
+    for user_id, day, category, amount in transactions:
+        row = users.setdefault(user_id, _user_row(
+            user_id, first_date=day, last_date=day))
+        row['transaction_total'] += sign * amount
+        row['transaction_count'] += sign
+        row['first_date'] = min(row['first_date'], day)
+        row['last_date'] = max(row['last_date'], day)
+
+        flow = 'income' if amount >= 0 else 'expense'
+        _add(tables[CategoryMonthStats], CategoryMonthStats,
+             (user_id, day.year, day.month, category),
+             amount=sign * amount, count=sign)
+        _add(tables[CategoryDayStats], CategoryDayStats,
+             (user_id, day, category), **{flow: sign * amount}, count=sign)
+        _add(tables[DayStats], DayStats,
+             (day, category), **{flow: sign * amount}, count=sign)
+    if not users:
+        return
+
+    dialect = db.bind.dialect.name
+    if sign < 0:
+        for row in users.values():
+            row['first_date'] = row['last_date'] = None
+    await db.execute(_upsert_user_stats(dialect), list(users.values()))
+    for model, rows in tables.items():
+        await db.execute(_upsert_summed(dialect, model), list(rows.values()))
+
+    if sign < 0:
+        await db.flush()
+        own = (Transaction.user_id == UserStats.user_id,
+               Transaction.transfer_id.is_(None))
+        await db.execute(
+            update(UserStats)
+            .filter(UserStats.user_id.in_(users))
+            .values(first_date=select(func.min(Transaction.date))
+                    .filter(*own).scalar_subquery(),
+                    last_date=select(func.max(Transaction.date))
+                    .filter(*own).scalar_subquery()))
+
+
+def _ledger_rows(transfers: bool) -> list:
+    '''
+    Criteria of the transactions the statistics count
+    transfers=False for databases from before transfers, whose
+    transactions have no transfer_id column yet.
+    '''
+    criteria = [Transaction.user_id.is_not(None)]
+    if transfers:
+        criteria.append(Transaction.transfer_id.is_(None))
+    return criteria
+
+
+def has_transfers(connection) -> bool:
+    return 'transfer_id' in {column['name'] for column
+                             in inspect(connection).get_columns('transactions')}
+
+
+def ledger_user_statistics(connection, transfers: bool = True) -> dict:
+    '''Compute the user_stats rows from accounts and transactions'''
+    users = {}
+    for user_id, total, count in connection.execute(
+            select(Account.user_id, func.sum(Account.amount), func.count())
+            .filter(Account.user_id.is_not(None))
+            .group_by(Account.user_id)):
+        users[user_id] = _user_row(user_id, account_total=total,
+                                   account_count=count)
+    for user_id, total, count, first, last in connection.execute(
+            select(Transaction.user_id, func.sum(Transaction.amount),
+                   func.count(), func.min(Transaction.date),
+                   func.max(Transaction.date))
+            .filter(*_ledger_rows(transfers))
+            .group_by(Transaction.user_id)):
+        users.setdefault(user_id, _user_row(user_id)).update(
+            transaction_total=total, transaction_count=count,
+            first_date=first, last_date=last)
+    return users
+
+
+def ledger_statistics(model, transfers: bool = True):
+    '''Rows of a category table computed from transactions, in key order'''
+    columns = {
+        'user_id': Transaction.user_id,
+        'date': Transaction.date,
+        'year': extract('year', Transaction.date),
+        'month': extract('month', Transaction.date),
+        'category': Transaction.category,
+    }
+    sums = {
+        'amount': func.sum(Transaction.amount),
+        'income': func.sum(case((Transaction.amount >= 0,
+                                 Transaction.amount), else_=0)),
+        'expense': func.sum(case((Transaction.amount < 0,
+                                  Transaction.amount), else_=0)),
+        'count': func.count(),
+    }
+    keys, values = SUMMED_TABLES[model]
+    key = [columns[name] for name in keys]
+    return (select(*(column.label(name) for name, column
+                     in zip(keys, key)),
+                   *(sums[name].label(name) for name in values))
+            .filter(*_ledger_rows(transfers),
+                    Transaction.date.is_not(None))
+            .group_by(*key)
+            .order_by(*key))
+
+
+def _fill(connection, model, query) -> None:
+    connection.execute(insert(model).from_select(
+        [column.name for column in query.selected_columns], query))
+
+
+def rebuild_statistics(connection, models=None) -> dict:
+    '''
+    Replace the aggregates with values recomputed from the ledger
+    The category tables are filled by INSERT ... SELECT, so the ledger is
+    never loaded into memory. ``models`` limits the rebuild to some of
+    the tables, as a migration step knows only the tables existing then.
+    '''
+    models = models or (UserStats, *SUMMED_TABLES)
+    transfers = has_transfers(connection)
+    for model in models:
+        connection.execute(delete(model))
+        if model is UserStats:
+            users = ledger_user_statistics(connection, transfers)
+            if users:
+                connection.execute(insert(UserStats), list(users.values()))
+        else:
+            _fill(connection, model, ledger_statistics(model, transfers))
+    return {model.__tablename__:
+            connection.execute(select(func.count()).select_from(model))
+            .scalar()
+            for model in models}
+
+
+def _same(stored, expected) -> bool:
+    # Amounts are exact decimals, no tolerance is needed
+    return (stored or 0) == (expected or 0)
+
+
+def _merge(expected, stored, key_names: list):
+    '''Pair up the rows of two key ordered streams'''
+    def key(row):
+        return tuple(row[name] for name in key_names)
+
+    expected, stored = iter(expected), iter(stored)
+    left, right = next(expected, None), next(stored, None)
+    while left is not None or right is not None:
+        if right is None or (left is not None and key(left) < key(right)):
+            yield key(left), left, {}
+            left = next(expected, None)
+        elif left is None or key(right) < key(left):
+            yield key(right), {}, right
+            right = next(stored, None)
+        else:
+            yield key(left), left, right
+            left, right = next(expected, None), next(stored, None)
+
+
+def _compare(drift: list, model, key_names: list, value_names: list,
+             expected, connection) -> None:
+    '''Append the differences between a stored table and its ledger rows'''
+    table = model.__table__
+    stored = connection.execute(
+        select(table).order_by(*(table.c[name] for name in key_names)))
+    for key, expected_row, stored_row in _merge(
+            expected, stored.mappings(), key_names):
+        for name in value_names:
+            if not _same(stored_row.get(name), expected_row.get(name)):
+                drift.append(
+                    f'{model.__tablename__} '
+                    f'{" ".join(str(part) for part in key)}: '
+                    f'{name} is {stored_row.get(name)}, '
+                    f'ledger has {expected_row.get(name)}')
+
+
+def verify_statistics(connection) -> list[str]:
+    '''
+    Describe every difference between the aggregates and the ledger
+    Stored and recomputed rows are streamed side by side in key order.
+    '''
+    drift = []
+    users = ledger_user_statistics(connection)
+    _compare(drift, UserStats, ['user_id'],
+             USER_TOTALS + ['first_date', 'last_date'],
+             [users[user_id] for user_id in sorted(users)], connection)
+    for model, (keys, values) in SUMMED_TABLES.items():
+        _compare(drift, model, keys, values,
+                 connection.execute(ledger_statistics(model)).mappings(),
+                 connection)
+    return drift
@@ -0,0 +1,76 @@
+'''
+Atomic balance changes
+
+A balance is never written back from a value read earlier. Every change
+is one conditional statement evaluated against the current row:
+
+    UPDATE accounts SET amount = amount + :delta
+    WHERE id = :id AND amount + :delta >= 0
+
+so concurrent requests can neither lose an update nor take an account
+below zero. Accounts are updated in id order, two transactions touching
+the same accounts queue on the row locks instead of deadlocking. Paths that
+replace or remove an account take its row lock with lock_account first
+and only then read the amount they take out of the statistics.
+
+The balance update is the first write of every path. A SQLite writer
+that cannot get the database lock within the driver timeout holds no
+lock yet, so the statement is retried with backoff before giving up.
+'''
+
+import asyncio
+from decimal import Decimal
+
+from sqlalchemy import update
+from sqlalchemy.exc import OperationalError
+
+from ..utils.config import settings
+from .models import Account
+
+
+def _is_busy(error: OperationalError) -> bool:
+    return 'database is locked' in str(error.orig)
+
+
+async def _execute_with_retry(db, stmt):
+    for attempt in range(settings.BALANCE_RETRY_ATTEMPTS):
+        try:
+            return await db.execute(stmt)
+        except OperationalError as error:
+            if (not _is_busy(error)
+                    or attempt == settings.BALANCE_RETRY_ATTEMPTS - 1):
+                raise
+            await asyncio.sleep(settings.BALANCE_RETRY_DELAY * 2 ** attempt)
+
+
+async def change_balances(db, changes: dict) -> set:
+    '''
+    Add {account_id: amount} to the balances
+    Returns the ids of the accounts left unchanged because their balance
+    would go below zero; the caller rolls back if it needs all or none.
+    '''
+    refused = set()
+    for account_id in sorted(changes):
+        delta = Decimal(changes[account_id])
+        result = await _execute_with_retry(db, (
+            update(Account)
+            .filter(Account.id == account_id,
+                    Account.amount + delta >= 0)
+            .values(amount=Account.amount + delta)
+            .execution_options(synchronize_session=False)))
+        if result.rowcount != 1:
+            refused.add(account_id)
+    return refused
+
+
+async def lock_account(db, account_id: int) -> None:
+    '''
+    Take the row lock of the account with a no-op update, so no balance
+    change can land between reading the account and writing it back
+    The caller re-reads the account afterwards.
+    '''
+    await _execute_with_retry(db, (
+        update(Account)
+        .filter(Account.id == account_id)
+        .values(amount=Account.amount)
+        .execution_options(synchronize_session=False)))
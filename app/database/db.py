@@ -1,22 +1,156 @@
 '''Making a local database with SQLite'''
 
-from sqlalchemy import create_engine
+import threading
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from ..utils.config import settings
 
 
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+
+def to_async_url(url: str) -> str:
+    '''Swap a blocking DB-API driver in the url for its asyncio counterpart'''
+    parsed = make_url(url)
+    if parsed.drivername in ASYNC_DRIVERS:
+        parsed = parsed.set(drivername=ASYNC_DRIVERS[parsed.drivername])
+    return parsed.render_as_string(hide_password=False)
+
+
+def sqlite_pragmas() -> dict:
+    '''
+    Pragmas of the tuning profile
+    WAL lets readers run beside the writer and, with synchronous=NORMAL,
+    commits without an fsync; a power loss may drop the last commits
+    but never corrupts the database.
+    '''
+    return {
+        'journal_mode': settings.SQLITE_JOURNAL_MODE,
+        'synchronous': settings.SQLITE_SYNCHRONOUS,
+        'busy_timeout': settings.SQLITE_BUSY_TIMEOUT,
+        'cache_size': settings.SQLITE_CACHE_SIZE,
+        'mmap_size': settings.SQLITE_MMAP_SIZE,
+    }
+
+
+def set_sqlite_pragmas(engine, pragmas: dict) -> None:
+    '''Run the pragmas on every new connection of the engine'''
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def engine_options(url: str, asynchronous: bool = False) -> dict:
+    '''Pool and driver arguments of the tuning profile for the url'''
+    parsed = make_url(url)
+    options = {}
+    if parsed.get_backend_name() == 'sqlite':
+        options['connect_args'] = {'check_same_thread': False}
+        if parsed.database in (None, '', ':memory:'):
+            return options
+    elif asynchronous:
+        options['connect_args'] = {'server_settings': {
+            'statement_timeout': str(settings.DB_STATEMENT_TIMEOUT)}}
+    else:
+        options['connect_args'] = {
+            'options': f'-c statement_timeout={settings.DB_STATEMENT_TIMEOUT}'}
+    options.update(
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+    return options
+
+
+def tune(engine) -> None:
+    '''Apply the SQLite pragmas to a blocking or async engine'''
+    sync_engine = getattr(engine, 'sync_engine', engine)
+    if sync_engine.dialect.name == 'sqlite':
+        set_sqlite_pragmas(sync_engine, sqlite_pragmas())
+
+
+ENGINE_NAMES = {'engine', 'session_local', 'async_engine',
+                'async_session_local', 'replica_engine',
+                'replica_session_local'}
+_engines_lock = threading.Lock()
+
+
+def _create_engines() -> dict:
+    '''The engines and session factories, from the settings'''
+    # Blocking engine for startup tasks and command line scripts
+    engine = create_engine(
+        settings.DB_URL,
+        **engine_options(settings.DB_URL)
+    )
+    tune(engine)
+
+    # Engine used by the request handlers
+    async_engine = create_async_engine(
+        to_async_url(settings.DB_URL),
+        **engine_options(settings.DB_URL, asynchronous=True)
+    )
+    tune(async_engine)
+    async_session_local = async_sessionmaker(
+        autoflush=False,
+        expire_on_commit=False,
+        bind=async_engine
+    )
+
+    # Engine of the read-only routes, the primary one without a replica
+    replica_engine = async_engine
+    replica_session_local = async_session_local
+    if settings.DB_REPLICA_URL:
+        replica_engine = create_async_engine(
+            to_async_url(settings.DB_REPLICA_URL),
+            **engine_options(settings.DB_REPLICA_URL, asynchronous=True)
+        )
+        tune(replica_engine)
+        replica_session_local = async_sessionmaker(
+            autoflush=False,
+            expire_on_commit=False,
+            bind=replica_engine,
+            info={'replica': True}
+        )
+
+    return {
+        'engine': engine,
+        'session_local': sessionmaker(
+            autoflush=False,
+            autocommit=False,
+            bind=engine
+        ),
+        'async_engine': async_engine,
+        'async_session_local': async_session_local,
+        'replica_engine': replica_engine,
+        'replica_session_local': replica_session_local,
+    }
+
 
-engine = create_engine(
-    settings.DB_URL,
-    connect_args={'check_same_thread':False}
-)
+def __getattr__(name):
+    '''
+    Build the engines on the first use of one of them
+    Importing this module reads no settings; code running at import time
+    refers to the module, e.g. ``db.async_session_local``, at call time
+    '''
+    if name not in ENGINE_NAMES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    with _engines_lock:
+        if name not in globals():
+            globals().update(_create_engines())
+    return globals()[name]
 
-session_local = sessionmaker(
-    autoflush=False,
-    autocommit=False,
-    bind=engine
-)
 
 Base = declarative_base()
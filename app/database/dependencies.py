@@ -1,10 +1,7 @@
 '''Creating a session with a database connection and closing it when exiting'''
 
-from .db import session_local
+from . import db as engines
 
-def get_db():
-    db = session_local()
-    try:
+async def get_db():
+    async with engines.async_session_local() as db:
         yield db
-    finally:
-        db.close()
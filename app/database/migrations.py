@@ -0,0 +1,210 @@
+'''
+Versioned schema migrations
+
+The applied version is kept in the schema_version table. A fresh database
+is created from the models and stamped with the latest version; an
+existing one runs, in order, every migration newer than its version.
+Databases created before versioning count as version 0. Steps create
+the tables they introduce themselves, never through create_all.
+'''
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+
+from .aggregates import SUMMED_TABLES, rebuild_statistics
+from .models import (
+    MINOR_UNIT_PLACES,
+    Base,
+    CategoryDayStats,
+    CategoryMonthStats,
+    DayStats,
+    UserStats,
+)
+
+MIGRATIONS = []
+
+
+def migration(version: int, description: str):
+    '''Register a migration step'''
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda step: step[0])
+        return func
+    return register
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def _add_column(connection, table_name: str, column_name: str) -> None:
+    '''Add a model column missing from an existing table'''
+    inspector = inspect(connection)
+    if column_name in {column['name']
+                       for column in inspector.get_columns(table_name)}:
+        return
+    column = Base.metadata.tables[table_name].columns[column_name]
+    ddl = (f'ALTER TABLE {table_name} ADD COLUMN {column_name} '
+           f'{column.type.compile(connection.dialect)}')
+    if column.server_default is not None:
+        ddl += f" DEFAULT '{column.server_default.arg}'"
+    if not column.nullable:
+        ddl += ' NOT NULL'
+    connection.execute(text(ddl))
+
+
+def recreate_index(connection, table_name: str, index_name: str) -> None:
+    '''Create a model index, replacing an older index with the same name'''
+    index = next(index for index in Base.metadata.tables[table_name].indexes
+                 if index.name == index_name)
+    index.drop(connection, checkfirst=True)
+    index.create(connection)
+
+
+def rebuild_table(connection, table_name: str, expressions: dict) -> None:
+    '''
+    Recreate a table from its model, copying the rows
+    ``expressions`` maps column names to SQL computing the new value from
+    the old row. This is how SQLite changes the type of a column: a new
+    table is filled, the old one dropped and the new one renamed.
+    '''
+    table = Base.metadata.tables[table_name]
+    new_name = f'_new_{table_name}'
+    ddl = str(CreateTable(table).compile(dialect=connection.dialect))
+    connection.execute(text(ddl.replace(f'CREATE TABLE {table_name} ',
+                                        f'CREATE TABLE {new_name} ', 1)))
+    # Columns added by later migrations start empty
+    existing = {column['name']
+                for column in inspect(connection).get_columns(table_name)}
+    names = [column.name for column in table.columns
+             if column.name in existing]
+    connection.execute(text(
+        f'INSERT INTO {new_name} ({", ".join(names)}) '
+        f'SELECT {", ".join(expressions.get(name, name) for name in names)} '
+        f'FROM {table_name}'))
+    connection.execute(text(f'DROP TABLE {table_name}'))
+    connection.execute(text(f'ALTER TABLE {new_name} RENAME TO {table_name}'))
+    for index in table.indexes:
+        index.create(connection)
+
+
+def _to_minor_units(connection, table_name: str, column_name: str) -> None:
+    '''Turn a float amount column into integer minor units'''
+    minor_units = (f'CAST(round({column_name} * {10 ** MINOR_UNIT_PLACES}) '
+                   'AS BIGINT)')
+    if connection.dialect.name == 'sqlite':
+        rebuild_table(connection, table_name, {column_name: minor_units})
+    else:
+        connection.execute(text(
+            f'ALTER TABLE {table_name} ALTER COLUMN {column_name} '
+            f'TYPE BIGINT USING {minor_units}'))
+
+
+@migration(1, 'users.token_version for token revocation')
+def _token_version(connection):
+    _add_column(connection, 'users', 'token_version')
+
+
+def _check_unique_logins(connection) -> None:
+    '''Refuse to build the unique login index over duplicate logins'''
+    duplicates = connection.execute(text(
+        'SELECT login, count(*) FROM users GROUP BY login '
+        'HAVING count(*) > 1 ORDER BY login')).all()
+    if duplicates:
+        listed = ', '.join(f'{login!r} x{count}'
+                           for login, count in duplicates)
+        raise RuntimeError(
+            f'users.login must be unique, rename or delete the duplicates '
+            f'before migrating: {listed}')
+
+
+@migration(2, 'indexes for per-user lookups, unique login')
+def _hot_query_indexes(connection):
+    _check_unique_logins(connection)
+    recreate_index(connection, 'users', 'ix_users_login')
+    recreate_index(connection, 'accounts', 'ix_accounts_user_id')
+    recreate_index(connection, 'transactions', 'ix_transactions_user_date')
+    recreate_index(connection, 'transactions', 'ix_transactions_account_id')
+
+
+@migration(3, 'index for (date, id) pages over all transactions')
+def _transaction_pages_index(connection):
+    recreate_index(connection, 'transactions', 'ix_transactions_date')
+
+
+@migration(4, 'precomputed user and category/month statistics')
+def _statistics_tables(connection):
+    # Filled by migration 5 together with the tables it adds
+    for table_name in ('user_stats', 'category_month_stats'):
+        Base.metadata.tables[table_name].create(connection, checkfirst=True)
+
+
+@migration(5, 'precomputed category/day statistics for time series')
+def _daily_statistics_table(connection):
+    Base.metadata.tables['category_day_stats'].create(connection,
+                                                      checkfirst=True)
+    rebuild_statistics(connection, (UserStats, CategoryMonthStats,
+                                    CategoryDayStats))
+
+
+@migration(6, 'precomputed all-user day statistics for admin analytics')
+def _analytics_statistics(connection):
+    Base.metadata.tables['day_stats'].create(connection, checkfirst=True)
+    recreate_index(connection, 'category_day_stats',
+                   'ix_category_day_stats_date')
+    rebuild_statistics(connection, (DayStats,))
+
+
+@migration(7, 'amounts as integer minor units')
+def _integer_money(connection):
+    _to_minor_units(connection, 'accounts', 'amount')
+    _to_minor_units(connection, 'transactions', 'amount')
+    # The aggregates are recreated with integer columns and recomputed
+    for model in (UserStats, *SUMMED_TABLES):
+        model.__table__.drop(connection)
+        model.__table__.create(connection)
+    rebuild_statistics(connection)
+
+
+@migration(8, 'transfers and the transfer_id of their legs')
+def _transfers(connection):
+    Base.metadata.tables['transfers'].create(connection, checkfirst=True)
+    _add_column(connection, 'transactions', 'transfer_id')
+
+
+def current_version(connection) -> int | None:
+    '''Applied version, None for an empty database'''
+    inspector = inspect(connection)
+    if inspector.has_table('schema_version'):
+        return connection.execute(
+            text('SELECT version FROM schema_version')).scalar() or 0
+    if inspector.has_table('users'):
+        return 0
+    return None
+
+
+def _stamp(connection, version: int) -> None:
+    connection.execute(text('DELETE FROM schema_version'))
+    connection.execute(text('INSERT INTO schema_version (version) '
+                            'VALUES (:version)'), {'version': version})
+
+
+def upgrade(engine) -> int:
+    '''Bring the database to the latest version, return that version'''
+    with engine.begin() as connection:
+        version = current_version(connection)
+        connection.execute(text('CREATE TABLE IF NOT EXISTS schema_version '
+                                '(version INTEGER NOT NULL)'))
+        if version is None:
+            Base.metadata.create_all(connection)
+            _stamp(connection, latest_version())
+            return latest_version()
+
+    for step_version, _, step in MIGRATIONS:
+        if step_version <= version:
+            continue
+        with engine.begin() as connection:
+            step(connection)
+            _stamp(connection, step_version)
+        version = step_version
+    return version
@@ -1,18 +1,56 @@
 '''Data schemas for working with SQLite based on schemas in .schemas'''
 
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, Boolean
+from decimal import ROUND_HALF_EVEN, Decimal
+
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    Date,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    TypeDecorator,
+)
 from sqlalchemy.orm import relationship
 
 from .db import Base
 
+# Money is kept in hundredths (kopecks, cents)
+MINOR_UNIT_PLACES = 2
+
+
+class Money(TypeDecorator):
+    '''
+    Decimal amount stored as an integer number of minor units
+    Sums and comparisons in SQL stay exact integer arithmetic.
+    '''
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return int(Decimal(str(value)).scaleb(MINOR_UNIT_PLACES)
+                   .to_integral_value(ROUND_HALF_EVEN))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return Decimal(int(value)).scaleb(-MINOR_UNIT_PLACES)
+
+
 class User(Base):
     __tablename__ = 'users'
     __table_args__ = {'extend_existing': True}
 
     id = Column(Integer, primary_key=True, index=True)
-    login = Column(String, index=True)
+    login = Column(String, index=True, unique=True)
     is_admin = Column(Boolean)
     password = Column(String)
+    token_version = Column(Integer, default=0, server_default='0',
+                           nullable=False)
 
 class Account(Base):
     __tablename__ = 'accounts'
@@ -20,19 +58,87 @@ class Account(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     account_name = Column(String)
-    amount = Column(Float)
-    user_id = Column(Integer, ForeignKey('users.id'))
-    user = relationship('User')
+    amount = Column(Money)
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
+    user = relationship('User', lazy='selectin')
 
 class Transaction(Base):
     __tablename__ = 'transactions'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        # Per-user history, date ranges and (date, id) ordering
+        Index('ix_transactions_user_date', 'user_id', 'date', 'id'),
+        # (date, id) ordered pages over all users
+        Index('ix_transactions_date', 'date', 'id'),
+        {'extend_existing': True},
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     category = Column(String)
-    amount = Column(Float)
+    amount = Column(Money)
     date = Column(Date)
     user_id = Column(Integer, ForeignKey('users.id'))
-    user = relationship('User')
-    account_id = Column(Integer, ForeignKey('accounts.id'))
-    account = relationship('Account')
+    user = relationship('User', lazy='selectin')
+    account_id = Column(Integer, ForeignKey('accounts.id'), index=True)
+    account = relationship('Account', lazy='selectin')
+    # Set on both legs of a transfer, which the statistics leave out
+    transfer_id = Column(Integer, ForeignKey('transfers.id'))
+
+class Transfer(Base):
+    __tablename__ = 'transfers'
+    __table_args__ = {'extend_existing': True}
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
+    from_account_id = Column(Integer, ForeignKey('accounts.id'))
+    to_account_id = Column(Integer, ForeignKey('accounts.id'))
+    amount = Column(Money, nullable=False)
+    date = Column(Date)
+
+
+class UserStats(Base):
+    __tablename__ = 'user_stats'
+    __table_args__ = {'extend_existing': True}
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    account_total = Column(Money, nullable=False, default=0)
+    account_count = Column(Integer, nullable=False, default=0)
+    transaction_total = Column(Money, nullable=False, default=0)
+    transaction_count = Column(Integer, nullable=False, default=0)
+    first_date = Column(Date)
+    last_date = Column(Date)
+
+class CategoryMonthStats(Base):
+    __tablename__ = 'category_month_stats'
+    __table_args__ = {'extend_existing': True}
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    category = Column(String, primary_key=True)
+    amount = Column(Money, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
+
+class CategoryDayStats(Base):
+    __tablename__ = 'category_day_stats'
+    __table_args__ = (
+        # Date ranges over all users, covering for the top spenders
+        Index('ix_category_day_stats_date', 'date', 'user_id', 'expense'),
+        {'extend_existing': True},
+    )
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    date = Column(Date, primary_key=True)
+    category = Column(String, primary_key=True)
+    income = Column(Money, nullable=False, default=0)
+    expense = Column(Money, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
+
+class DayStats(Base):
+    __tablename__ = 'day_stats'
+    __table_args__ = {'extend_existing': True}
+
+    date = Column(Date, primary_key=True)
+    category = Column(String, primary_key=True)
+    income = Column(Money, nullable=False, default=0)
+    expense = Column(Money, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,63 @@
+'''
+Routing of the read-only routes to the replica
+
+Writes always go to the primary session of get_db. The statistics and
+list routes take get_read_db instead, a session of DB_REPLICA_URL, so a
+replica that lags behind the primary may return data a moment old.
+With READ_YOUR_WRITES_SECONDS set, a user whose request committed on the
+primary reads from the primary for that many seconds afterwards and sees
+their own write at once, whichever worker served the write: the time of
+the last write is kept in the shared state.
+'''
+
+import time
+
+from fastapi import Depends
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..utils.authorisation import CurrentPrincipal, Principal
+from ..utils.config import settings
+from ..utils.shared_state import shared_state
+from . import db as engines
+from .dependencies import get_db
+
+
+def writer_key(user_id: int) -> str:
+    return f'wrote:{user_id}'
+
+
+@event.listens_for(Session, 'after_commit')
+def _remember_writer(session):
+    # get_current_principal tags the primary session of the request
+    principal_id = session.info.get('principal_id')
+    if principal_id is not None and settings.READ_YOUR_WRITES_SECONDS > 0:
+        shared_state.set(writer_key(principal_id), time.time())
+
+
+def is_replica(db) -> bool:
+    '''Whether the session reads from the replica'''
+    return bool(db.info.get('replica'))
+
+
+def read_sessionmaker(principal: Principal):
+    '''Sessions of the replica, of the primary right after an own write'''
+    if settings.READ_YOUR_WRITES_SECONDS > 0:
+        wrote_at = shared_state.get(writer_key(principal.id))
+        if (wrote_at is not None
+                and wrote_at + settings.READ_YOUR_WRITES_SECONDS > time.time()):
+            return engines.async_session_local
+    return engines.replica_session_local
+
+
+async def get_read_db(principal: CurrentPrincipal,
+                      db: AsyncSession = Depends(get_db)):
+    # Reads from the primary share the session of the request, a second
+    # one would hold a second pooled connection for the same request
+    session_factory = read_sessionmaker(principal)
+    if session_factory is engines.async_session_local:
+        yield db
+        return
+    async with session_factory() as read_db:
+        yield read_db
@@ -1,13 +1,49 @@
 '''Starting service'''
 
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+
+from .database import db as engines
+from .database.migrations import upgrade
+from .middleware.idempotency import IdempotencyMiddleware
+from .middleware.metrics import MetricsMiddleware
+from .utils.config import settings
+from .utils.metrics import instrument_engine
+from .utils.rate_limit import limit_client
+from .routes import (
+    account,
+    analytics,
+    greeting,
+    statistic,
+    transaction,
+    transfer,
+    user,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    '''
+    Bring the schema up to date before serving, close the pools after
+    Importing this module reads no settings and touches neither the
+    database nor argon2: the engines and stores are built on first use.
+    The administrator is created once by `python -m app.manage create-admin`
+    '''
+    if settings.DB_UPGRADE_ON_STARTUP:
+        await run_in_threadpool(upgrade, engines.engine)
+    yield
+    for request_engine in {engines.async_engine, engines.replica_engine}:
+        await request_engine.dispose()
+    engines.engine.dispose()
 
-from .database.db import engine
-from .database.models import Base
-from .utils.init_admin import create_admin
-from .routes import account, greeting, statistic, transaction, user
 
 app = FastAPI(
+    lifespan=lifespan,
+    # Runs before the dependencies of every route, authentication included
+    dependencies=[Depends(limit_client)],
     title="Система управления финансами",
     description="Простейшая система управления финансами, основанная на "
                 "фреймворке FastAPI. Дает возможность как вести запись "
@@ -21,14 +57,16 @@ app = FastAPI(
 )
 
 
-Base.metadata.create_all(bind=engine)
-
-
-create_admin()
-
-
 app.include_router(greeting.router)
 app.include_router(user.router)
 app.include_router(account.router)
 app.include_router(transaction.router)
+app.include_router(transfer.router)
 app.include_router(statistic.router)
+app.include_router(analytics.router)
+
+app.add_middleware(IdempotencyMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+# Every engine, they are built on first use
+instrument_engine(Engine)
@@ -0,0 +1,123 @@
+'''
+Maintenance commands
+
+    python -m app.manage serve --workers 4
+    python -m app.manage migrate
+    python -m app.manage create-admin
+    python -m app.manage rebuild-stats
+    python -m app.manage verify-stats
+'''
+
+import argparse
+import os
+import sys
+
+# Settings of the stores the workers have to share
+SHARED_BACKENDS = ('STATS_CACHE_BACKEND', 'IDEMPOTENCY_BACKEND',
+                   'SHARED_STATE_BACKEND', 'RATE_LIMIT_BACKEND')
+
+
+def migrate(args) -> None:
+    '''Bring the database schema to the latest version'''
+    from .database.db import engine
+    from .database.migrations import upgrade
+
+    try:
+        print(f'schema version: {upgrade(engine)}')
+    except RuntimeError as error:
+        sys.exit(f'migration failed: {error}')
+
+
+def create_admin(args) -> None:
+    '''Create the administrator from DB_USER and DB_PASSWORD if missing'''
+    from .utils.config import settings
+    from .utils.init_admin import create_admin as create
+
+    if create():
+        print(f'administrator {settings.DB_USER} created')
+    else:
+        print(f'administrator {settings.DB_USER} already exists')
+
+
+def rebuild_stats(args) -> None:
+    '''Recompute the precomputed statistics from the ledger'''
+    from .database.aggregates import rebuild_statistics
+    from .database.db import engine
+
+    with engine.begin() as connection:
+        counts = rebuild_statistics(connection)
+    for table_name, count in counts.items():
+        print(f'{table_name}: {count} rows')
+
+
+def verify_stats(args) -> None:
+    '''Compare the precomputed statistics with the ledger'''
+    from .database.aggregates import verify_statistics
+    from .database.db import engine
+
+    with engine.connect() as connection:
+        drift = verify_statistics(connection)
+    for line in drift:
+        print(line)
+    print(f'drift: {len(drift)}')
+    if drift:
+        sys.exit(1)
+
+
+def worker_environment(workers: int) -> dict:
+    '''
+    Environment of the served workers
+    They skip the migrations done by serve, and with several of them the
+    in-process memory stores are replaced by the shared sqlite ones
+    '''
+    from .utils.config import settings
+
+    environment = {'DB_UPGRADE_ON_STARTUP': 'false'}
+    if workers > 1:
+        for name in SHARED_BACKENDS:
+            if getattr(settings, name) == 'memory':
+                environment[name] = 'sqlite'
+    return environment
+
+
+def serve(args) -> None:
+    '''Migrate and create the administrator once, then start the workers'''
+    import uvicorn
+
+    migrate(args)
+    create_admin(args)
+    environment = worker_environment(args.workers)
+    for name, value in environment.items():
+        if name != 'DB_UPGRADE_ON_STARTUP':
+            print(f'{name}={value}, shared by the workers')
+    os.environ.update(environment)
+    uvicorn.run('app.main:app', host=args.host, port=args.port,
+                workers=args.workers)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog='python -m app.manage',
+                                     description='Maintenance commands')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serving = commands.add_parser('serve', help=serve.__doc__)
+    serving.add_argument('--host', default='127.0.0.1')
+    serving.add_argument('--port', type=int, default=8000)
+    serving.add_argument('--workers', type=int, default=1)
+    serving.set_defaults(handler=serve)
+
+    commands.add_parser('migrate', help=migrate.__doc__).set_defaults(
+        handler=migrate)
+    commands.add_parser('create-admin', help=create_admin.__doc__) \
+        .set_defaults(handler=create_admin)
+    commands.add_parser('rebuild-stats', help=rebuild_stats.__doc__) \
+        .set_defaults(handler=rebuild_stats)
+    commands.add_parser('verify-stats', help=verify_stats.__doc__) \
+        .set_defaults(handler=verify_stats)
+
+    args = parser.parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+'''
+Idempotency-Key support for the create and update endpoints
+
+A POST, PUT or PATCH carrying an Idempotency-Key header runs once; its
+response is stored and every retry with the same key gets that response
+back without reaching the application, so no authorisation, validation
+or balance update runs again. Keys are scoped by a hash of the
+Authorization header, a retry has to present the same credentials.
+
+While the first request runs, its key holds a pending entry: a
+concurrent retry gets 409, a retry with the same key but another method,
+path or body gets 422. Server errors, refused credentials and rate
+limited requests are not stored, the request can then be retried.
+Entries expire after IDEMPOTENCY_TTL seconds; pending ones left by a
+crashed worker count as abandoned after IDEMPOTENCY_LOCK_TTL seconds.
+'''
+
+import base64
+import hashlib
+import json
+import time
+
+from ..utils.config import Lazy, settings
+from ..utils.response_cache import create_backend
+
+METHODS = {'POST', 'PUT', 'PATCH'}
+HEADER = b'idempotency-key'
+MAX_KEY_LENGTH = 255
+# Responses telling the client to try again, with other credentials or later
+RETRYABLE = {401, 429}
+
+
+def _hash(*parts: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+
+def entry_key(authorization: bytes, key: bytes) -> str:
+    '''Key of the stored response of a request'''
+    return 'idempotency:' + _hash(authorization, key)
+
+
+async def _send_json(send, status: int, detail: str) -> None:
+    body = json.dumps({'detail': detail}).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class IdempotencyStore:
+    '''Backend with stored, replayed and conflicting request counters'''
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.stored = 0
+        self.replays = 0
+        self.conflicts = 0
+
+    def stats(self) -> dict:
+        return {
+            'backend': self.backend.kind,
+            'size': len(self.backend),
+            'stored': self.stored,
+            'replays': self.replays,
+            'conflicts': self.conflicts,
+        }
+
+
+idempotency_store = IdempotencyStore(Lazy(lambda: create_backend(
+    settings.IDEMPOTENCY_BACKEND, settings.IDEMPOTENCY_SIZE,
+    settings.IDEMPOTENCY_TTL, settings.IDEMPOTENCY_PATH)))
+
+
+class IdempotencyMiddleware:
+    '''Pure ASGI middleware, the response body is never re-encoded'''
+
+    def __init__(self, app, store: IdempotencyStore = idempotency_store):
+        self.app = app
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] not in METHODS:
+            return await self.app(scope, receive, send)
+        headers = dict(scope['headers'])
+        key = headers.get(HEADER)
+        if key is None:
+            return await self.app(scope, receive, send)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return await _send_json(send, 400, 'Invalid Idempotency-Key')
+
+        messages, body = [], b''
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message['type'] != 'http.request':
+                break
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        cache_key = entry_key(headers.get(b'authorization', b''), key)
+        fingerprint = _hash(scope['method'].encode(),
+                            scope['path'].encode(),
+                            scope['query_string'], body)
+
+        backend = self.store.backend
+        if not backend.add(cache_key, {'fingerprint': fingerprint,
+                                       'pending': time.time()}):
+            entry = backend.get(cache_key)
+            if entry is None or (
+                    'pending' in entry
+                    and entry['pending'] + settings.IDEMPOTENCY_LOCK_TTL
+                    < time.time()):
+                # Expired meanwhile, or abandoned by its request
+                backend.set(cache_key, {'fingerprint': fingerprint,
+                                        'pending': time.time()})
+            elif entry['fingerprint'] != fingerprint:
+                self.store.conflicts += 1
+                return await _send_json(
+                    send, 422, 'The Idempotency-Key was used for '
+                               'another request')
+            elif 'pending' in entry:
+                self.store.conflicts += 1
+                return await _send_json(
+                    send, 409, 'A request with this Idempotency-Key '
+                               'is in progress')
+            else:
+                self.store.replays += 1
+                return await self._replay(entry['response'], send)
+
+        async def replay_receive():
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        response = {'status': 500, 'headers': [], 'body': b''}
+        complete = False
+
+        async def record_send(message):
+            nonlocal complete
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = [
+                    [name.decode('latin-1'), value.decode('latin-1')]
+                    for name, value in message.get('headers', [])]
+            elif message['type'] == 'http.response.body':
+                response['body'] += message.get('body', b'')
+                complete = not message.get('more_body')
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, record_send)
+        finally:
+            if (complete and response['status'] < 500
+                    and response['status'] not in RETRYABLE):
+                response['body'] = base64.b64encode(
+                    response['body']).decode()
+                backend.set(cache_key, {'fingerprint': fingerprint,
+                                        'response': response})
+                self.store.stored += 1
+            else:
+                backend.delete([cache_key])
+
+    @staticmethod
+    async def _replay(response: dict, send) -> None:
+        await send({'type': 'http.response.start',
+                    'status': response['status'],
+                    'headers': [(name.encode('latin-1'),
+                                 value.encode('latin-1'))
+                                for name, value in response['headers']]
+                    + [(b'idempotent-replayed', b'true')]})
+        await send({'type': 'http.response.body',
+                    'body': base64.b64decode(response['body'])})
@@ -0,0 +1,41 @@
+'''
+Per-route latency, statement count and SQL time of every request
+
+Pure ASGI middleware; the route label is the template of the matched
+route, e.g. /accounts/{user_id}, so the number of series stays bounded.
+Registered last, it also times the responses replayed by the
+idempotency middleware.
+'''
+
+import time
+
+from ..utils.metrics import UNMATCHED_ROUTE, Metrics, metrics
+
+
+class MetricsMiddleware:
+
+    def __init__(self, app, registry: Metrics = metrics):
+        self.app = app
+        self.metrics = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.metrics.enabled:
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def record_send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        token = self.metrics.start_request()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, record_send)
+        finally:
+            # The router stores the matched route in the shared scope
+            route = getattr(scope.get('route'), 'path', UNMATCHED_ROUTE)
+            self.metrics.finish_request(token, scope['method'], route,
+                                        status, time.perf_counter() - started)
@@ -1,21 +1,24 @@
 """Processing requests from /accounts/."""
 from typing import Annotated, List
 
-from fastapi import APIRouter, Depends, Path
-from fastapi.security import HTTPBasicCredentials
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Path, Query, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 from starlette.status import HTTP_201_CREATED
 
+from ..database.aggregates import apply_account
+from ..database.balances import lock_account
 from ..database.dependencies import get_db
 from ..database.models import Account
-from ..schemas.account import AccountCreate, AccountResponse
-from ..utils.authorisation_password import (
-    get_current_user_with_login_and_password,
-    security,
-)
+from ..database.replica import get_read_db
+from ..schemas.account import AccountCompact, AccountCreate, AccountResponse
+from ..schemas.pagination import ViewPageQuery
+from ..utils.authorisation import CurrentPrincipal
+from ..utils.pagination import finish_page, paginate
+from ..utils.response_cache import invalidate_statistics
 from ..utils.users_rights import (
     check_account_exists,
-    check_admin_rights,
     check_user_exists,
     check_user_rights,
     http_wrong_rights,
@@ -24,26 +27,47 @@ from ..utils.users_rights import (
 
 router = APIRouter(prefix="/accounts", tags=["accounts"])
 
+ACCOUNT_PAGE_KEY = [Account.id]
+
+# Full pages load the holder in the same statement,
+# compact pages select flat columns only
+ACCOUNT_FULL_LOAD = (joinedload(Account.user),)
+ACCOUNT_COMPACT_COLUMNS = [
+    Account.id,
+    Account.account_name,
+    Account.amount,
+    Account.user_id,
+]
+
+
+async def accounts_page(page: ViewPageQuery, response: Response,
+                        db: AsyncSession, *criteria) -> list:
+    """Load one id ordered page of accounts in one statement."""
+    compact = page.view == 'compact'
+    if compact:
+        query = select(*ACCOUNT_COMPACT_COLUMNS)
+    else:
+        query = select(Account).options(*ACCOUNT_FULL_LOAD)
+    result = await db.execute(
+        paginate(query.filter(*criteria), ACCOUNT_PAGE_KEY, page))
+    items = result.all() if compact else result.scalars().all()
+    return finish_page(items, ACCOUNT_PAGE_KEY, page, response)
+
 
 @router.post('/',
              response_model=AccountResponse,
              status_code=HTTP_201_CREATED,
              summary='Create a new account for a registered user')
 async def create_accounts(
-    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    principal: CurrentPrincipal,
     account: AccountCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> AccountResponse:
     """Create a new account for a registered user."""
-    db_user = check_user_exists(account.user_id, db)
-    is_admin_id(account.user_id, db)
-
-    check_user_rights(
-        db,
-        db_user,
-        credentials.username,
-        credentials.password
-    )
+    db_user = await check_user_exists(account.user_id, db)
+    await is_admin_id(account.user_id, db)
+
+    check_user_rights(principal, db_user)
 
     db_account = Account(
         account_name=account.account_name,
@@ -52,104 +76,107 @@ async def create_accounts(
         user_id=db_user.id
     )
     db.add(db_account)
-    db.commit()
-    db.refresh(db_account)
+    await apply_account(db, db_user.id, account.amount)
+    await db.commit()
+    invalidate_statistics(db_user.id, [])
+    await db.refresh(db_account)
     return db_account
 
 
 @router.get('/get-all',
-            response_model=List[AccountResponse],
+            response_model=List[AccountResponse] | List[AccountCompact],
             summary='Get all accounts (admin only)')
 async def get_accounts(
-    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
-    db: Session = Depends(get_db)
+    principal: CurrentPrincipal,
+    page: Annotated[ViewPageQuery, Query()],
+    response: Response,
+    db: AsyncSession = Depends(get_read_db)
 ) -> List[AccountResponse]:
-    """Only for admin. Retrieve a list of all accounts."""
-    if check_admin_rights(
-        credentials.username,
-        credentials.password
-    ):
-        return db.query(Account).all()
+    """
+    Only for admin. Retrieve a page of all accounts.
+
+    view=compact returns the holder's id instead of the nested user.
+    """
+    if principal.is_admin:
+        return await accounts_page(page, response, db)
 
     raise http_wrong_rights
 
 
 @router.get('/{user_id}',
-            response_model=List[AccountResponse],
+            response_model=List[AccountResponse] | List[AccountCompact],
             summary='Get all accounts by user_id (user_id = 0 for own)')
 async def get_accounts_by_id(
-    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    principal: CurrentPrincipal,
+    page: Annotated[ViewPageQuery, Query()],
+    response: Response,
     user_id: int = Path(
         ...,
         description="User ID to get accounts", ge=0
     ),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ) -> List[AccountResponse]:
     """
     Only for admin.
     Retrieve a list of user's accounts.
 
     user_id == 0 for own accounts.
+    view=compact returns the holder's id instead of the nested user.
     """
-    current_user = get_current_user_with_login_and_password(db,
-                                                            credentials.username,
-                                                            credentials.password)
     if user_id == 0:
-        user_id = current_user.id
+        user_id = principal.id
     else:
-        db_user = check_user_exists(user_id, db)
-        check_user_rights(
-            db,
-            db_user,
-            credentials.username,
-            credentials.password
-        )
+        db_user = await check_user_exists(user_id, db)
+        check_user_rights(principal, db_user)
 
-    return db.query(Account).filter(Account.user_id == user_id).all()
+    return await accounts_page(page, response, db,
+                               Account.user_id == user_id)
 
 
 @router.delete('/{account_id}', response_model=AccountResponse)
 async def delete_account(
-    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    principal: CurrentPrincipal,
     account_id: int = Path(..., description="Account ID to delete", ge=1),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> AccountResponse:
     """Delete an account by its ID."""
-    db_account = check_account_exists(account_id, db)
-    db_user = check_user_exists(db_account.user_id, db)
-
-    check_user_rights(
-        db,
-        db_user,
-        credentials.username,
-        credentials.password
-    )
-
-    db.delete(db_account)
-    db.commit()
+    db_account = await check_account_exists(account_id, db)
+    db_user = await check_user_exists(db_account.user_id, db)
+
+    check_user_rights(principal, db_user)
+
+    # The amount read above may be older than a balance change since
+    await lock_account(db, account_id)
+    await db.refresh(db_account)
+    await db.delete(db_account)
+    await apply_account(db, db_account.user_id, db_account.amount, sign=-1)
+    await db.commit()
+    invalidate_statistics(db_account.user_id, [])
     return db_account
 
 
 @router.put('/{account_id}', response_model=AccountResponse)
 async def change_account(
-    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    principal: CurrentPrincipal,
     account: AccountCreate,
     account_id: int = Path(..., description="Account ID to change", ge=1),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> AccountResponse:
     """Update an existing account's details by ID."""
-    db_account = check_account_exists(account_id, db)
-    db_user = check_user_exists(db_account.user_id, db)
-
-    check_user_rights(
-        db,
-        db_user,
-        credentials.username,
-        credentials.password
-    )
+    db_account = await check_account_exists(account_id, db)
+    db_user = await check_user_exists(db_account.user_id, db)
+
+    check_user_rights(principal, db_user)
+    # The amount read above may be older than a balance change since
+    await lock_account(db, account_id)
+    await db.refresh(db_account)
+    await apply_account(db, db_account.user_id, db_account.amount, sign=-1)
+    await apply_account(db, account.user_id, account.amount)
     db_account.account_name = account.account_name
     db_account.amount = account.amount
     db_account.user_id = account.user_id
-    db.commit()
-    db.refresh(db_account)
+    await db.commit()
+    invalidate_statistics(db_user.id, [])
+    invalidate_statistics(account.user_id, [])
+    await db.refresh(db_account)
     return db_account
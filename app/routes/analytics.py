@@ -0,0 +1,153 @@
+"""Processing requests from /analytics/."""
+from typing import Annotated, List
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database.models import CategoryDayStats, DayStats, User
+from ..database.replica import get_read_db
+from ..schemas.analytics import (
+    AnalyticsQuery,
+    CategoryShare,
+    DailyVolume,
+    TopSpendersQuery,
+    UserSpending,
+)
+from ..utils.authorisation import CurrentPrincipal
+from ..utils.users_rights import http_wrong_rights
+
+router = APIRouter(prefix="/analytics", tags=["analytics"])
+
+
+def in_range(query, model, analytics: AnalyticsQuery):
+    """Apply the date range of an analytics request."""
+    if analytics.date_from is not None:
+        query = query.filter(model.date >= analytics.date_from)
+    if analytics.date_to is not None:
+        query = query.filter(model.date <= analytics.date_to)
+    return query
+
+
+def top_spenders_statement(analytics: TopSpendersQuery):
+    """Users with the largest expenses, from category_day_stats."""
+    expense = func.sum(CategoryDayStats.expense)
+    spenders = in_range(
+        select(CategoryDayStats.user_id, expense.label('expense')),
+        CategoryDayStats, analytics
+    ).group_by(
+        CategoryDayStats.user_id
+    ).having(
+        expense < 0
+    ).order_by(
+        expense, CategoryDayStats.user_id
+    ).limit(analytics.limit).subquery()
+    return select(
+        spenders.c.user_id, User.login, spenders.c.expense
+    ).outerjoin(
+        User, User.id == spenders.c.user_id
+    ).order_by(spenders.c.expense, spenders.c.user_id)
+
+
+def categories_statement(analytics: AnalyticsQuery):
+    """Totals per category over all users, from day_stats."""
+    return in_range(select(
+        DayStats.category,
+        func.sum(DayStats.income).label('income'),
+        func.sum(DayStats.expense).label('expense'),
+        func.sum(DayStats.count).label('count')
+    ), DayStats, analytics).group_by(
+        DayStats.category
+    ).having(
+        func.sum(DayStats.count) > 0
+    ).order_by(DayStats.category)
+
+
+def daily_volume_statement(analytics: AnalyticsQuery):
+    """Totals per day over all users, from day_stats."""
+    return in_range(select(
+        DayStats.date,
+        func.sum(DayStats.income).label('income'),
+        func.sum(DayStats.expense).label('expense'),
+        func.sum(DayStats.count).label('count')
+    ), DayStats, analytics).group_by(
+        DayStats.date
+    ).having(
+        func.sum(DayStats.count) > 0
+    ).order_by(DayStats.date)
+
+
+@router.get('/top-spenders', response_model=List[UserSpending])
+async def get_top_spenders(
+    principal: CurrentPrincipal,
+    analytics: Annotated[TopSpendersQuery, Query()],
+    db: AsyncSession = Depends(get_read_db)
+) -> List[UserSpending]:
+    """
+    Only for admin. Users with the largest expenses in the range.
+
+    One grouped statement over the precomputed per-user daily totals.
+    """
+    if not principal.is_admin:
+        raise http_wrong_rights
+
+    return [
+        UserSpending(user_id=row.user_id, login=row.login,
+                     expense=row.expense)
+        for row in await db.execute(top_spenders_statement(analytics))
+    ]
+
+
+@router.get('/categories', response_model=List[CategoryShare])
+async def get_categories(
+    principal: CurrentPrincipal,
+    analytics: Annotated[AnalyticsQuery, Query()],
+    db: AsyncSession = Depends(get_read_db)
+) -> List[CategoryShare]:
+    """
+    Only for admin. Distribution of the turnover over the categories.
+
+    One grouped statement over the precomputed all-user daily totals.
+    """
+    if not principal.is_admin:
+        raise http_wrong_rights
+
+    rows = (await db.execute(categories_statement(analytics))).all()
+    turnover = sum(row.income - row.expense for row in rows)
+    return [
+        CategoryShare(
+            category=row.category,
+            income=row.income,
+            expense=row.expense,
+            net=row.income + row.expense,
+            count=row.count,
+            share=(row.income - row.expense) / turnover if turnover else 0.0
+        )
+        for row in rows
+    ]
+
+
+@router.get('/daily-volume', response_model=List[DailyVolume])
+async def get_daily_volume(
+    principal: CurrentPrincipal,
+    analytics: Annotated[AnalyticsQuery, Query()],
+    db: AsyncSession = Depends(get_read_db)
+) -> List[DailyVolume]:
+    """
+    Only for admin. Number and sums of the transactions of every day.
+
+    One grouped statement over the precomputed all-user daily totals.
+    """
+    if not principal.is_admin:
+        raise http_wrong_rights
+
+    return [
+        DailyVolume(
+            date=row.date,
+            income=row.income,
+            expense=row.expense,
+            net=row.income + row.expense,
+            count=row.count
+        )
+        for row in await db.execute(daily_volume_statement(analytics))
+    ]
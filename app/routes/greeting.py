@@ -1,10 +1,51 @@
-from fastapi import APIRouter
+import os
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from ..middleware.idempotency import idempotency_store
+from ..utils.authorisation_password import password_service
+from ..utils.metrics import metrics
+from ..utils.response_cache import stats_cache
 
 
 router = APIRouter()
 
+http_metrics_disabled = HTTPException(
+    status_code=404,
+    detail='Metrics are disabled, set METRICS_ENABLED'
+)
+
 
 @router.get('/', summary='The view for opening the root')
 def hello_func():
     '''The output of the inscription 'Hello!' when opening the root'''
     return('Hello!')
+
+
+@router.get('/status', summary='Load of the password hashing pool, '
+                               'the statistics cache and the '
+                               'idempotency store')
+def status_func():
+    '''
+    Queue depth and counters of the argon2 worker pool,
+    hits, misses and evictions of the statistics cache,
+    stored and replayed responses of the idempotency store,
+    all counted by the worker process with the given pid
+    '''
+    return {'worker': os.getpid(),
+            'password_service': password_service.stats(),
+            'stats_cache': stats_cache.stats(),
+            'idempotency': idempotency_store.stats()}
+
+
+@router.get('/metrics', response_class=PlainTextResponse,
+            summary='Request, SQL and password hashing metrics')
+def metrics_func():
+    '''
+    Latency histograms per route, statements and SQL time per request,
+    argon2 call durations, in the Prometheus text format
+    '''
+    if not metrics.enabled:
+        raise http_metrics_disabled
+    return metrics.render()
@@ -2,117 +2,203 @@
 from datetime import date
 from typing import Annotated, List
 
-from fastapi import APIRouter, Depends, Path
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from sqlalchemy import func
-from sqlalchemy.orm import Session
-
-from ..database.dependencies import get_db
-from ..database.models import Account, Transaction
-from ..schemas.statistic import UserBalanceStats, UserCategorySpending
+from fastapi import APIRouter, Depends, Path, Query
+from sqlalchemy import Date, cast, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database.models import CategoryDayStats, CategoryMonthStats, UserStats
+from ..database.replica import get_read_db, is_replica
+from ..schemas.statistic import (
+    TimeSeriesPoint,
+    TimeSeriesQuery,
+    UserBalanceStats,
+    UserCategorySpending,
+)
+from ..utils.authorisation import CurrentPrincipal
+from ..utils.response_cache import balance_key, monthly_key, stats_cache
 from ..utils.users_rights import check_user_exists, check_user_rights
 
 router = APIRouter(prefix="/stats", tags=["statistics"])
-security = HTTPBasic()
 
 
 @router.get('/user-balances/{user_id}', response_model=UserBalanceStats)
 async def get_balance_statistics(
-    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    principal: CurrentPrincipal,
     user_id: int = Path(..., description="User ID to calculate statistics", ge=1),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ) -> UserBalanceStats:
-    """Retrieve aggregated balance statistics for a user."""
-    db_user = check_user_exists(user_id, db)
-
-    check_user_rights(
-        db,
-        db_user,
-        credentials.username,
-        credentials.password
-    )
+    """
+    Retrieve aggregated balance statistics for a user.
 
-    # Get total amount and account count
-    account_stats = db.query(
-        func.sum(Account.amount).label('total_amount'),
-        func.count(Account.id).label('account_count')
-    ).filter(
-        Account.user_id == user_id
-    ).first()
-
-    # Get transaction statistics
-    transaction_stats = db.query(
-        func.sum(Transaction.amount).label('total_transactions'),
-        func.count(Transaction.id).label('transaction_count'),
-        func.min(Transaction.date).label('first_date'),
-        func.max(Transaction.date).label('last_date')
-    ).filter(
-        Transaction.user_id == user_id
-    ).first()
+    Read from the precomputed user_stats row, cached until a write of the
+    user's accounts or transactions. Rows read from a replica are not
+    cached.
+    """
+    key = balance_key(user_id)
+    if principal.is_admin or principal.id == user_id:
+        if (cached := stats_cache.get(key)) is not None:
+            return cached
+
+    db_user = await check_user_exists(user_id, db)
+
+    check_user_rights(principal, db_user)
+
+    stats = await db.get(UserStats, user_id)
 
     avg_per_day = 0.0
     avg_per_month = 0.0
 
-    if transaction_stats and transaction_stats.transaction_count:
-        total_days = (transaction_stats.last_date -
-                     transaction_stats.first_date).days + 1
+    if stats and stats.transaction_count:
+        total_days = (stats.last_date - stats.first_date).days + 1
         total_months = total_days / 30.44  # Average days in month
 
         if total_days > 0:
-            avg_per_day = transaction_stats.total_transactions / total_days
-            avg_per_month = transaction_stats.total_transactions / total_months
+            avg_per_day = float(stats.transaction_total) / total_days
+            avg_per_month = float(stats.transaction_total) / total_months
 
-    return UserBalanceStats(
+    balance = UserBalanceStats(
         user_id=user_id,
         user_name=db_user.login,
-        total_amount=account_stats.total_amount or 0.0 if account_stats else 0.0,
-        account_count=account_stats.account_count or 0 if account_stats else 0,
+        total_amount=stats.account_total if stats else 0,
+        account_count=stats.account_count if stats else 0,
         avg_transaction_per_day=avg_per_day,
         avg_transaction_per_month=avg_per_month
     )
+    # A lagging replica could cache a value the write already invalidated
+    if not is_replica(db):
+        stats_cache.set(key, balance.model_dump(mode='json'))
+    return balance
 
 
 @router.get('/monthly-category-spent/{user_id}',
            response_model=List[UserCategorySpending])
 async def get_monthly_category_spent(
-    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    principal: CurrentPrincipal,
     user_id: int = Path(..., description="User ID to receive transactions", ge=1),
     month_trans: int = None,
     year_trans: int = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ) -> List[UserCategorySpending]:
-    """Retrieve the monthly spending per category for a specific user."""
-    db_user = check_user_exists(user_id, db)
-
-    check_user_rights(
-        db,
-        db_user,
-        credentials.username,
-        credentials.password
-    )
+    """
+    Retrieve the monthly spending per category for a specific user.
 
+    Read from the precomputed category_month_stats rows of the month,
+    cached until a write of the user's transactions in that month. Rows
+    read from a replica are not cached.
+    """
     current_year = year_trans if year_trans else date.today().year
     current_month = month_trans if month_trans else date.today().month
 
-    first_day_of_month = date(current_year, current_month, 1)
+    key = monthly_key(user_id, current_year, current_month)
+    if principal.is_admin or principal.id == user_id:
+        if (cached := stats_cache.get(key)) is not None:
+            return cached
+
+    db_user = await check_user_exists(user_id, db)
 
-    category_spending = db.query(
-        Transaction.category,
-        func.sum(Transaction.amount).label('cat_amount')
+    check_user_rights(principal, db_user)
+
+    category_spending = (await db.execute(select(
+        CategoryMonthStats.category,
+        CategoryMonthStats.amount
     ).filter(
-        Transaction.user_id == user_id,
-        Transaction.date >= first_day_of_month,
-        Transaction.date <= date.today()
-    ).group_by(
-        Transaction.category
+        CategoryMonthStats.user_id == user_id,
+        CategoryMonthStats.year == current_year,
+        CategoryMonthStats.month == current_month,
+        CategoryMonthStats.count > 0
     ).order_by(
-        func.sum(Transaction.amount)
-    ).all()
+        CategoryMonthStats.amount
+    ))).all()
 
-    return [
+    spending = [
         UserCategorySpending(
             category=cat,
             cat_amount=cat_sp
-        )
+        ).model_dump(mode='json')
         for cat, cat_sp in category_spending
     ]
+    if not is_replica(db):
+        stats_cache.set(key, spending)
+    return spending
+
+
+# SQLite date() modifiers giving the first day of the bucket
+SQLITE_PERIOD_START = {
+    'week': ('-6 days', 'weekday 1'),
+    'month': ('start of month',),
+    'year': ('start of year',),
+}
+
+
+def period_start(column, granularity: str, dialect: str):
+    """First day of the day, week, month or year the date falls into."""
+    if granularity == 'day':
+        return column
+    if dialect == 'sqlite':
+        return func.date(column, *SQLITE_PERIOD_START[granularity],
+                         type_=Date)
+    return cast(func.date_trunc(granularity, column), Date)
+
+
+def time_series_statement(user_id: int, query: TimeSeriesQuery,
+                          dialect: str):
+    """One grouped statement over the precomputed category_day_stats."""
+    period = period_start(CategoryDayStats.date, query.granularity,
+                          dialect).label('period')
+    count = func.sum(CategoryDayStats.count)
+    stmt = select(
+        period,
+        CategoryDayStats.category,
+        func.sum(CategoryDayStats.income).label('income'),
+        func.sum(CategoryDayStats.expense).label('expense'),
+        count.label('count')
+    ).filter(
+        CategoryDayStats.user_id == user_id
+    ).group_by(
+        period, CategoryDayStats.category
+    ).having(
+        count > 0
+    ).order_by(
+        period, CategoryDayStats.category
+    )
+    if query.date_from is not None:
+        stmt = stmt.filter(CategoryDayStats.date >= query.date_from)
+    if query.date_to is not None:
+        stmt = stmt.filter(CategoryDayStats.date <= query.date_to)
+    if query.category is not None:
+        stmt = stmt.filter(CategoryDayStats.category == query.category)
+    return stmt
+
+
+@router.get('/timeseries/{user_id}', response_model=List[TimeSeriesPoint])
+async def get_time_series(
+    principal: CurrentPrincipal,
+    query: Annotated[TimeSeriesQuery, Query()],
+    user_id: int = Path(..., description="User ID to build the series", ge=1),
+    db: AsyncSession = Depends(get_read_db)
+) -> List[TimeSeriesPoint]:
+    """
+    Income, expense and net per category for every day, week, month or
+    year of the range.
+
+    Rolled up in one grouped statement from the precomputed
+    category_day_stats rows, so the cost depends on the number of days
+    and categories in the range, not on the number of transactions.
+    """
+    db_user = await check_user_exists(user_id, db)
+
+    check_user_rights(principal, db_user)
+
+    rows = await db.execute(
+        time_series_statement(user_id, query, db.bind.dialect.name))
+    return [
+        TimeSeriesPoint(
+            period=row.period,
+            category=row.category,
+            income=row.income,
+            expense=row.expense,
+            net=row.income + row.expense,
+            count=row.count
+        )
+        for row in rows
+    ]
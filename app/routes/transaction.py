@@ -2,17 +2,42 @@
 from datetime import date
 from typing import Annotated, List
 
-from fastapi import APIRouter, Depends, HTTPException, Path
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from sqlalchemy.orm import Session
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    HTTPException,
+    Path,
+    Query,
+    Response,
+)
+from fastapi.responses import StreamingResponse
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 from starlette.status import HTTP_201_CREATED
 
+from ..database.aggregates import apply_balances, apply_transactions
+from ..database.balances import change_balances
 from ..database.dependencies import get_db
-from ..database.models import Transaction
-from ..schemas.transaction import TransactionCreate, TransactionResponse
+from ..database.models import Account, Transaction, User
+from ..database.replica import get_read_db, read_sessionmaker
+from ..schemas.pagination import TransactionQuery
+from ..schemas.transaction import (
+    BulkTransactionResponse,
+    BulkTransactionResult,
+    TransactionCompact,
+    TransactionCreate,
+    TransactionExportQuery,
+    TransactionResponse,
+)
+from ..utils.authorisation import CurrentPrincipal
+from ..utils.config import settings
+from ..utils.export import MEDIA_TYPES, export_query, stream_transactions
+from ..utils.pagination import finish_page, paginate
+from ..utils.response_cache import invalidate_statistics
 from ..utils.users_rights import (
     check_account_exists,
-    check_admin_rights,
     check_transaction_exists,
     check_user_exists,
     check_user_rights,
@@ -21,7 +46,64 @@ from ..utils.users_rights import (
 )
 
 router = APIRouter(prefix="/transactions", tags=["transactions"])
-security = HTTPBasic()
+
+http_expense_exceeds_balance = HTTPException(
+    status_code=406,
+    detail='The amount of the expense exceeds the balance amount'
+)
+
+http_negative_balance = HTTPException(
+    status_code=406,
+    detail='The new amount of the expense exceeds the balance amount. '
+           'The balance cannot be negative'
+)
+
+http_too_many_items = HTTPException(
+    status_code=422,
+    detail='Too many items, the limit is BULK_MAX_ITEMS'
+)
+
+http_transfer_leg = HTTPException(
+    status_code=409,
+    detail='The transaction is a leg of a transfer'
+)
+
+ALLOWED_CATEGORIES = {
+    True: ['Salary', 'Bonus', 'Scholarship', 'Gift', 'Other income'],
+    False: ['Products', 'Clothing', 'Subscriptions', 'Other expenses']
+}
+
+
+def check_category(trans: TransactionCreate) -> None:
+    """Check the category matches the sign of the amount."""
+    income = trans.amount >= 0
+    if trans.category not in ALLOWED_CATEGORIES[income]:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Category not found. For {'positive' if income else 'negative'} "
+                  f"amount it can be: {', '.join(ALLOWED_CATEGORIES[income])}"
+        )
+
+
+def ledger_row(db_transaction: Transaction) -> tuple:
+    """Key the precomputed statistics are maintained by."""
+    return (db_transaction.user_id, db_transaction.date,
+            db_transaction.category, db_transaction.amount)
+
+
+def check_not_transfer(db_transaction: Transaction) -> None:
+    """Check the transaction is not a leg of a transfer."""
+    if db_transaction.transfer_id is not None:
+        raise http_transfer_leg
+
+
+def check_account_owner(db_account: Account, db_user: User) -> None:
+    """Check the account belongs to the user."""
+    if db_account.user_id != db_user.id:
+        raise HTTPException(
+            status_code=409,
+            detail='The user does not have such an account'
+        )
 
 
 @router.post(
@@ -30,46 +112,23 @@ security = HTTPBasic()
     status_code=HTTP_201_CREATED
 )
 async def create_transaction(
-    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    principal: CurrentPrincipal,
     trans: TransactionCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> TransactionResponse:
     """Create a new transaction linked to a user and account."""
-    db_user = check_user_exists(trans.user_id, db)
-    is_admin_id(trans.user_id, db)
-
-    check_user_rights(
-        db,
-        db_user,
-        credentials.username,
-        credentials.password
-    )
-    db_account = check_account_exists(trans.account_id, db)
+    db_user = await check_user_exists(trans.user_id, db)
+    await is_admin_id(trans.user_id, db)
 
-    if db_account.user_id != db_user.id:
-        raise HTTPException(
-            status_code=409,
-            detail='The user does not have such an account'
-        )
+    check_user_rights(principal, db_user)
+    db_account = await check_account_exists(trans.account_id, db)
 
-    allowed_categories = {
-        True: ['Salary', 'Bonus', 'Scholarship', 'Gift', 'Other income'],
-        False: ['Products', 'Clothing', 'Subscriptions', 'Other expenses']
-    }
-    if trans.category not in allowed_categories[trans.amount >= 0]:
-        raise HTTPException(
-            status_code=404,
-            detail=f"Category not found. For {'positive' if trans.amount > 0 else 'negative'} "
-                  f"amount it can be: {', '.join(allowed_categories[trans.amount > 0])}"
-        )
+    check_account_owner(db_account, db_user)
+    check_category(trans)
 
-    new_account_amount = db_account.amount + trans.amount
-    if new_account_amount < 0:
-        raise HTTPException(
-            status_code=406,
-            detail='The amount of the expense exceeds the balance amount'
-        )
-    db_account.amount = new_account_amount
+    if await change_balances(db, {db_account.id: trans.amount}):
+        raise http_expense_exceeds_balance
+    await apply_balances(db, {db_account.user_id: trans.amount})
 
     db_transaction = Transaction(
         category=trans.category,
@@ -82,130 +141,331 @@ async def create_transaction(
     )
 
     db.add(db_transaction)
-    db.commit()
-    db.refresh(db_transaction)
-    db.refresh(db_account)
+    await apply_transactions(db, [ledger_row(db_transaction)])
+    await db.commit()
+    invalidate_statistics(db_user.id, [db_transaction.date])
+    await db.refresh(db_transaction)
+    await db.refresh(db_account)
     return db_transaction
 
 
-@router.get('/', response_model=List[TransactionResponse])
+@router.post('/bulk', response_model=BulkTransactionResponse)
+async def create_transactions_bulk(
+    principal: CurrentPrincipal,
+    items: Annotated[List[TransactionCreate], Body()],
+    db: AsyncSession = Depends(get_db)
+) -> BulkTransactionResponse:
+    """
+    Create many transactions in one database transaction.
+
+    Users and accounts are loaded once, every item is checked like
+    POST /transactions/ against the running in-memory balances, and the
+    accepted items are inserted with a single statement. Rejected items
+    are reported in the results and do not stop the others.
+    The balance of each account then changes by one conditional update;
+    if a concurrent request has spent the money meanwhile, every item
+    of that account is rejected with 406.
+    Unlike the single-item endpoint, the date of each item is kept.
+    """
+    if len(items) > settings.BULK_MAX_ITEMS:
+        raise http_too_many_items
+    users = {db_user.id: db_user for db_user in await db.scalars(
+        select(User).filter(User.id.in_({trans.user_id for trans in items})))}
+    accounts = {db_account.id: db_account for db_account in await db.scalars(
+        select(Account)
+        .filter(Account.id.in_({trans.account_id for trans in items})))}
+    balances = {account_id: db_account.amount
+                for account_id, db_account in accounts.items()}
+
+    results, rows = [], []
+    for index, trans in enumerate(items):
+        try:
+            if (db_user := users.get(trans.user_id)) is None:
+                raise HTTPException(status_code=404, detail='User not found')
+            if db_user.login == settings.DB_USER:
+                raise http_wrong_rights
+            check_user_rights(principal, db_user)
+            if (db_account := accounts.get(trans.account_id)) is None:
+                raise HTTPException(status_code=404,
+                                    detail='Account not found')
+            check_account_owner(db_account, db_user)
+            check_category(trans)
+            new_account_amount = balances[db_account.id] + trans.amount
+            if new_account_amount < 0:
+                raise http_expense_exceeds_balance
+        except HTTPException as error:
+            results.append(BulkTransactionResult(
+                index=index,
+                status_code=error.status_code,
+                detail=error.detail
+            ))
+            continue
+
+        balances[db_account.id] = new_account_amount
+        rows.append({
+            'category': trans.category,
+            'amount': trans.amount,
+            'date': trans.date,
+            'user_id': db_user.id,
+            'account_id': db_account.id,
+        })
+        results.append(BulkTransactionResult(index=index,
+                                             status_code=HTTP_201_CREATED))
+
+    changes = {}
+    for row in rows:
+        changes[row['account_id']] = (changes.get(row['account_id'], 0)
+                                      + row['amount'])
+    if refused := await change_balances(db, changes):
+        accepted = iter(row['account_id'] not in refused for row in rows)
+        for result in results:
+            if (result.status_code == HTTP_201_CREATED
+                    and not next(accepted)):
+                result.status_code = http_expense_exceeds_balance.status_code
+                result.detail = http_expense_exceeds_balance.detail
+        rows = [row for row in rows if row['account_id'] not in refused]
+
+    if rows:
+        ids = iter((await db.scalars(
+            insert(Transaction)
+            .returning(Transaction.id, sort_by_parameter_order=True),
+            rows
+        )).all())
+        users = {}
+        for row in rows:
+            users[row['user_id']] = (users.get(row['user_id'], 0)
+                                     + row['amount'])
+        await apply_balances(db, users)
+        await apply_transactions(db, [
+            (row['user_id'], row['date'], row['category'], row['amount'])
+            for row in rows
+        ])
+        await db.commit()
+        days = {}
+        for row in rows:
+            days.setdefault(row['user_id'], set()).add(row['date'])
+        for user_id, user_days in days.items():
+            invalidate_statistics(user_id, user_days)
+        for result in results:
+            if result.status_code == HTTP_201_CREATED:
+                result.id = next(ids)
+
+    return BulkTransactionResponse(
+        created=len(rows),
+        failed=len(items) - len(rows),
+        results=results
+    )
+
+
+TRANSACTION_PAGE_KEY = [Transaction.date, Transaction.id]
+
+# Full pages load the nested user and account in the same statement,
+# compact pages select flat columns only
+TRANSACTION_FULL_LOAD = (
+    joinedload(Transaction.user),
+    joinedload(Transaction.account).joinedload(Account.user),
+)
+TRANSACTION_COMPACT_COLUMNS = [
+    Transaction.id,
+    Transaction.date,
+    Transaction.category,
+    Transaction.amount,
+    Transaction.user_id,
+    Transaction.account_id,
+    Transaction.transfer_id,
+]
+
+
+def filter_transactions(query, filters: TransactionQuery):
+    """Apply the optional filters of a transaction list request."""
+    if filters.date_from is not None:
+        query = query.filter(Transaction.date >= filters.date_from)
+    if filters.date_to is not None:
+        query = query.filter(Transaction.date <= filters.date_to)
+    if filters.category is not None:
+        query = query.filter(Transaction.category == filters.category)
+    if filters.account_id is not None:
+        query = query.filter(Transaction.account_id == filters.account_id)
+    if filters.amount_min is not None:
+        query = query.filter(Transaction.amount >= filters.amount_min)
+    if filters.amount_max is not None:
+        query = query.filter(Transaction.amount <= filters.amount_max)
+    return query
+
+
+async def transactions_page(filters: TransactionQuery, response: Response,
+                            db: AsyncSession, *criteria) -> list:
+    """Load one (date, id) ordered page of transactions in one statement."""
+    compact = filters.view == 'compact'
+    if compact:
+        query = select(*TRANSACTION_COMPACT_COLUMNS)
+    else:
+        query = select(Transaction).options(*TRANSACTION_FULL_LOAD)
+    query = paginate(filter_transactions(query.filter(*criteria), filters),
+                     TRANSACTION_PAGE_KEY, filters)
+    result = await db.execute(query)
+    items = result.all() if compact else result.scalars().all()
+    return finish_page(items, TRANSACTION_PAGE_KEY, filters, response)
+
+
+@router.get('/',
+            response_model=List[TransactionResponse] | List[TransactionCompact])
 async def get_transactions(
-    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
-    db: Session = Depends(get_db)
+    principal: CurrentPrincipal,
+    filters: Annotated[TransactionQuery, Query()],
+    response: Response,
+    db: AsyncSession = Depends(get_read_db)
 ) -> List[TransactionResponse]:
-    """Only for admin. Retrieve a list of all transactions."""
-    if check_admin_rights(
-        credentials.username,
-        credentials.password
-    ):
-        return db.query(Transaction).all()
+    """
+    Only for admin. Retrieve a page of all transactions.
+
+    The cursor of the next page is returned in the X-Next-Cursor header.
+    view=compact returns ids instead of nested user and account objects.
+    """
+    if principal.is_admin:
+        return await transactions_page(filters, response, db)
 
     raise http_wrong_rights
 
 
-@router.get('/{user_id}', response_model=List[TransactionResponse],
+@router.get('/{user_id}',
+            response_model=List[TransactionResponse] | List[TransactionCompact],
             summary='Get all accounts by ID')
 async def get_transactions_by_id(
-    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    principal: CurrentPrincipal,
+    filters: Annotated[TransactionQuery, Query()],
+    response: Response,
     user_id: int = Path(..., description="User ID to get transactions", ge=1),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ) -> List[TransactionResponse]:
-    """Only for admin or for getting own transactions."""
-    db_user = check_user_exists(user_id, db)
-
-    check_user_rights(
-        db,
-        db_user,
-        credentials.username,
-        credentials.password
-    )
+    """
+    Only for admin or for getting own transactions.
+
+    The cursor of the next page is returned in the X-Next-Cursor header.
+    view=compact returns ids instead of nested user and account objects.
+    """
+    db_user = await check_user_exists(user_id, db)
+
+    check_user_rights(principal, db_user)
+
+    return await transactions_page(filters, response, db,
+                                   Transaction.user_id == user_id)
+
+
+@router.get('/{user_id}/export',
+            response_class=StreamingResponse,
+            summary='Stream the transaction history as NDJSON or CSV')
+async def export_transactions(
+    principal: CurrentPrincipal,
+    export: Annotated[TransactionExportQuery, Query()],
+    user_id: int = Path(..., description="User ID to export transactions",
+                        ge=1),
+    db: AsyncSession = Depends(get_read_db)
+) -> StreamingResponse:
+    """Only for admin or for exporting own transactions."""
+    db_user = await check_user_exists(user_id, db)
 
-    return db.query(Transaction).filter(Transaction.user_id == user_id).all()
+    check_user_rights(principal, db_user)
+
+    query = export_query().filter(Transaction.user_id == user_id)
+    if export.date_from is not None:
+        query = query.filter(Transaction.date >= export.date_from)
+    if export.date_to is not None:
+        query = query.filter(Transaction.date <= export.date_to)
+    if export.account_id is not None:
+        query = query.filter(Transaction.account_id == export.account_id)
+
+    return StreamingResponse(
+        stream_transactions(query, export.format,
+                            read_sessionmaker(principal)),
+        media_type=MEDIA_TYPES[export.format],
+        headers={'Content-Disposition': 'attachment; filename='
+                 f'transactions-{user_id}.{export.format}'}
+    )
 
 
 @router.delete('/{trans_id}', response_model=TransactionResponse)
 async def delete_transaction(
-    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    principal: CurrentPrincipal,
     trans_id: int = Path(..., description="Transaction ID to delete", ge=1),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> TransactionResponse:
     """Delete a transaction by ID and adjust the corresponding account balance."""
-    db_transaction = check_transaction_exists(trans_id, db)
-    db_user = check_user_exists(db_transaction.user_id, db)
-
-    check_user_rights(
-        db,
-        db_user,
-        credentials.username,
-        credentials.password
-    )
-    db_account = check_account_exists(db_transaction.account_id, db)
-    new_account_amount = db_account.amount - db_transaction.amount
-    if new_account_amount < 0:
-        raise HTTPException(
-            status_code=406,
-            detail='The new amount of the expense exceeds the balance amount. '
-                   'The balance cannot be negative'
-        )
-    db_account.amount = new_account_amount
+    db_transaction = await check_transaction_exists(trans_id, db)
+    check_not_transfer(db_transaction)
+    db_user = await check_user_exists(db_transaction.user_id, db)
+
+    check_user_rights(principal, db_user)
+    db_account = await check_account_exists(db_transaction.account_id, db)
+    if await change_balances(db, {db_account.id: -db_transaction.amount}):
+        raise http_negative_balance
+    await apply_balances(db, {db_account.user_id: -db_transaction.amount})
 
-    db.delete(db_transaction)
-    db.commit()
-    db.refresh(db_account)
+    await db.delete(db_transaction)
+    await apply_transactions(db, [ledger_row(db_transaction)], sign=-1)
+    await db.commit()
+    invalidate_statistics(db_transaction.user_id, [db_transaction.date])
+    invalidate_statistics(db_account.user_id, [])
+    await db.refresh(db_account)
     return db_transaction
 
 
 @router.put('/{trans_id}', response_model=TransactionResponse)
 async def change_transaction(
-    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    principal: CurrentPrincipal,
     trans: TransactionCreate,
     trans_id: int = Path(..., description="Transaction ID to change", ge=1),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> TransactionResponse:
-    """Update an existing transaction by ID and adjust the corresponding."""
-    db_transaction = check_transaction_exists(trans_id, db)
-    db_user = check_user_exists(trans.user_id, db)
-
-    check_user_rights(
-        db,
-        db_user,
-        credentials.username,
-        credentials.password
-    )
+    """
+    Update an existing transaction by ID and adjust the corresponding
+    balances: the amount leaves the old account and the new amount
+    enters the new one, both or neither.
+    """
+    db_transaction = await check_transaction_exists(trans_id, db)
+    check_not_transfer(db_transaction)
+    # The caller must own the transaction as well as its new place
+    old_user = await check_user_exists(db_transaction.user_id, db)
+    check_user_rights(principal, old_user)
+    old_account = await db.get(Account, db_transaction.account_id)
+    if old_account is not None:
+        check_account_owner(old_account, old_user)
 
-    db_account = check_account_exists(trans.account_id, db)
+    db_user = await check_user_exists(trans.user_id, db)
 
-    if db_account.user_id != db_user.id:
-        raise HTTPException(
-            status_code=409,
-            detail='The user does not have such an account'
-        )
-    allowed_categories = {
-        True: ['Salary', 'Bonus', 'Scholarship', 'Gift', 'Other income'],
-        False: ['Products', 'Clothing', 'Subscriptions', 'Other expenses']
-    }
-    if trans.category not in allowed_categories[trans.amount > 0]:
-        raise HTTPException(
-            status_code=404,
-            detail=f"Category not found. For {'positive' if trans.amount > 0 else 'negative'} "
-                  f"amount it can be: {', '.join(allowed_categories[trans.amount > 0])}"
-        )
+    check_user_rights(principal, db_user)
 
-    new_account_amount = (db_account.amount - db_transaction.amount + trans.amount)
-    if new_account_amount < 0:
-        raise HTTPException(
-            status_code=406,
-            detail='The new amount of the expense exceeds the balance amount. '
-                   'The balance cannot be negative'
-        )
-    db_account.amount = new_account_amount
+    db_account = await check_account_exists(trans.account_id, db)
+
+    check_account_owner(db_account, db_user)
+    check_category(trans)
+
+    changes = {db_account.id: trans.amount}
+    users = {db_account.user_id: trans.amount}
+    if old_account is not None:
+        changes[old_account.id] = (changes.get(old_account.id, 0)
+                                   - db_transaction.amount)
+        users[old_account.user_id] = (users.get(old_account.user_id, 0)
+                                      - db_transaction.amount)
+    if await change_balances(db, changes):
+        raise http_negative_balance
+    await apply_balances(db, users)
 
+    old_row = ledger_row(db_transaction)
     db_transaction.category = trans.category
     db_transaction.amount = trans.amount
     db_transaction.user_id = trans.user_id
     db_transaction.account_id = trans.account_id
+    await apply_transactions(db, [old_row], sign=-1)
+    await apply_transactions(db, [ledger_row(db_transaction)])
 
-    db.commit()
-    db.refresh(db_transaction)
-    db.refresh(db_account)
+    await db.commit()
+    invalidate_statistics(old_row[0], [old_row[1]])
+    invalidate_statistics(db_transaction.user_id, [db_transaction.date])
+    invalidate_statistics(db_account.user_id, [])
+    if old_account is not None:
+        invalidate_statistics(old_account.user_id, [])
+        await db.refresh(old_account)
+    await db.refresh(db_transaction)
+    await db.refresh(db_account)
     return db_transaction
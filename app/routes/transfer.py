@@ -0,0 +1,85 @@
+"""Processing requests from /transfers/."""
+from datetime import date
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.status import HTTP_201_CREATED
+
+from ..database.balances import change_balances
+from ..database.dependencies import get_db
+from ..database.models import Transaction, Transfer
+from ..schemas.transfer import TransferCreate, TransferResponse
+from ..utils.authorisation import CurrentPrincipal
+from ..utils.users_rights import (
+    check_account_exists,
+    check_user_exists,
+    check_user_rights,
+    is_admin_id,
+)
+from .transaction import check_account_owner, http_expense_exceeds_balance
+
+router = APIRouter(prefix="/transfers", tags=["transfers"])
+
+TRANSFER_CATEGORY = 'Transfer'
+
+http_same_account = HTTPException(
+    status_code=409,
+    detail='The accounts of a transfer must differ'
+)
+
+
+@router.post(
+    '/',
+    response_model=TransferResponse,
+    status_code=HTTP_201_CREATED
+)
+async def create_transfer(
+    principal: CurrentPrincipal,
+    transfer: TransferCreate,
+    db: AsyncSession = Depends(get_db)
+) -> TransferResponse:
+    """
+    Move money between two accounts of one holder.
+
+    The debit and credit legs (category 'Transfer', linked by
+    transfer_id) and both balance changes are written in one database
+    transaction, so the money is always in exactly one of the accounts.
+    The legs are left out of the statistics.
+    """
+    if transfer.from_account_id == transfer.to_account_id:
+        raise http_same_account
+    source = await check_account_exists(transfer.from_account_id, db)
+    target = await check_account_exists(transfer.to_account_id, db)
+    db_user = await check_user_exists(source.user_id, db)
+    await is_admin_id(db_user.id, db)
+
+    check_user_rights(principal, db_user)
+    check_account_owner(target, db_user)
+
+    if await change_balances(db, {source.id: -transfer.amount,
+                                  target.id: transfer.amount}):
+        raise http_expense_exceeds_balance
+
+    db_transfer = Transfer(
+        user_id=db_user.id,
+        from_account_id=source.id,
+        to_account_id=target.id,
+        amount=transfer.amount,
+        date=date.today()
+    )
+    db.add(db_transfer)
+    await db.flush()
+    db.add_all([
+        Transaction(
+            category=TRANSFER_CATEGORY,
+            amount=sign * transfer.amount,
+            date=db_transfer.date,
+            user_id=db_user.id,
+            account_id=db_account.id,
+            transfer_id=db_transfer.id
+        )
+        for sign, db_account in ((-1, source), (1, target))
+    ])
+    # The totals of the holder do not change, nothing cached is stale
+    await db.commit()
+    return db_transfer
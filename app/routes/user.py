@@ -1,27 +1,35 @@
 """Processing requests from /users/."""
 from typing import Annotated, List
 
-from fastapi import APIRouter, Depends, HTTPException, Path
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Response
 from fastapi.security import (
     HTTPAuthorizationCredentials,
     HTTPBasic,
     HTTPBasicCredentials,
 )
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.status import HTTP_201_CREATED
 
 from ..database.dependencies import get_db
 from ..database.models import User
+from ..schemas.pagination import PageQuery
 from ..schemas.user import UserCreate, UserResponse
 from ..utils.authorisation_password import (
     get_current_user_with_login_and_password,
-    get_password_hash,
+    invalidate_user_credentials,
+    password_service,
 )
 from ..utils.authorisation_token import (
-    encode_jwt,
+    encode_user_jwt,
+    get_current_principal_with_token,
     get_current_user_with_token,
     http_bearer,
+    invalidate_user_tokens,
 )
+from ..utils.pagination import finish_page, paginate
+from ..utils.response_cache import invalidate_statistics
 from ..utils.users_rights import (
     check_admin_rights,
     http_wrong_rights,
@@ -32,6 +40,15 @@ from ..utils.users_rights import (
 router = APIRouter(prefix="/users", tags=["users"])
 security = HTTPBasic()
 
+USER_PAGE_KEY = [User.id]
+
+
+def http_login_taken(login: str) -> HTTPException:
+    return HTTPException(
+        status_code=422,
+        detail=f"User with username {login} already exists"
+    )
+
 
 @router.post(
     '/register',
@@ -41,24 +58,27 @@ security = HTTPBasic()
 )
 async def register_user(
     user: UserCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> UserResponse:
     """Register a new user in the system."""
-    existing_user = db.query(User).filter(User.login == user.login).first()
+    existing_user = await db.scalar(
+        select(User).filter(User.login == user.login)
+    )
     if existing_user:
-        raise HTTPException(
-            status_code=422,
-            detail=f"User with username {user.login} already exists"
-        )
+        raise http_login_taken(user.login)
 
     db_user = User(
         login=user.login,
         is_admin=False,
-        password=get_password_hash(user.password),
+        password=await password_service.hash(user.password),
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise http_login_taken(user.login)
+    await db.refresh(db_user)
     return db_user
 
 
@@ -68,11 +88,14 @@ async def register_user(
 )
 async def login_with_password(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> UserResponse:
     """Get authenticated user's information."""
-    db_user = get_current_user_with_login_and_password(db, credentials.username,
-                                                       credentials.password)
+    db_user = await get_current_user_with_login_and_password(
+        db,
+        credentials.username,
+        credentials.password
+    )
     return db_user
 
 
@@ -82,11 +105,11 @@ async def login_with_password(
 )
 async def login_with_token(
     credentials: HTTPAuthorizationCredentials = Depends(http_bearer),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> UserResponse:
     """Get user information using authorization token."""
     token = credentials.credentials
-    db_user = get_current_user_with_token(token, db)
+    db_user = await get_current_user_with_token(token, db)
     if db_user:
         return db_user
 
@@ -102,15 +125,18 @@ async def login_with_token(
 )
 async def get_access_token(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> dict:
     """Get access token and user ID for authenticated users."""
-    db_user = get_current_user_with_login_and_password(db, credentials.username,
-                                                       credentials.password)
+    db_user = await get_current_user_with_login_and_password(
+        db,
+        credentials.username,
+        credentials.password
+    )
 
     return {
         "user_id": db_user.id,
-        "access_token": encode_jwt({'sub': db_user.login}),
+        "access_token": encode_user_jwt(db_user),
         "token_type": "bearer"
     }
 
@@ -122,15 +148,20 @@ async def get_access_token(
 )
 async def get_users(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
-    db: Session = Depends(get_db)
+    page: Annotated[PageQuery, Query()],
+    response: Response,
+    db: AsyncSession = Depends(get_db)
 ) -> List[UserResponse]:
-    """ADMIN ONLY - Retrieve list of all users."""
-    if check_admin_rights(
+    """ADMIN ONLY - Retrieve a page of all users."""
+    if await check_admin_rights(
             db,
             credentials.username,
             credentials.password
     ):
-        return db.query(User).all()
+        users = (await db.scalars(
+            paginate(select(User), USER_PAGE_KEY, page)
+        )).all()
+        return finish_page(users, USER_PAGE_KEY, page, response)
 
     raise http_wrong_rights
 
@@ -142,29 +173,35 @@ async def get_users(
 async def delete_user(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
     user_id: int = Path(..., description="User ID to delete", ge=0),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> UserResponse:
     """
     Delete user by ID. Admin only or self-deletion.
 
     user_id == 0 for self-deletion.
     """
-    db_user = get_current_user_with_login_and_password(db, credentials.username,
-                                                       credentials.password)
+    db_user = await get_current_user_with_login_and_password(
+        db,
+        credentials.username,
+        credentials.password
+    )
 
     if user_id == 0:
         user_id = db_user.id
-        user_to_delete = check_user_exists(user_id, db)
-        is_admin_id(user_id, db)
+        user_to_delete = await check_user_exists(user_id, db)
+        await is_admin_id(user_id, db)
         correct_id = True
     else:
-        user_to_delete = check_user_exists(user_id, db)
-        is_admin_id(user_id, db)
+        user_to_delete = await check_user_exists(user_id, db)
+        await is_admin_id(user_id, db)
         correct_id = user_id == db_user.id
 
     if correct_id or db_user.is_admin:
-        db.delete(user_to_delete)
-        db.commit()
+        await db.delete(user_to_delete)
+        await db.commit()
+        invalidate_user_credentials(user_to_delete.id)
+        invalidate_user_tokens(user_to_delete.id)
+        invalidate_statistics(user_to_delete.id)
         return user_to_delete
     raise http_wrong_rights
 
@@ -176,7 +213,7 @@ async def delete_user(
 async def change_user(
     user: UserCreate,
     user_id: int = Path(..., description="User ID to update", ge=0),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     credentials: HTTPAuthorizationCredentials = Depends(http_bearer)
 ) -> UserResponse:
     """
@@ -185,23 +222,32 @@ async def change_user(
 
     user_id == 0 for self-update.
     """
-    current_user = get_current_user_with_token(credentials.credentials, db)
-    is_admin = current_user.is_admin
+    principal = await get_current_principal_with_token(credentials.credentials,
+                                                       db)
 
     if user_id == 0:
-        user_id = current_user.id
-        db_user = current_user
-        correct_id = True
-    else:
-        db_user = db.query(User).filter(User.id == user_id).first()
-        correct_id = user_id == current_user.id
+        user_id = principal.id
+    db_user = await check_user_exists(user_id, db)
+    correct_id = user_id == principal.id
 
-    is_admin_id(user_id, db)
+    await is_admin_id(user_id, db)
 
-    if correct_id or is_admin:
+    if correct_id or principal.is_admin:
+        if await db.scalar(select(User.id).filter(User.login == user.login,
+                                                  User.id != db_user.id)):
+            raise http_login_taken(user.login)
         db_user.login = user.login
-        db_user.password = get_password_hash(user.password)
-        db.commit()
-        db.refresh(db_user)
+        db_user.password = await password_service.hash(user.password)
+        db_user.token_version = (db_user.token_version or 0) + 1
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Taken by a concurrent registration since the check
+            await db.rollback()
+            raise http_login_taken(user.login)
+        invalidate_user_credentials(db_user.id)
+        invalidate_user_tokens(db_user.id)
+        invalidate_statistics(db_user.id, [])
+        await db.refresh(db_user)
         return db_user
     raise http_wrong_rights
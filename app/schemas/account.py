@@ -3,6 +3,7 @@ from typing import Annotated
 
 from pydantic import BaseModel, Field
 
+from .money import Money, MoneyInput
 from .user import UserResponse
 
 class AccountBase(BaseModel):
@@ -12,8 +13,8 @@ class AccountBase(BaseModel):
         description='Name of account',
         max_length=15
     )]
-    amount: Annotated[float, Field(
-        default=0.0,
+    amount: Annotated[Money, Field(
+        default=0,
         ge=0,
         description='Account amount'
     )]
@@ -25,7 +26,11 @@ class AccountBase(BaseModel):
 
 class AccountCreate(AccountBase):
     """Schema for creating new accounts."""
-    pass
+    amount: Annotated[MoneyInput, Field(
+        default=0,
+        ge=0,
+        description='Account amount'
+    )]
 
 
 class AccountResponse(AccountBase):
@@ -42,3 +47,15 @@ class AccountResponse(AccountBase):
     class Config:
         """Pydantic configuration."""
         from_attributes = True
+
+
+class AccountCompact(AccountBase):
+    """Account schema with the holder's id instead of the nested user."""
+    id: Annotated[int, Field(
+        ...,
+        description='Automatic unique indexing'
+    )]
+
+    class Config:
+        """Pydantic configuration."""
+        from_attributes = True
@@ -0,0 +1,98 @@
+"""Data schemas for the cross-user analytics of admins."""
+from datetime import date
+from typing import Annotated
+
+from pydantic import BaseModel, Field
+
+from .money import Money
+
+
+class AnalyticsQuery(BaseModel):
+    """Date range of an analytics request."""
+    date_from: Annotated[date | None, Field(
+        default=None,
+        description='Earliest transaction date, inclusive'
+    )]
+    date_to: Annotated[date | None, Field(
+        default=None,
+        description='Latest transaction date, inclusive'
+    )]
+
+
+class TopSpendersQuery(AnalyticsQuery):
+    """Date range and size of the top spenders list."""
+    limit: Annotated[int, Field(
+        default=10,
+        ge=1,
+        le=100,
+        description='Number of users in the list'
+    )]
+
+
+class UserSpending(BaseModel):
+    """Expenses of one user in the range."""
+    user_id: Annotated[int, Field(
+        ...,
+        description='The unique index of the user'
+    )]
+    login: Annotated[str | None, Field(
+        default=None,
+        description='Login of the user, empty for deleted users'
+    )]
+    expense: Annotated[Money, Field(
+        ...,
+        description='Sum of the negative amounts'
+    )]
+
+
+class CategoryShare(BaseModel):
+    """Totals of one category over all users."""
+    category: Annotated[str, Field(
+        ...,
+        description='The category of the transactions'
+    )]
+    income: Annotated[Money, Field(
+        ...,
+        description='Sum of the non-negative amounts'
+    )]
+    expense: Annotated[Money, Field(
+        ...,
+        description='Sum of the negative amounts'
+    )]
+    net: Annotated[Money, Field(
+        ...,
+        description='Income plus expense'
+    )]
+    count: Annotated[int, Field(
+        ...,
+        description='Number of transactions'
+    )]
+    share: Annotated[float, Field(
+        ...,
+        description='Part of the turnover (income minus expense) '
+                    'of all categories'
+    )]
+
+
+class DailyVolume(BaseModel):
+    """Totals of one day over all users."""
+    date: Annotated[date, Field(
+        ...,
+        description='The day'
+    )]
+    income: Annotated[Money, Field(
+        ...,
+        description='Sum of the non-negative amounts'
+    )]
+    expense: Annotated[Money, Field(
+        ...,
+        description='Sum of the negative amounts'
+    )]
+    net: Annotated[Money, Field(
+        ...,
+        description='Income plus expense'
+    )]
+    count: Annotated[int, Field(
+        ...,
+        description='Number of transactions'
+    )]
@@ -0,0 +1,25 @@
+"""Money types shared by the schemas."""
+from decimal import Decimal
+from typing import Annotated
+
+from pydantic import Field, PlainSerializer
+
+
+def format_money(amount: Decimal) -> str:
+    """Write an amount exactly, with two decimal places."""
+    return f'{amount:.2f}'
+
+
+# Exact amount, written to JSON as a string such as "-0.30" so that no
+# client float rounds it. Sums and balances have no digit limit.
+Money = Annotated[Decimal, PlainSerializer(
+    format_money,
+    return_type=str,
+    when_used='json'
+)]
+
+# Amount accepted from a request, it must fit the minor unit storage
+MoneyInput = Annotated[Money, Field(
+    max_digits=18,
+    decimal_places=2
+)]
@@ -0,0 +1,70 @@
+"""Query schemas for paginated list endpoints."""
+from datetime import date
+from typing import Annotated, Literal
+
+from pydantic import BaseModel, Field, field_validator
+
+from ..utils.config import settings
+from .money import MoneyInput
+
+
+class PageQuery(BaseModel):
+    """Keyset pagination parameters."""
+    limit: Annotated[int, Field(
+        default_factory=lambda: settings.PAGE_SIZE_DEFAULT,
+        ge=1,
+        description='Maximum number of items in the page, '
+                    'at most PAGE_SIZE_MAX'
+    )]
+    cursor: Annotated[str | None, Field(
+        default=None,
+        description='Opaque cursor from the X-Next-Cursor header '
+                    'of the previous page'
+    )]
+
+    @field_validator('limit')
+    @classmethod
+    def limit_at_most_page_size_max(cls, limit: int) -> int:
+        """The bound is read when validating, not when importing."""
+        if limit > settings.PAGE_SIZE_MAX:
+            raise ValueError(
+                f'Input should be less than or equal to '
+                f'{settings.PAGE_SIZE_MAX}')
+        return limit
+
+
+class ViewPageQuery(PageQuery):
+    """Pagination parameters of lists with a compact view."""
+    view: Annotated[Literal['full', 'compact'], Field(
+        default='full',
+        description="'compact' returns ids instead of nested user "
+                    "and account objects"
+    )]
+
+
+class TransactionQuery(ViewPageQuery):
+    """Pagination and filters for transaction lists."""
+    date_from: Annotated[date | None, Field(
+        default=None,
+        description='Earliest transaction date, inclusive'
+    )]
+    date_to: Annotated[date | None, Field(
+        default=None,
+        description='Latest transaction date, inclusive'
+    )]
+    category: Annotated[str | None, Field(
+        default=None,
+        description='Transaction category'
+    )]
+    account_id: Annotated[int | None, Field(
+        default=None,
+        description='The unique index of the account'
+    )]
+    amount_min: Annotated[MoneyInput | None, Field(
+        default=None,
+        description='Minimum transaction amount, inclusive'
+    )]
+    amount_max: Annotated[MoneyInput | None, Field(
+        default=None,
+        description='Maximum transaction amount, inclusive'
+    )]
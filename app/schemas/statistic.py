@@ -1,8 +1,11 @@
 """Data schemas for working with statistic calculating in FastAPI."""
-from typing import Annotated
+from datetime import date
+from typing import Annotated, Literal
 
 from pydantic import BaseModel, Field
 
+from .money import Money
+
 class StatsBase(BaseModel):
     """Basic schema for all statistic research."""
     pass
@@ -18,7 +21,7 @@ class UserBalanceStats(StatsBase):
         ...,
         description='The name of the REGISTERED user with the specified index'
     )]
-    total_amount: Annotated[float, Field(
+    total_amount: Annotated[Money, Field(
         ...,
         description='Total account amount'
     )]
@@ -42,7 +45,56 @@ class UserCategorySpending(StatsBase):
         ...,
         description='The category for which it is considered a waste'
     )]
-    cat_amount: Annotated[float, Field(
+    cat_amount: Annotated[Money, Field(
         ...,
         description='The total amount for the specified category'
     )]
+
+
+
+class TimeSeriesQuery(BaseModel):
+    """Range, bucket size and filter of a time series."""
+    date_from: Annotated[date | None, Field(
+        default=None,
+        description='Earliest transaction date, inclusive'
+    )]
+    date_to: Annotated[date | None, Field(
+        default=None,
+        description='Latest transaction date, inclusive'
+    )]
+    granularity: Annotated[Literal['day', 'week', 'month', 'year'], Field(
+        default='month',
+        description='Bucket size, weeks start on Monday'
+    )]
+    category: Annotated[str | None, Field(
+        default=None,
+        description='Only this category'
+    )]
+
+
+class TimeSeriesPoint(StatsBase):
+    """Income and expense of one category in one bucket."""
+    period: Annotated[date, Field(
+        ...,
+        description='First day of the bucket'
+    )]
+    category: Annotated[str, Field(
+        ...,
+        description='The category of the transactions'
+    )]
+    income: Annotated[Money, Field(
+        ...,
+        description='Sum of the non-negative amounts'
+    )]
+    expense: Annotated[Money, Field(
+        ...,
+        description='Sum of the negative amounts'
+    )]
+    net: Annotated[Money, Field(
+        ...,
+        description='Income plus expense'
+    )]
+    count: Annotated[int, Field(
+        ...,
+        description='Number of transactions'
+    )]
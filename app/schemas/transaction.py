@@ -1,16 +1,17 @@
 """Data schemas for working with transactions in FastAPI."""
 from datetime import date
-from typing import Annotated
+from typing import Annotated, List, Literal
 
 from pydantic import BaseModel, Field, validator
 
 from .account import AccountResponse
+from .money import Money, MoneyInput
 from .user import UserResponse
 
 class TransactionBase(BaseModel):
     """Basic schema for transactions."""
-    amount: Annotated[float, Field(
-        default=0.0,
+    amount: Annotated[Money, Field(
+        default=0,
         description='Transaction amount'
     )]
     category: Annotated[str, Field(
@@ -48,7 +49,10 @@ class TransactionBase(BaseModel):
 
 class TransactionCreate(TransactionBase):
     """Schema for creating new transactions."""
-    pass
+    amount: Annotated[MoneyInput, Field(
+        default=0,
+        description='Transaction amount'
+    )]
 
 
 class TransactionResponse(TransactionBase):
@@ -57,9 +61,83 @@ class TransactionResponse(TransactionBase):
         ...,
         description='Automatic unique indexing'
     )]
+    transfer_id: Annotated[int | None, Field(
+        default=None,
+        description='The transfer the transaction is a leg of'
+    )]
     user: UserResponse
     account: AccountResponse
 
     class Config:
         """Pydantic configuration."""
         from_attributes = True
+
+
+class TransactionCompact(TransactionBase):
+    """Transaction schema with ids instead of nested objects."""
+    id: Annotated[int, Field(
+        ...,
+        description='Automatic unique indexing'
+    )]
+    transfer_id: Annotated[int | None, Field(
+        default=None,
+        description='The transfer the transaction is a leg of'
+    )]
+
+    class Config:
+        """Pydantic configuration."""
+        from_attributes = True
+
+
+class BulkTransactionResult(BaseModel):
+    """Outcome of one item of a bulk request."""
+    index: Annotated[int, Field(
+        ...,
+        description='Position of the item in the request'
+    )]
+    status_code: Annotated[int, Field(
+        ...,
+        description='201 if created, otherwise the error of the single-item '
+                    'endpoint'
+    )]
+    id: Annotated[int | None, Field(
+        default=None,
+        description='Index of the created transaction'
+    )]
+    detail: Annotated[str | None, Field(
+        default=None,
+        description='Reason the item was rejected'
+    )]
+
+
+class BulkTransactionResponse(BaseModel):
+    """Summary of a bulk request."""
+    created: Annotated[int, Field(
+        ...,
+        description='Number of created transactions'
+    )]
+    failed: Annotated[int, Field(
+        ...,
+        description='Number of rejected items'
+    )]
+    results: List[BulkTransactionResult]
+
+
+class TransactionExportQuery(BaseModel):
+    """Format and filters of a transaction history export."""
+    format: Annotated[Literal['ndjson', 'csv'], Field(
+        default='ndjson',
+        description='One JSON object per line or CSV with a header row'
+    )]
+    date_from: Annotated[date | None, Field(
+        default=None,
+        description='Earliest transaction date, inclusive'
+    )]
+    date_to: Annotated[date | None, Field(
+        default=None,
+        description='Latest transaction date, inclusive'
+    )]
+    account_id: Annotated[int | None, Field(
+        default=None,
+        description='The unique index of the account'
+    )]
@@ -0,0 +1,54 @@
+"""Data schemas for working with transfers in FastAPI."""
+from datetime import date
+from typing import Annotated
+
+from pydantic import BaseModel, Field
+
+from .money import Money, MoneyInput
+
+
+class TransferBase(BaseModel):
+    """Basic schema for transfers."""
+    from_account_id: Annotated[int, Field(
+        ...,
+        description='The unique index of the account to debit'
+    )]
+    to_account_id: Annotated[int, Field(
+        ...,
+        description='The unique index of the account to credit, '
+                    'of the same holder'
+    )]
+    amount: Annotated[Money, Field(
+        ...,
+        gt=0,
+        description='Transferred amount'
+    )]
+
+
+class TransferCreate(TransferBase):
+    """Schema for creating new transfers."""
+    amount: Annotated[MoneyInput, Field(
+        ...,
+        gt=0,
+        description='Transferred amount'
+    )]
+
+
+class TransferResponse(TransferBase):
+    """Transfer schema for work with database."""
+    id: Annotated[int, Field(
+        ...,
+        description='Automatic unique indexing, the transfer_id of the legs'
+    )]
+    user_id: Annotated[int, Field(
+        ...,
+        description='The unique index of the holder of both accounts'
+    )]
+    date: Annotated[date, Field(
+        ...,
+        description='Date of transfer'
+    )]
+
+    class Config:
+        """Pydantic configuration."""
+        from_attributes = True
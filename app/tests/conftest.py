@@ -0,0 +1,13 @@
+'''Schema and administrator the tests run against'''
+import pytest
+
+from ..database.db import engine
+from ..database.migrations import upgrade
+from ..utils.init_admin import create_admin
+
+
+@pytest.fixture(scope='session', autouse=True)
+def database():
+    # The application no longer does this when imported
+    upgrade(engine)
+    create_admin()
@@ -0,0 +1,146 @@
+'''Idempotency-Key testing'''
+import time
+from decimal import Decimal
+
+import faker
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from ..database.db import async_engine
+from ..main import app
+from ..middleware.idempotency import entry_key, idempotency_store
+from ..utils import rate_limit
+from ..utils.config import settings
+from ..utils.response_cache import MemoryBackend, SQLiteBackend
+
+client = TestClient(app)
+fake = faker.Faker()
+
+client.user_login = fake.user_name() + fake.pystr(max_chars=6)
+client.user_password = fake.password()
+
+
+def setup_module():
+    user = client.post(
+        '/users/register',
+        json={'login': client.user_login, 'password': client.user_password}
+    ).json()
+    client.user_id = user['id']
+    token = client.get(
+        '/users/get-token',
+        auth=(client.user_login, client.user_password)
+    ).json()['access_token']
+    client.bearer = {'Authorization': f'Bearer {token}'}
+    client.account_id = client.post(
+        '/accounts/',
+        json={'account_name': 'main', 'amount': 100,
+              'user_id': client.user_id},
+        headers={**client.bearer, 'Idempotency-Key': fake.uuid4()}
+    ).json()['id']
+
+
+def balance() -> Decimal:
+    return Decimal(client.get('/accounts/0',
+                              headers=client.bearer).json()[0]['amount'])
+
+
+def test_retry_is_replayed_without_running_the_request():
+    headers = {**client.bearer, 'Idempotency-Key': fake.uuid4()}
+    item = {'amount': -30, 'category': 'Products',
+            'user_id': client.user_id, 'account_id': client.account_id}
+    first = client.post('/transactions/', json=item, headers=headers)
+    assert first.status_code == 201
+    assert 'idempotent-replayed' not in first.headers
+
+    statements = []
+
+    def record(*args):
+        statements.append(args[2])
+
+    event.listen(async_engine.sync_engine, 'before_cursor_execute', record)
+    try:
+        retry = client.post('/transactions/', json=item, headers=headers)
+    finally:
+        event.remove(async_engine.sync_engine, 'before_cursor_execute',
+                     record)
+    assert statements == []
+    assert retry.status_code == 201
+    assert retry.headers['idempotent-replayed'] == 'true'
+    assert retry.json() == first.json()
+    assert balance() == 70
+
+    # The same key with another body is refused, a new key runs again
+    assert client.post('/transactions/', json={**item, 'amount': -1},
+                       headers=headers).status_code == 422
+    assert client.post('/transactions/', json=item, headers={
+        **client.bearer, 'Idempotency-Key': fake.uuid4()
+    }).status_code == 201
+    assert balance() == 40
+
+
+def test_keys_are_scoped_by_credentials():
+    key = fake.uuid4()
+    item = {'amount': 5, 'category': 'Gift',
+            'user_id': client.user_id, 'account_id': client.account_id}
+    assert client.post('/transactions/', json=item, headers={
+        'Idempotency-Key': key
+    }).status_code == 401
+    assert client.post('/transactions/', json=item, headers={
+        **client.bearer, 'Idempotency-Key': key
+    }).status_code == 201
+
+
+def test_request_in_progress_and_errors():
+    key = fake.uuid4()
+    headers = {**client.bearer, 'Idempotency-Key': key}
+    item = {'amount': -10 ** 6, 'category': 'Products',
+            'user_id': client.user_id, 'account_id': client.account_id}
+    refused = client.post('/transactions/', json=item, headers=headers)
+    assert refused.status_code == 406
+    assert client.post('/transactions/', json=item,
+                       headers=headers).json() == refused.json()
+
+    # A concurrent first request still running
+    pending = entry_key(headers['Authorization'].encode(), key.encode())
+    entry = idempotency_store.backend.get(pending)
+    idempotency_store.backend.set(pending, {
+        'fingerprint': entry['fingerprint'], 'pending': time.time()})
+    assert client.post('/transactions/', json=item,
+                       headers=headers).status_code == 409
+
+    assert client.post('/transactions/', json=item, headers={
+        **client.bearer, 'Idempotency-Key': 'k' * 256
+    }).status_code == 400
+    assert client.get('/status').json()['idempotency']['replays'] >= 2
+
+
+def test_rate_limited_request_is_not_stored(monkeypatch):
+    monkeypatch.setattr(rate_limit, 'limits', MemoryBackend(1000, 3600))
+    monkeypatch.setattr(settings, 'RATE_LIMIT_CLIENT_BURST', 1)
+    monkeypatch.setattr(settings, 'RATE_LIMIT_CLIENT_PER_SECOND', 0.01)
+    headers = {'Idempotency-Key': fake.uuid4()}
+    user = {'login': fake.user_name() + fake.pystr(max_chars=6),
+            'password': fake.password()}
+    client.post('/users/register', json={
+        'login': fake.user_name() + fake.pystr(max_chars=6),
+        'password': fake.password()})
+    limited = client.post('/users/register', json=user, headers=headers)
+    assert limited.status_code == 429
+
+    # Retried once the limit allows it, the request runs
+    rate_limit.limits.clear()
+    retried = client.post('/users/register', json=user, headers=headers)
+    assert retried.status_code == 201
+    assert 'idempotent-replayed' not in retried.headers
+
+
+def test_sqlite_backend_add(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'keys.db'), maxsize=10, ttl=60)
+    shared = SQLiteBackend(str(tmp_path / 'keys.db'), maxsize=10, ttl=60)
+    assert backend.add('key', {'pending': 1})
+    assert not shared.add('key', {'pending': 2})
+    assert shared.get('key') == {'pending': 1}
+
+    expired = SQLiteBackend(str(tmp_path / 'keys.db'), maxsize=10, ttl=-1)
+    expired.add('old', {})
+    assert backend.add('old', {'pending': 3})
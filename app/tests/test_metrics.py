@@ -0,0 +1,64 @@
+'''/metrics testing'''
+import faker
+from fastapi.testclient import TestClient
+
+from ..main import app
+from ..utils.metrics import metrics
+
+client = TestClient(app)
+fake = faker.Faker()
+
+client.user_login = fake.user_name() + fake.pystr(max_chars=6)
+client.user_password = fake.password()
+
+
+def sample(text: str, name: str, labels: str) -> float:
+    prefix = f'{name}{{{labels}}} '
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return 0.0
+
+
+def test_disabled_by_default():
+    assert not metrics.enabled
+    before = metrics.requests.count(('GET', '/', '200'))
+    assert client.get('/').status_code == 200
+    assert metrics.requests.count(('GET', '/', '200')) == before
+    assert client.get('/metrics').status_code == 404
+
+
+def test_request_sql_and_password_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', True)
+    user_id = client.post(
+        '/users/register',
+        json={'login': client.user_login, 'password': client.user_password}
+    ).json()['id']
+    token = client.get(
+        '/users/get-token',
+        auth=(client.user_login, client.user_password)
+    ).json()['access_token']
+    bearer = {'Authorization': f'Bearer {token}'}
+    client.post('/accounts/', json={'account_name': 'main', 'amount': 10,
+                                    'user_id': user_id}, headers=bearer)
+    for _ in range(3):
+        assert client.get('/accounts/0', headers=bearer).status_code == 200
+    assert client.get('/no-such-page').status_code == 404
+
+    text = client.get('/metrics').text
+    route = 'method="GET",route="/accounts/{user_id}"'
+    assert sample(text, 'http_request_duration_seconds_count',
+                  route + ',status="200"') >= 3
+    assert sample(text, 'db_statements_per_request_count', route) >= 3
+    assert sample(text, 'db_statements_per_request_sum', route) >= 3
+    assert sample(text, 'db_seconds_per_request_sum', route) > 0
+    assert sample(text, 'http_request_duration_seconds_count',
+                  'method="GET",route="unmatched",status="404"') >= 1
+    assert sample(text, 'password_hash_duration_seconds_count',
+                  'operation="hash"') >= 1
+    assert sample(text, 'password_hash_duration_seconds_count',
+                  'operation="verify"') >= 1
+    assert sample(text, 'password_seconds_per_request_sum',
+                  'method="GET",route="/users/get-token"') > 0
+    assert ('http_request_duration_seconds_bucket{method="GET",'
+            'route="/accounts/{user_id}",status="200",le="+Inf"}') in text
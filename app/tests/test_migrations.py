@@ -0,0 +1,26 @@
+'''Schema migrations testing'''
+import pytest
+from sqlalchemy import create_engine, text
+
+from ..database.migrations import _stamp, upgrade
+from ..database.models import Base
+
+
+def test_duplicate_logins_stop_the_unique_index(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "legacy.db"}')
+    # A database of version 1, whose logins were never unique
+    with engine.begin() as connection:
+        Base.metadata.create_all(connection)
+        connection.execute(text('CREATE TABLE schema_version '
+                                '(version INTEGER NOT NULL)'))
+        _stamp(connection, 1)
+        connection.execute(text('DROP INDEX ix_users_login'))
+        connection.execute(text(
+            "INSERT INTO users (login, is_admin, password) "
+            "VALUES ('anna', 0, 'x'), ('anna', 0, 'y'), ('boris', 0, 'z')"))
+
+    with pytest.raises(RuntimeError, match="'anna' x2"):
+        upgrade(engine)
+    with engine.connect() as connection:
+        assert connection.execute(
+            text('SELECT version FROM schema_version')).scalar() == 1
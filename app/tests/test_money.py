@@ -0,0 +1,231 @@
+'''
+Exact money: balances against the sum of their transactions after
+random operations
+
+MONEY_OPERATIONS sets the number of balance changes of the storage test
+(MONEY_OPERATIONS=1000000 for a long run, about 25 minutes),
+MONEY_API_OPERATIONS the number of requests of the endpoint test and
+MONEY_SEED the sequence.
+'''
+import asyncio
+import os
+import random
+from decimal import Decimal
+
+import faker
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+from sqlalchemy import create_engine, delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from ..database.aggregates import apply_balances, verify_statistics
+from ..database.balances import change_balances
+from ..database.db import engine
+from ..database.models import Account, Base, Transaction, User
+from ..main import app
+from ..routes import account as account_routes
+from ..schemas.statistic import UserBalanceStats
+from ..schemas.transaction import TransactionCreate
+
+OPERATIONS = int(os.environ.get('MONEY_OPERATIONS', 5_000))
+API_OPERATIONS = int(os.environ.get('MONEY_API_OPERATIONS', 150))
+SEED = int(os.environ.get('MONEY_SEED', 0))
+
+client = TestClient(app)
+fake = faker.Faker()
+
+client.user_login = fake.user_name() + fake.pystr(max_chars=6)
+client.user_password = fake.password()
+
+
+def setup_module():
+    user = client.post(
+        '/users/register',
+        json={'login': client.user_login, 'password': client.user_password}
+    ).json()
+    client.user_id = user['id']
+    token = client.get(
+        '/users/get-token',
+        auth=(client.user_login, client.user_password)
+    ).json()['access_token']
+    client.bearer = {'Authorization': f'Bearer {token}'}
+
+
+def random_amount(rng: random.Random, limit: int = 50_000) -> Decimal:
+    '''Amount of up to ``limit`` minor units with a random sign'''
+    return Decimal(rng.randint(-limit, limit)).scaleb(-2)
+
+
+def test_money_schema_is_exact():
+    trans = TransactionCreate.model_validate_json('{"amount": 0.1}')
+    assert trans.amount == Decimal('0.1')
+    assert trans.category == 'Other income'
+    assert TransactionCreate(amount=Decimal('-0.30')).model_dump(
+        mode='json')['amount'] == '-0.30'
+    with pytest.raises(ValidationError):
+        TransactionCreate(amount=Decimal('0.001'))
+    with pytest.raises(ValidationError):
+        TransactionCreate(amount=Decimal('12345678901234567.89'))
+    largest = TransactionCreate(amount=Decimal('9999999999999999.99'))
+    assert largest.model_dump(mode='json')['amount'] == '9999999999999999.99'
+
+
+def test_sums_have_no_digit_limit():
+    stats = UserBalanceStats(
+        user_id=1, user_name='holder', account_count=12,
+        total_amount=Decimal('9999999999999999.99') * 12,
+        avg_transaction_per_day=0, avg_transaction_per_month=0)
+    assert stats.model_dump(mode='json')['total_amount'] == \
+        '119999999999999999.88'
+
+
+async def random_ledger(path, operations: int, rng: random.Random):
+    '''
+    Random creations, deletions and changes of transactions of one
+    account, every balance change made by change_balances
+    Returns the balance the operations should leave
+    '''
+    memory = create_async_engine(f'sqlite+aiosqlite:///{path}')
+    async with memory.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all, tables=[
+            User.__table__, Account.__table__, Transaction.__table__])
+        await connection.execute(insert(Account).values(id=1, amount=0))
+
+    ledger, expected, next_id = {}, Decimal(0), 1
+    async with AsyncSession(memory) as db:
+        for step in range(operations):
+            operation = rng.random()
+            if operation < 0.6 or not ledger:
+                amount = random_amount(rng)
+                if not await change_balances(db, {1: amount}):
+                    await db.execute(insert(Transaction).values(
+                        id=next_id, amount=amount, account_id=1))
+                    ledger[next_id] = amount
+                    next_id += 1
+                    expected += amount
+            elif operation < 0.8:
+                trans_id = rng.choice(list(ledger))
+                if not await change_balances(db, {1: -ledger[trans_id]}):
+                    await db.execute(delete(Transaction).filter(
+                        Transaction.id == trans_id))
+                    expected -= ledger.pop(trans_id)
+            else:
+                trans_id = rng.choice(list(ledger))
+                amount = random_amount(rng)
+                if not await change_balances(
+                        db, {1: amount - ledger[trans_id]}):
+                    await db.execute(update(Transaction).filter(
+                        Transaction.id == trans_id).values(amount=amount))
+                    expected += amount - ledger[trans_id]
+                    ledger[trans_id] = amount
+            if step % 1000 == 999:
+                await db.commit()
+        await db.commit()
+    await memory.dispose()
+    return expected
+
+
+def test_stored_balance_equals_sum_of_transactions(tmp_path):
+    expected = asyncio.run(random_ledger(tmp_path / 'ledger.db', OPERATIONS,
+                                         random.Random(SEED)))
+    memory = create_engine(f'sqlite:///{tmp_path / "ledger.db"}')
+    with memory.connect() as connection:
+        balance = connection.execute(select(Account.amount)).scalar()
+        total = connection.execute(
+            select(func.sum(Transaction.amount))).scalar() or 0
+    assert balance == total == expected
+    assert balance >= 0
+
+
+def transactions_of(account_id: int) -> list:
+    '''Every transaction of the account, page by page'''
+    items, cursor = [], None
+    while True:
+        params = {'account_id': account_id, 'view': 'compact',
+                  'limit': 1000}
+        if cursor:
+            params['cursor'] = cursor
+        page = client.get(f'/transactions/{client.user_id}', params=params,
+                          headers=client.bearer)
+        items += page.json()
+        if not (cursor := page.headers.get('X-Next-Cursor')):
+            return items
+
+
+def test_balance_equals_sum_of_transactions_through_endpoints():
+    rng = random.Random(SEED)
+    initial = abs(random_amount(rng))
+    account_id = client.post(
+        '/accounts/',
+        json={'account_name': 'random', 'amount': float(initial),
+              'user_id': client.user_id},
+        headers=client.bearer
+    ).json()['id']
+
+    created = []
+    for _ in range(API_OPERATIONS):
+        operation = rng.random()
+        amount = random_amount(rng, 10_000)
+        item = {'amount': float(amount),
+                'category': 'Gift' if amount >= 0 else 'Products',
+                'user_id': client.user_id, 'account_id': account_id}
+        if operation < 0.6 or not created:
+            response = client.post('/transactions/', json=item,
+                                   headers=client.bearer)
+            if response.status_code == 201:
+                created.append(response.json()['id'])
+        elif operation < 0.8:
+            response = client.delete(
+                f'/transactions/{created[-1]}', headers=client.bearer)
+            if response.status_code == 200:
+                created.pop()
+        else:
+            response = client.put(
+                f'/transactions/{rng.choice(created)}', json=item,
+                headers=client.bearer)
+        assert response.status_code in (200, 201, 406)
+
+    account = next(acc for acc in client.get(
+        '/accounts/0', params={'view': 'compact'}, headers=client.bearer
+    ).json() if acc['id'] == account_id)
+    ledger = transactions_of(account_id)
+    assert len(ledger) == len(created)
+    assert (Decimal(account['amount'])
+            == initial + sum(Decimal(trans['amount'])
+                             for trans in ledger))
+
+    with engine.connect() as connection:
+        assert verify_statistics(connection) == []
+
+
+def test_account_change_sees_a_balance_change_made_meanwhile(monkeypatch):
+    account_id = client.post(
+        '/accounts/',
+        json={'account_name': 'meanwhile', 'amount': 100,
+              'user_id': client.user_id},
+        headers=client.bearer
+    ).json()['id']
+    check_user_exists = account_routes.check_user_exists
+
+    async def changed_meanwhile(user_id, db):
+        # A transaction lands after the route has read the account
+        await change_balances(db, {account_id: Decimal(5)})
+        await apply_balances(db, {client.user_id: Decimal(5)})
+        return await check_user_exists(user_id, db)
+
+    monkeypatch.setattr(account_routes, 'check_user_exists',
+                        changed_meanwhile)
+    assert client.put(
+        f'/accounts/{account_id}',
+        json={'account_name': 'meanwhile', 'amount': 50,
+              'user_id': client.user_id},
+        headers=client.bearer
+    ).status_code == 200
+    response = client.delete(f'/accounts/{account_id}',
+                             headers=client.bearer)
+    assert response.status_code == 200
+    assert response.json()['amount'] == '55.00'
+
+    with engine.connect() as connection:
+        assert verify_statistics(connection) == []
@@ -0,0 +1,133 @@
+'''Rate limiting testing'''
+import faker
+import pytest
+from fastapi.testclient import TestClient
+
+from ..main import app
+from ..utils import authorisation_password, rate_limit
+from ..utils.authorisation_password import password_service
+from ..utils.cache import TTLCache
+from ..utils.config import settings
+from ..utils.response_cache import MemoryBackend, SQLiteBackend
+
+client = TestClient(app)
+fake = faker.Faker()
+
+client.user_login = fake.user_name() + fake.pystr(max_chars=6)
+client.user_password = fake.password()
+
+
+def setup_module():
+    client.post(
+        '/users/register',
+        json={'login': client.user_login, 'password': client.user_password}
+    )
+
+
+@pytest.fixture(autouse=True)
+def fresh_limits(monkeypatch):
+    monkeypatch.setattr(rate_limit, 'limits', MemoryBackend(1000, 3600))
+    # Credentials verified by an earlier test would skip the limits
+    monkeypatch.setattr(authorisation_password, 'verified_credentials',
+                        TTLCache(1000, 300))
+
+
+@pytest.fixture
+def verifications(monkeypatch):
+    calls = []
+    verify = password_service.verify
+
+    async def counted(password, hashed):
+        calls.append(password)
+        return await verify(password, hashed)
+
+    monkeypatch.setattr(password_service, 'verify', counted)
+    return calls
+
+
+def test_client_bucket_of_a_route(monkeypatch):
+    monkeypatch.setattr(settings, 'RATE_LIMIT_CLIENT_BURST', 3)
+    monkeypatch.setattr(settings, 'RATE_LIMIT_CLIENT_PER_SECOND', 0.01)
+    assert [client.get('/').status_code for _ in range(4)] == [
+        200, 200, 200, 429]
+    assert int(client.get('/').headers['Retry-After']) > 1
+    # Another route has a bucket of its own
+    assert client.get('/status').status_code == 200
+
+    monkeypatch.setattr(settings, 'RATE_LIMIT_ENABLED', False)
+    assert client.get('/').status_code == 200
+
+
+def test_user_bucket_counts_every_user_id_of_a_route(monkeypatch):
+    monkeypatch.setattr(settings, 'RATE_LIMIT_USER_BURST', 2)
+    monkeypatch.setattr(settings, 'RATE_LIMIT_USER_PER_SECOND', 0.01)
+    token = client.get(
+        '/users/get-token', auth=(client.user_login, client.user_password)
+    ).json()['access_token']
+    bearer = {'Authorization': f'Bearer {token}'}
+    assert client.get('/accounts/0', headers=bearer).status_code == 200
+    assert client.get('/accounts/0', headers=bearer).status_code == 200
+    assert client.get('/accounts/1', headers=bearer).status_code == 429
+    user_id = client.get('/users/authorise-with-token',
+                         headers=bearer).json()['id']
+    assert client.get(f'/stats/user-balances/{user_id}',
+                      headers=bearer).status_code == 200
+
+
+def test_failed_logins_back_off_before_argon2(monkeypatch, verifications):
+    monkeypatch.setattr(settings, 'LOGIN_BACKOFF_FREE_FAILURES', 2)
+    monkeypatch.setattr(settings, 'LOGIN_BACKOFF_BASE', 30)
+    wrong = (client.user_login, 'wrong' + client.user_password)
+    assert [client.get('/users/get-token', auth=wrong).status_code
+            for _ in range(3)] == [401, 401, 401]
+    assert len(verifications) == 3
+
+    response = client.get('/users/authorise-with-password', auth=wrong)
+    assert response.status_code == 429
+    assert 25 < int(response.headers['Retry-After']) <= 30
+    # The right password waits too, without reaching argon2
+    assert client.get(
+        '/users/get-token', auth=(client.user_login, client.user_password)
+    ).status_code == 429
+    assert len(verifications) == 3
+
+    # The backoff doubles with every further failure
+    rate_limit.limits.clear()
+    for _ in range(4):
+        rate_limit.password_failed(client.user_login, 'testclient')
+    backoff = rate_limit.limits.get(
+        rate_limit.backoff_key(client.user_login, 'testclient'))
+    assert backoff[0] == 4
+    assert client.get('/users/get-token', auth=wrong).status_code == 429
+    assert 55 < int(client.get('/users/get-token', auth=wrong)
+                    .headers['Retry-After']) <= 60
+
+
+def test_success_forgets_the_failures(monkeypatch, verifications):
+    monkeypatch.setattr(settings, 'LOGIN_BACKOFF_FREE_FAILURES', 1)
+    wrong = (client.user_login, 'wrong' + client.user_password)
+    assert client.get('/users/get-token', auth=wrong).status_code == 401
+    assert client.get(
+        '/users/get-token', auth=(client.user_login, client.user_password)
+    ).status_code == 200
+    assert client.get('/users/get-token', auth=wrong).status_code == 401
+
+
+def test_password_bucket_of_a_login(monkeypatch, verifications):
+    monkeypatch.setattr(settings, 'LOGIN_BACKOFF_FREE_FAILURES', 100)
+    monkeypatch.setattr(settings, 'PASSWORD_LOGIN_BURST', 2)
+    monkeypatch.setattr(settings, 'PASSWORD_LOGIN_PER_SECOND', 0.01)
+    guesses = [(client.user_login, fake.password()) for _ in range(4)]
+    assert [client.get('/accounts/0', auth=guess).status_code
+            for guess in guesses] == [401, 401, 429, 429]
+    assert len(verifications) == 2
+
+
+def test_sqlite_buckets_are_shared(tmp_path, monkeypatch):
+    path = str(tmp_path / 'rate_limit.db')
+    workers = [SQLiteBackend(path, maxsize=100, ttl=60) for _ in range(2)]
+    taken = []
+    for turn in range(6):
+        monkeypatch.setattr(rate_limit, 'limits', workers[turn % 2])
+        taken.append(rate_limit.take_token('client:a', 4, 0.001) == 0)
+    assert taken == [True] * 4 + [False] * 2
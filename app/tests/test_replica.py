@@ -0,0 +1,130 @@
+'''Replica routing testing, the replica being a copy of the database file'''
+import json
+import sqlite3
+from decimal import Decimal
+
+import faker
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from ..database import db, replica
+from ..database.db import async_engine, engine
+from ..main import app
+from ..utils.config import settings
+from ..utils.response_cache import balance_key, stats_cache
+from ..utils.shared_state import shared_state
+
+client = TestClient(app)
+fake = faker.Faker()
+
+client.user_login = fake.user_name() + fake.pystr(max_chars=6)
+client.user_password = fake.password()
+
+
+def setup_module():
+    user = client.post(
+        '/users/register',
+        json={'login': client.user_login, 'password': client.user_password}
+    ).json()
+    client.user_id = user['id']
+    token = client.get(
+        '/users/get-token',
+        auth=(client.user_login, client.user_password)
+    ).json()['access_token']
+    client.bearer = {'Authorization': f'Bearer {token}'}
+    client.account_id = client.post(
+        '/accounts/',
+        json={'account_name': 'main', 'amount': 100,
+              'user_id': client.user_id},
+        headers=client.bearer
+    ).json()['id']
+
+
+def copy_as_replica(path) -> async_sessionmaker:
+    '''Snapshot of the primary, a replica which never catches up'''
+    source = sqlite3.connect(engine.url.database)
+    target = sqlite3.connect(path)
+    source.backup(target)
+    source.close()
+    target.close()
+    return async_sessionmaker(
+        autoflush=False,
+        expire_on_commit=False,
+        bind=create_async_engine(f'sqlite+aiosqlite:///{path}'),
+        info={'replica': True}
+    )
+
+
+def write(amount: int):
+    assert client.post('/transactions/', json={
+        'amount': amount, 'category': 'Gift',
+        'user_id': client.user_id, 'account_id': client.account_id
+    }, headers=client.bearer).status_code == 201
+
+
+def balance() -> Decimal:
+    return Decimal(client.get('/accounts/0',
+                              headers=client.bearer).json()[0]['amount'])
+
+
+def stats_total() -> Decimal:
+    return Decimal(client.get(f'/stats/user-balances/{client.user_id}',
+                              headers=client.bearer).json()['total_amount'])
+
+
+def test_reads_go_to_the_replica(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'replica_session_local',
+                        copy_as_replica(tmp_path / 'replica.db'))
+    monkeypatch.setattr(settings, 'READ_YOUR_WRITES_SECONDS', 0)
+    write(5)
+
+    assert balance() == 100
+    assert stats_total() == 100
+    assert stats_cache.get(balance_key(client.user_id)) is None
+    transactions = client.get(f'/transactions/{client.user_id}',
+                              headers=client.bearer).json()
+    assert transactions == []
+    # The primary has the write
+    monkeypatch.setattr(db, 'replica_session_local',
+                        copy_as_replica(tmp_path / 'caught-up.db'))
+    assert balance() == 105
+    assert stats_total() == 105
+
+
+def test_read_your_writes(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'replica_session_local',
+                        copy_as_replica(tmp_path / 'replica.db'))
+    monkeypatch.setattr(settings, 'READ_YOUR_WRITES_SECONDS', 60)
+    stale = balance()
+    write(7)
+
+    assert balance() == stale + 7
+    export = client.get(f'/transactions/{client.user_id}/export',
+                        headers=client.bearer).text.splitlines()
+    assert json.loads(export[-1])['amount'] == '7.00'
+
+    # Another user still reads the replica
+    admin = {'Authorization': 'Basic YWRtaW46YWRtaW4='}
+    accounts = client.get(f'/accounts/{client.user_id}', headers=admin).json()
+    assert Decimal(accounts[0]['amount']) == stale
+
+    shared_state.delete([replica.writer_key(client.user_id)])
+    assert balance() == stale
+
+
+def test_primary_reads_share_the_request_session():
+    checkouts = []
+
+    def record(*args):
+        checkouts.append(args)
+
+    pool = async_engine.sync_engine.pool
+    event.listen(pool, 'checkout', record)
+    try:
+        response = client.get('/accounts/0', auth=(client.user_login,
+                                                   client.user_password))
+    finally:
+        event.remove(pool, 'checkout', record)
+    assert response.status_code == 200
+    assert len(checkouts) == 1
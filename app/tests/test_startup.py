@@ -0,0 +1,38 @@
+'''Startup testing, every check runs in a fresh interpreter'''
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+SERVE = '''
+from fastapi.testclient import TestClient
+from app.main import app
+with TestClient(app) as client:
+    print(client.get('/users/get-all', auth=('admin', 'admin')).status_code)
+'''
+
+
+def run(tmp_path, *args) -> str:
+    env = {**os.environ, 'DB_URL': f'sqlite:///{tmp_path / "wallet.db"}'}
+    return subprocess.run([sys.executable, *args], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=True).stdout
+
+
+def test_import_does_not_touch_the_database(tmp_path):
+    output = run(tmp_path, '-c', 'import app.main\n'
+                 'from app.utils.config import get_settings\n'
+                 'print(get_settings.cache_info().misses)')
+    # Neither the settings nor anything built from them were read
+    assert output.split()[-1] == '0'
+    assert not (tmp_path / 'wallet.db').exists()
+
+
+def test_lifespan_migrates_and_admin_is_created_once(tmp_path):
+    # The schema comes from the lifespan, nobody is allowed in yet
+    assert run(tmp_path, '-c', SERVE).split()[-1] == '401'
+    assert 'created' in run(tmp_path, '-m', 'app.manage', 'create-admin')
+    assert 'already exists' in run(tmp_path, '-m', 'app.manage',
+                                   'create-admin')
+    assert run(tmp_path, '-c', SERVE).split()[-1] == '200'
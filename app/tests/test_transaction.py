@@ -0,0 +1,506 @@
+'''Accounts, transactions and statistics experience testing'''
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import faker
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from ..database.aggregates import verify_statistics
+from ..database.db import async_engine, engine
+from ..main import app
+from ..utils.response_cache import SQLiteBackend, stats_cache
+
+client = TestClient(app)
+fake = faker.Faker()
+
+client.user_login = fake.user_name() + fake.pystr(max_chars=6)
+client.user_password = fake.password()
+
+
+def setup_module():
+    user = client.post(
+        '/users/register',
+        json={'login': client.user_login, 'password': client.user_password}
+    ).json()
+    client.user_id = user['id']
+    client.token = client.get(
+        '/users/get-token',
+        auth=(client.user_login, client.user_password)
+    ).json()['access_token']
+    client.bearer = {'Authorization': f'Bearer {client.token}'}
+
+
+def test_bearer_token_on_resource_routes():
+    account = client.post(
+        '/accounts/',
+        json={'account_name': 'main', 'amount': 100,
+              'user_id': client.user_id},
+        headers=client.bearer
+    )
+    assert account.status_code == 201
+    client.account_id = account.json()['id']
+
+    transaction = client.post(
+        '/transactions/',
+        json={'amount': -30, 'category': 'Products',
+              'user_id': client.user_id, 'account_id': client.account_id},
+        headers=client.bearer
+    )
+    assert transaction.status_code == 201
+    assert transaction.json()['account']['amount'] == '70.00'
+
+    stats = client.get(f'/stats/user-balances/{client.user_id}',
+                       headers=client.bearer)
+    assert stats.status_code == 200
+    assert stats.json()['total_amount'] == '70.00'
+
+
+def test_basic_credentials_still_accepted():
+    response = client.get('/accounts/0',
+                          auth=(client.user_login, client.user_password))
+    assert response.status_code == 200
+    assert [acc['id'] for acc in response.json()] == [client.account_id]
+
+
+def test_missing_credentials():
+    assert client.get('/accounts/0').status_code == 401
+    response = client.get('/accounts/0',
+                          headers={'Authorization': 'Bearer not-a-token'})
+    assert response.status_code == 401
+
+
+def test_transactions_pagination_and_filters():
+    for amount, category in [(5, 'Salary'), (-1, 'Clothing'),
+                             (7, 'Bonus'), (-2, 'Clothing')]:
+        response = client.post(
+            '/transactions/',
+            json={'amount': amount, 'category': category,
+                  'user_id': client.user_id,
+                  'account_id': client.account_id},
+            headers=client.bearer
+        )
+        assert response.status_code == 201
+
+    seen, cursor = [], None
+    while True:
+        params = {'limit': 2}
+        if cursor:
+            params['cursor'] = cursor
+        response = client.get(f'/transactions/{client.user_id}',
+                              params=params, headers=client.bearer)
+        assert response.status_code == 200
+        assert len(response.json()) <= 2
+        seen += [item['id'] for item in response.json()]
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+    assert len(seen) == 5
+    assert seen == sorted(seen)
+
+    clothing = client.get(f'/transactions/{client.user_id}',
+                          params={'category': 'Clothing', 'amount_max': -1.5},
+                          headers=client.bearer)
+    assert [item['amount'] for item in clothing.json()] == ['-2.00']
+
+    wrong = client.get(f'/transactions/{client.user_id}',
+                       params={'cursor': 'garbage'}, headers=client.bearer)
+    assert wrong.status_code == 400
+
+
+def test_export_transactions():
+    ndjson = client.get(f'/transactions/{client.user_id}/export',
+                        headers=client.bearer)
+    assert ndjson.status_code == 200
+    assert ndjson.headers['content-type'] == 'application/x-ndjson'
+    lines = ndjson.text.splitlines()
+    assert len(lines) == 5
+
+    csv_export = client.get(f'/transactions/{client.user_id}/export',
+                            params={'format': 'csv',
+                                    'account_id': client.account_id},
+                            headers=client.bearer)
+    rows = csv_export.text.splitlines()
+    assert rows[0] == 'id,date,category,amount,account_id'
+    assert len(rows) == 6
+    assert csv_export.text.count('\r\n') == csv_export.text.count('\n')
+
+
+def count_statements(path, **kwargs):
+    statements = []
+
+    def record(*args):
+        statements.append(args[2])
+
+    event.listen(async_engine.sync_engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(path, headers=client.bearer, **kwargs)
+    finally:
+        event.remove(async_engine.sync_engine, 'before_cursor_execute',
+                     record)
+    assert response.status_code == 200
+    return response, len(statements)
+
+
+def test_list_statement_count_is_constant():
+    for path in [f'/transactions/{client.user_id}', '/accounts/0']:
+        for view in ['full', 'compact']:
+            one, few = count_statements(path,
+                                        params={'limit': 1, 'view': view})
+            five, many = count_statements(path,
+                                          params={'limit': 5, 'view': view})
+            assert len(one.json()) <= len(five.json())
+            assert few == many <= 2
+
+
+def test_compact_view():
+    full = client.get(f'/transactions/{client.user_id}',
+                      headers=client.bearer).json()
+    compact = client.get(f'/transactions/{client.user_id}',
+                         params={'view': 'compact'},
+                         headers=client.bearer).json()
+    assert 'account' in full[0] and 'user' in full[0]
+    assert 'account' not in compact[0] and 'user' not in compact[0]
+    assert [item['id'] for item in full] == [item['id'] for item in compact]
+
+
+def test_bulk_transactions():
+    balance = client.get('/accounts/0', headers=client.bearer).json()[0]
+    items = [
+        {'amount': 10, 'category': 'Gift', 'user_id': client.user_id,
+         'account_id': client.account_id, 'date': '2024-01-15'},
+        {'amount': -5, 'category': 'Salary', 'user_id': client.user_id,
+         'account_id': client.account_id},
+        {'amount': -10 ** 6, 'category': 'Products',
+         'user_id': client.user_id, 'account_id': client.account_id},
+        {'amount': -3, 'category': 'Products', 'user_id': client.user_id,
+         'account_id': 10 ** 9},
+        {'amount': -4, 'user_id': client.user_id,
+         'account_id': client.account_id},
+    ]
+    response = client.post('/transactions/bulk', json=items,
+                           headers=client.bearer)
+    assert response.status_code == 200
+    body = response.json()
+    assert (body['created'], body['failed']) == (2, 3)
+    assert [item['status_code'] for item in body['results']] == \
+        [201, 404, 406, 404, 201]
+    assert body['results'][0]['id'] is not None
+
+    after = client.get('/accounts/0', headers=client.bearer).json()[0]
+    assert Decimal(after['amount']) == Decimal(balance['amount']) + 6
+    first = client.get(f'/transactions/{client.user_id}',
+                       params={'date_to': '2024-01-31'},
+                       headers=client.bearer).json()
+    assert [item['id'] for item in first] == [body['results'][0]['id']]
+
+
+def test_precomputed_statistics_follow_the_ledger():
+    items = [
+        {'amount': 40, 'category': 'Bonus', 'user_id': client.user_id,
+         'account_id': client.account_id, 'date': '2023-03-02'},
+        {'amount': -15, 'category': 'Clothing', 'user_id': client.user_id,
+         'account_id': client.account_id, 'date': '2023-03-20'},
+        {'amount': -5, 'category': 'Clothing', 'user_id': client.user_id,
+         'account_id': client.account_id, 'date': '2023-03-21'},
+    ]
+    created = [result['id'] for result in client.post(
+        '/transactions/bulk', json=items, headers=client.bearer
+    ).json()['results']]
+
+    changed = client.put(
+        f'/transactions/{created[1]}',
+        json={'amount': -12, 'category': 'Products',
+              'user_id': client.user_id, 'account_id': client.account_id},
+        headers=client.bearer
+    )
+    assert changed.status_code == 200
+    assert client.delete(f'/transactions/{created[2]}',
+                         headers=client.bearer).status_code == 200
+
+    month = client.get(f'/stats/monthly-category-spent/{client.user_id}',
+                       params={'month_trans': 3, 'year_trans': 2023},
+                       headers=client.bearer).json()
+    assert month == [{'category': 'Products', 'cat_amount': '-12.00'},
+                     {'category': 'Bonus', 'cat_amount': '40.00'}]
+
+    accounts = client.get('/accounts/0', headers=client.bearer).json()
+    stats = client.get(f'/stats/user-balances/{client.user_id}',
+                       headers=client.bearer).json()
+    assert Decimal(stats['total_amount']) == sum(Decimal(acc['amount'])
+                                                 for acc in accounts)
+    assert stats['account_count'] == len(accounts)
+
+    with engine.connect() as connection:
+        assert verify_statistics(connection) == []
+
+
+def test_statistics_cache_is_invalidated_by_writes():
+    path = f'/stats/user-balances/{client.user_id}'
+    first = client.get(path, headers=client.bearer).json()
+    hits = stats_cache.hits
+    assert client.get(path, headers=client.bearer).json() == first
+    assert stats_cache.hits == hits + 1
+
+    month = client.get(f'/stats/monthly-category-spent/{client.user_id}',
+                       params={'month_trans': 3, 'year_trans': 2023},
+                       headers=client.bearer).json()
+    client.post('/transactions/', headers=client.bearer, json={
+        'amount': 3, 'category': 'Gift', 'user_id': client.user_id,
+        'account_id': client.account_id})
+
+    after = client.get(path, headers=client.bearer).json()
+    assert (Decimal(after['total_amount'])
+            == Decimal(first['total_amount']) + 3)
+    assert stats_cache.hits == hits + 2
+    assert client.get(f'/stats/monthly-category-spent/{client.user_id}',
+                      params={'month_trans': 3, 'year_trans': 2023},
+                      headers=client.bearer).json() == month
+    assert stats_cache.hits == hits + 3
+    assert client.get('/status').json()['stats_cache']['invalidations'] > 0
+
+
+def test_sqlite_cache_backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'cache.db'), maxsize=2, ttl=60)
+    shared = SQLiteBackend(str(tmp_path / 'cache.db'), maxsize=2, ttl=60)
+    backend.set('1:balance', {'total': 1})
+    backend.set('1:monthly:2023-03', [])
+    assert shared.get('1:balance') == {'total': 1}
+    assert shared.get('1:monthly:2023-03') == []
+
+    backend.set('12:balance', {'total': 12})
+    assert len(backend) == 2 and backend.evictions == 1
+    assert shared.delete_prefix('1:') == 1
+    assert backend.get('12:balance') == {'total': 12}
+
+
+def test_time_series():
+    items = [
+        {'amount': 10, 'category': 'Salary', 'date': '2019-12-30'},
+        {'amount': -2, 'category': 'Products', 'date': '2020-01-05'},
+        {'amount': -3, 'category': 'Products', 'date': '2020-01-06'},
+    ]
+    for item in items:
+        item.update(user_id=client.user_id, account_id=client.account_id)
+    assert client.post('/transactions/bulk', json=items,
+                       headers=client.bearer).json()['created'] == 3
+
+    def series(**params):
+        response = client.get(f'/stats/timeseries/{client.user_id}',
+                              params={'date_from': '2019-01-01',
+                                      'date_to': '2020-12-31', **params},
+                              headers=client.bearer)
+        assert response.status_code == 200
+        return [(point['period'], point['category'], Decimal(point['income']),
+                 Decimal(point['expense']), Decimal(point['net']),
+                 point['count'])
+                for point in response.json()]
+
+    assert series(granularity='week') == [
+        ('2019-12-30', 'Products', 0, -2, -2, 1),
+        ('2019-12-30', 'Salary', 10, 0, 10, 1),
+        ('2020-01-06', 'Products', 0, -3, -3, 1),
+    ]
+    assert series(granularity='year') == [
+        ('2019-01-01', 'Salary', 10, 0, 10, 1),
+        ('2020-01-01', 'Products', 0, -5, -5, 2),
+    ]
+    assert series(category='Products') == [
+        ('2020-01-01', 'Products', 0, -5, -5, 2),
+    ]
+    assert series(granularity='day', date_to='2020-01-05')[-1][:2] == \
+        ('2020-01-05', 'Products')
+
+
+def test_admin_analytics():
+    window = {'date_from': '2019-12-30', 'date_to': '2020-01-06'}
+    assert client.get('/analytics/top-spenders', params=window,
+                      headers=client.bearer).status_code == 403
+
+    admin = ('admin', 'admin')
+    spenders = client.get('/analytics/top-spenders', params=window,
+                          auth=admin).json()
+    assert {'user_id': client.user_id, 'login': client.user_login,
+            'expense': '-5.00'} in spenders
+    expenses = [Decimal(item['expense']) for item in spenders]
+    assert expenses == sorted(expenses)
+
+    categories = client.get('/analytics/categories', params=window,
+                            auth=admin).json()
+    assert {'Products', 'Salary'} <= {item['category']
+                                      for item in categories}
+    assert abs(sum(item['share'] for item in categories) - 1) < 1e-9
+
+    days = client.get('/analytics/daily-volume', params=window,
+                      auth=admin).json()
+    assert {'2019-12-30', '2020-01-05', '2020-01-06'} <= \
+        {item['date'] for item in days}
+    assert all(window['date_from'] <= item['date'] <= window['date_to']
+               for item in days)
+
+
+def test_moving_a_transaction_between_accounts():
+    accounts = [client.post(
+        '/accounts/',
+        json={'account_name': name, 'amount': 20, 'user_id': client.user_id},
+        headers=client.bearer
+    ).json()['id'] for name in ('from', 'to')]
+    trans = client.post(
+        '/transactions/',
+        json={'amount': 5, 'category': 'Gift', 'user_id': client.user_id,
+              'account_id': accounts[0]},
+        headers=client.bearer
+    ).json()
+
+    moved = client.put(
+        f'/transactions/{trans["id"]}',
+        json={'amount': 7, 'category': 'Gift', 'user_id': client.user_id,
+              'account_id': accounts[1]},
+        headers=client.bearer
+    )
+    assert moved.status_code == 200
+    balances = {acc['id']: Decimal(acc['amount']) for acc in client.get(
+        '/accounts/0', params={'view': 'compact'}, headers=client.bearer
+    ).json()}
+    assert (balances[accounts[0]], balances[accounts[1]]) == (20, 27)
+
+    with engine.connect() as connection:
+        assert verify_statistics(connection) == []
+
+
+def test_changing_a_transaction_of_another_user():
+    login, password = fake.user_name() + fake.pystr(max_chars=6), 'secret12'
+    other_id = client.post(
+        '/users/register', json={'login': login, 'password': password}
+    ).json()['id']
+    other = {'Authorization': 'Bearer ' + client.get(
+        '/users/get-token', auth=(login, password)).json()['access_token']}
+    other_account = client.post(
+        '/accounts/',
+        json={'account_name': 'savings', 'amount': 0, 'user_id': other_id},
+        headers=other
+    ).json()['id']
+    trans = client.post(
+        '/transactions/',
+        json={'amount': 1000, 'category': 'Salary', 'user_id': other_id,
+              'account_id': other_account},
+        headers=other
+    ).json()
+    own_account = client.post(
+        '/accounts/',
+        json={'account_name': 'mine', 'amount': 0, 'user_id': client.user_id},
+        headers=client.bearer
+    ).json()['id']
+
+    response = client.put(
+        f'/transactions/{trans["id"]}',
+        json={'amount': 1, 'category': 'Salary', 'user_id': client.user_id,
+              'account_id': own_account},
+        headers=client.bearer
+    )
+    assert response.status_code == 403
+
+    def balance(account_id, bearer):
+        return {acc['id']: Decimal(acc['amount']) for acc in client.get(
+            '/accounts/0', params={'view': 'compact'}, headers=bearer
+        ).json()}[account_id]
+
+    assert balance(other_account, other) == 1000
+    assert balance(own_account, client.bearer) == 0
+
+
+def test_concurrent_balance_changes():
+    account_id = client.post(
+        '/accounts/',
+        json={'account_name': 'shared', 'amount': 30,
+              'user_id': client.user_id},
+        headers=client.bearer
+    ).json()['id']
+
+    def post(amount):
+        return client.post(
+            '/transactions/',
+            json={'amount': amount, 'user_id': client.user_id,
+                  'account_id': account_id},
+            headers=client.bearer
+        ).status_code
+
+    def balance():
+        return next(Decimal(acc['amount']) for acc in client.get(
+            '/accounts/0', params={'view': 'compact'}, headers=client.bearer
+        ).json() if acc['id'] == account_id)
+
+    # 80 withdrawals of 1 from a balance of 30: exactly 30 succeed
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        codes = list(pool.map(post, [-1] * 80))
+    assert codes.count(201) == 30
+    assert codes.count(406) == 50
+    assert balance() == 0
+
+    # No deposit is lost
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        codes = list(pool.map(post, [0.5] * 80))
+    assert codes == [201] * 80
+    assert balance() == 40
+
+    with engine.connect() as connection:
+        assert verify_statistics(connection) == []
+
+
+def test_transfers():
+    source, target = [client.post(
+        '/accounts/',
+        json={'account_name': name, 'amount': amount,
+              'user_id': client.user_id},
+        headers=client.bearer
+    ).json()['id'] for name, amount in (('wallet', 50), ('savings', 0))]
+    path = f'/stats/user-balances/{client.user_id}'
+    before = client.get(path, headers=client.bearer).json()
+
+    def balances():
+        return {acc['id']: Decimal(acc['amount']) for acc in client.get(
+            '/accounts/0', params={'view': 'compact'}, headers=client.bearer
+        ).json()}
+
+    transfer = client.post(
+        '/transfers/',
+        json={'from_account_id': source, 'to_account_id': target,
+              'amount': 20.5},
+        headers=client.bearer
+    )
+    assert transfer.status_code == 201
+    transfer = transfer.json()
+    assert (balances()[source], balances()[target]) == \
+        (Decimal('29.50'), Decimal('20.50'))
+
+    legs = [item for account_id in (source, target) for item in client.get(
+        f'/transactions/{client.user_id}',
+        params={'view': 'compact', 'account_id': account_id},
+        headers=client.bearer
+    ).json() if item['transfer_id'] == transfer['id']]
+    assert sorted((leg['account_id'], leg['amount'], leg['category'])
+                  for leg in legs) == [(source, '-20.50', 'Transfer'),
+                                       (target, '20.50', 'Transfer')]
+    assert client.delete(f'/transactions/{legs[0]["id"]}',
+                         headers=client.bearer).status_code == 409
+
+    assert client.get(path, headers=client.bearer).json() == before
+    month = client.get(f'/stats/monthly-category-spent/{client.user_id}',
+                       headers=client.bearer).json()
+    assert 'Transfer' not in {item['category'] for item in month}
+
+    for body, status_code in [
+        ({'from_account_id': source, 'to_account_id': target,
+          'amount': 30}, 406),
+        ({'from_account_id': source, 'to_account_id': source,
+          'amount': 1}, 409),
+        ({'from_account_id': source, 'to_account_id': target,
+          'amount': 0}, 422),
+    ]:
+        assert client.post('/transfers/', json=body,
+                           headers=client.bearer).status_code == status_code
+    assert (balances()[source], balances()[target]) == \
+        (Decimal('29.50'), Decimal('20.50'))
+
+    with engine.connect() as connection:
+        assert verify_statistics(connection) == []
@@ -2,7 +2,15 @@
 import faker
 from fastapi.testclient import TestClient
 
+from ..database import db
+from ..database.models import User
 from ..main import app
+from ..utils.authorisation_password import (
+    invalidate_user_credentials,
+    password_service,
+    pwd_context,
+)
+from ..utils.authorisation_token import encode_jwt
 
 client = TestClient(app)
 fake = faker.Faker()
@@ -22,4 +30,119 @@ def test_register_user():
 
     assert response.status_code == 201
     client.user_new_id = response.json()
-    print(client.user_new_id)
\ No newline at end of file
+    print(client.user_new_id)
+
+def test_login_with_password():
+    for _ in range(2):
+        response = client.get(
+            '/users/authorise-with-password',
+            auth=(client.user_login, client.user_password)
+        )
+        assert response.status_code == 200
+        assert response.json()['login'] == client.user_login
+
+
+def test_change_password_invalidates_credentials():
+    token = client.get(
+        '/users/get-token',
+        auth=(client.user_login, client.user_password)
+    ).json()['access_token']
+    new_password = fake.password()
+
+    response = client.put(
+        '/users/0',
+        json={'login': client.user_login, 'password': new_password},
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    assert response.status_code == 200
+    stale_token = client.get(
+        '/users/authorise-with-token',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    assert stale_token.status_code == 401
+
+    old = client.get(
+        '/users/authorise-with-password',
+        auth=(client.user_login, client.user_password)
+    )
+    assert old.status_code == 401
+    client.user_password = new_password
+    new = client.get(
+        '/users/authorise-with-password',
+        auth=(client.user_login, client.user_password)
+    )
+    assert new.status_code == 200
+
+
+def test_password_change_during_a_verify(monkeypatch):
+    login = fake.user_name() + fake.pystr(max_chars=6)
+    password = fake.password()
+    user_id = client.post('/users/register',
+                          json={'login': login, 'password': password}).json()['id']
+    verify = password_service.verify
+
+    async def changed_meanwhile(plain, hashed):
+        verified = await verify(plain, hashed)
+        # Another request changes the password while argon2 runs
+        with db.session_local() as session:
+            session.get(User, user_id).password = pwd_context.hash(
+                fake.password())
+            session.commit()
+        invalidate_user_credentials(user_id)
+        return verified
+
+    monkeypatch.setattr(password_service, 'verify', changed_meanwhile)
+    assert client.get('/users/authorise-with-password',
+                      auth=(login, password)).status_code == 200
+    monkeypatch.setattr(password_service, 'verify', verify)
+    assert client.get('/users/authorise-with-password',
+                      auth=(login, password)).status_code == 401
+
+
+def test_login_with_token():
+    token = client.get(
+        '/users/get-token',
+        auth=(client.user_login, client.user_password)
+    ).json()['access_token']
+    for _ in range(2):
+        response = client.get(
+            '/users/authorise-with-token',
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        assert response.status_code == 200
+        assert response.json()['login'] == client.user_login
+
+    response = client.get(
+        '/users/authorise-with-token',
+        headers={'Authorization': 'Bearer not-a-token'}
+    )
+    assert response.status_code == 401
+
+
+def test_token_without_user_id_and_version():
+    token = encode_jwt({'sub': client.user_login})
+    response = client.get(
+        '/users/authorise-with-token',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    assert response.status_code == 401
+
+
+def test_change_login_to_a_taken_one():
+    taken = fake.user_name() + fake.pystr(max_chars=6)
+    client.post('/users/register',
+                json={'login': taken, 'password': fake.password()})
+    token = client.get(
+        '/users/get-token',
+        auth=(client.user_login, client.user_password)
+    ).json()['access_token']
+    response = client.put(
+        '/users/0',
+        json={'login': taken, 'password': fake.password()},
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    assert response.status_code == 422
+    assert client.get(
+        '/users/authorise-with-password',
+        auth=(client.user_login, client.user_password)
+    ).status_code == 200
@@ -0,0 +1,68 @@
+'''Multi-worker serving testing, the other worker being a second backend'''
+import time
+
+import faker
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from .. import manage
+from ..database.db import engine
+from ..main import app
+from ..utils import shared_state
+from ..utils.authorisation_password import get_password_hash
+from ..utils.response_cache import SQLiteBackend
+
+client = TestClient(app)
+fake = faker.Faker()
+
+client.user_login = fake.user_name() + fake.pystr(max_chars=6)
+client.user_password = fake.password()
+
+
+def setup_module():
+    client.user_id = client.post(
+        '/users/register',
+        json={'login': client.user_login, 'password': client.user_password}
+    ).json()['id']
+
+
+def test_worker_environment():
+    assert manage.worker_environment(1) == {'DB_UPGRADE_ON_STARTUP': 'false'}
+    assert manage.worker_environment(4) == {
+        'DB_UPGRADE_ON_STARTUP': 'false',
+        'STATS_CACHE_BACKEND': 'sqlite',
+        'IDEMPOTENCY_BACKEND': 'sqlite',
+        'SHARED_STATE_BACKEND': 'sqlite',
+        'RATE_LIMIT_BACKEND': 'sqlite',
+    }
+
+
+def test_changes_made_by_another_worker(tmp_path, monkeypatch):
+    path = str(tmp_path / 'shared.db')
+    monkeypatch.setattr(shared_state, 'shared_state',
+                        SQLiteBackend(path, maxsize=100, ttl=60))
+    basic = (client.user_login, client.user_password)
+    token = client.get('/users/get-token', auth=basic).json()['access_token']
+    bearer = {'Authorization': f'Bearer {token}'}
+    assert client.get('/users/authorise-with-token',
+                      headers=bearer).status_code == 200
+    assert client.get('/users/authorise-with-password',
+                      auth=basic).status_code == 200
+
+    # Another worker changes the password: the caches of this one are stale
+    with engine.begin() as connection:
+        connection.execute(text(
+            'UPDATE users SET password = :password, '
+            'token_version = token_version + 1 WHERE id = :id'),
+            {'password': get_password_hash('changed'), 'id': client.user_id})
+    assert client.get('/users/authorise-with-token',
+                      headers=bearer).status_code == 200
+
+    other_worker = SQLiteBackend(path, maxsize=100, ttl=60)
+    other_worker.set(shared_state.changed_key(client.user_id), time.time())
+    assert client.get('/users/authorise-with-token',
+                      headers=bearer).status_code == 401
+    assert client.get('/users/authorise-with-password',
+                      auth=basic).status_code == 401
+    assert client.get('/users/authorise-with-password',
+                      auth=(client.user_login, 'changed')).status_code == 200
@@ -0,0 +1,60 @@
+'''Resolving the caller from a bearer token or from login and password'''
+
+from typing import Annotated
+
+from fastapi import Depends, HTTPException, Request
+from fastapi.security import (
+    HTTPAuthorizationCredentials,
+    HTTPBasic,
+    HTTPBasicCredentials,
+    HTTPBearer,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database.dependencies import get_db
+from .authorisation_password import get_current_user_with_login_and_password
+from .authorisation_token import Principal, get_current_principal_with_token
+from .rate_limit import limit_user
+
+optional_basic = HTTPBasic(auto_error=False)
+optional_bearer = HTTPBearer(auto_error=False)
+
+http_not_authenticated = HTTPException(
+        status_code=401,
+        detail="Not authenticated",
+        headers={"WWW-Authenticate": "Bearer, Basic"},
+    )
+
+
+async def get_current_principal(
+    request: Request,
+    bearer: Annotated[HTTPAuthorizationCredentials | None,
+                      Depends(optional_bearer)],
+    basic: Annotated[HTTPBasicCredentials | None, Depends(optional_basic)],
+    db: AsyncSession = Depends(get_db)
+) -> Principal:
+    '''
+    Dependency returning the authenticated caller
+    Accepts a token from /users/get-token or Basic credentials
+    and takes a token from the rate limit bucket of the user
+    '''
+    if bearer is not None:
+        principal = await get_current_principal_with_token(
+            bearer.credentials, db)
+    elif basic is not None:
+        db_user = await get_current_user_with_login_and_password(
+            db,
+            basic.username,
+            basic.password
+        )
+        principal = Principal(db_user.id, db_user.login,
+                              bool(db_user.is_admin))
+    else:
+        raise http_not_authenticated
+    limit_user(principal.id, request)
+    # Commits of the request count as the caller's writes (read-your-writes)
+    db.info['principal_id'] = principal.id
+    return principal
+
+
+CurrentPrincipal = Annotated[Principal, Depends(get_current_principal)]
@@ -1,11 +1,26 @@
 '''File with methods for authorisation users with login and password'''
 
+import hashlib
+import hmac
+import time
+
 from passlib.context import CryptContext
 from fastapi import HTTPException
 from fastapi.security import HTTPBasic, HTTPBearer
+from sqlalchemy import select
 
 from ..database.models import User
 from ..schemas.user import UserResponse
+from .cache import TTLCache
+from .config import Lazy, settings
+from .metrics import metrics
+from .password_service import PasswordService
+from .rate_limit import (
+    check_password_attempt,
+    password_failed,
+    password_succeeded,
+)
+from .shared_state import changed_since, mark_user_changed
 
 http_wrong_credentials = HTTPException(
         status_code=401,
@@ -17,11 +32,17 @@ http_wrong_credentials = HTTPException(
 pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
 security = HTTPBasic()
 http_bearer = HTTPBearer()
+password_service = Lazy(lambda: PasswordService(
+    pwd_context, settings.PASSWORD_WORKERS, settings.PASSWORD_MAX_QUEUE,
+    observer=metrics.observe_password))
+verified_credentials = Lazy(lambda: TTLCache(settings.AUTH_CACHE_SIZE,
+                                             settings.AUTH_CACHE_TTL))
 
 
 def get_password_hash(password: str) -> str:
     '''
     Password hashing function
+    Blocks the caller, use password_service.hash inside request handlers
     '''
     return pwd_context.hash(password)
 
@@ -29,26 +50,72 @@ def get_password_hash(password: str) -> str:
 def verify_password(password: str, hashed_password: str) -> bool:
     '''
     Password verification function
+    Blocks the caller, use password_service.verify inside request handlers
     '''
     return pwd_context.verify(password, hashed_password)
 
 
-def get_current_user_with_login_and_password(
+def _credential_key(login: str, password: str) -> tuple:
+    '''
+    Cache key for a login/password pair
+    The password is kept only as a keyed digest
+    '''
+    digest = hmac.new(settings.SECRET_KEY.encode(),
+                      password.encode(),
+                      hashlib.sha256).hexdigest()
+    return login, digest
+
+
+def invalidate_user_credentials(user_id: int) -> None:
+    '''
+    Forget verified credentials of the user, in every worker
+    Must be called when the user's login or password changes or the user is deleted
+    '''
+    verified_credentials.discard_values(lambda cached: cached[0] == user_id)
+    mark_user_changed(user_id)
+
+
+async def get_current_user_with_login_and_password(
         db,
         login: str,
         password: str
 ) -> UserResponse:
-    print('I am here')
     '''
     Verifies the user's existence
     If the password is specified, it checks the password
     Return user
+
+    A credential is verified with argon2 at most once per request (the result
+    is remembered in the session info) and recently verified credentials
+    are remembered in a TTL cache, so repeat callers skip argon2 entirely.
+    Any other check passes the rate limits of the login and the client
+    first, the client address comes from the session info
     '''
-    db_user = db.query(User).filter(User.login == login).first()
-    if db_user:
-        if verify_password(password, db_user.password):
-            return db_user
-    raise http_wrong_credentials
+    key = _credential_key(login, password)
+    verified_in_request = db.info.setdefault('verified_users', {})
+    if key in verified_in_request:
+        return verified_in_request[key]
 
+    db_user = None
+    cached = verified_credentials.get(key)
+    if cached is not None and not changed_since(*cached):
+        db_user = await db.scalar(select(User).filter(User.id == cached[0]))
+        if db_user and db_user.login != login:
+            db_user = None
 
+    if db_user is None:
+        client = db.info.get('client', '')
+        check_password_attempt(login, client)
+        # Taken before the user is read, so a change during the verify
+        # is newer than the cached entry
+        cached_at = time.time()
+        db_user = await db.scalar(select(User).filter(User.login == login))
+        if not (db_user
+                and await password_service.verify(password, db_user.password)):
+            password_failed(login, client)
+            raise http_wrong_credentials
+        password_succeeded(login, client)
+        verified_credentials.set(key, (db_user.id, cached_at))
 
+    verified_in_request[key] = db_user
+    return db_user
@@ -1,21 +1,45 @@
 '''File with methods for authorisation users with token'''
 
+import hashlib
+import math
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from typing import Annotated
 
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer
-from jose import jwt
-from passlib.context import CryptContext
+from jose import JWTError, jwt
+from sqlalchemy import select
 
 from ..database.models import User
 from ..schemas.user import UserResponse
-from ..utils.config import settings
+from ..utils.cache import TTLCache
+from ..utils.config import Lazy, settings
+from ..utils.shared_state import changed_since, mark_user_changed
 
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
 http_bearer = HTTPBearer()
 
+http_wrong_token = HTTPException(
+        status_code=401,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+@dataclass(frozen=True)
+class Principal:
+    '''Authenticated caller, resolved from a token or from a password'''
+    id: int
+    login: str
+    is_admin: bool
+    expires: float = math.inf
+
+
+validated_tokens = Lazy(lambda: TTLCache(settings.TOKEN_CACHE_SIZE,
+                                         settings.TOKEN_CACHE_TTL))
+
 
 def encode_jwt(data: dict,
                time_action: timedelta | None = None) -> str:
@@ -43,41 +67,89 @@ def encode_jwt(data: dict,
     return encoded
 
 
+def encode_user_jwt(db_user: User,
+                    time_action: timedelta | None = None) -> str:
+    '''
+    Create token carrying everything needed to authorise the user:
+    login, id, admin flag and the user's current token version
+    '''
+    return encode_jwt({
+        'sub': db_user.login,
+        'uid': db_user.id,
+        'adm': bool(db_user.is_admin),
+        'ver': db_user.token_version or 0,
+    }, time_action)
+
+
 def decode_jwt(token: str) -> dict:
     '''
     Decoding of the token with expiration verification
     '''
-    decoded = jwt.decode(
-        token,
-        settings.SECRET_KEY,
-        algorithms=settings.ALGORITHM
-    )
-    if datetime.fromtimestamp(decoded['exp']) < datetime.utcnow():
-        raise HTTPException(
-            status_code=400,
-            detail='Inactive user'
+    try:
+        return jwt.decode(
+            token,
+            settings.SECRET_KEY,
+            algorithms=[settings.ALGORITHM]
         )
-    else:
-        return decoded
+    except JWTError:
+        raise http_wrong_token
 
 
-def get_current_user_with_token(token: Annotated[str, Depends(http_bearer)],
-                     db) -> UserResponse:
-    credentials_exception = HTTPException(
-        status_code=401,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = decode_jwt(token)
-        login: str = payload.get("sub")
-        if login is None:
-            raise credentials_exception
-    except jwt.InvalidTokenError:
-        raise credentials_exception
+def invalidate_user_tokens(user_id: int) -> None:
+    '''
+    Forget validated tokens of the user, in every worker
+    Must be called after the user's token version is bumped or the user is deleted
+    '''
+    validated_tokens.discard_values(lambda cached: cached[0].id == user_id)
+    mark_user_changed(user_id)
 
-    db_user = db.query(User).filter(User.login == login).first()
+
+async def get_current_principal_with_token(token: str, db) -> Principal:
+    '''
+    Resolve the token to a principal
+
+    Validated tokens are remembered by their hash, so repeat calls need
+    neither signature checks nor database round trips. A token issued
+    before the user's token version was bumped is rejected, and so is one
+    without the user id and version.
+    '''
+    token_key = hashlib.sha256(token.encode()).digest()
+    cached = validated_tokens.get(token_key)
+    if cached is not None:
+        principal, cached_at = cached
+        if (principal.expires > time.time()
+                and not changed_since(principal.id, cached_at)):
+            return principal
+
+    payload = decode_jwt(token)
+    login = payload.get('sub')
+    # Tokens issued before they carried the user id and token version
+    # could not be revoked, the user has to get a new one
+    if login is None or 'uid' not in payload or 'ver' not in payload:
+        raise http_wrong_token
+
+    # Taken before the token version is read, so a change made meanwhile
+    # is newer than the cached entry
+    cached_at = time.time()
+    row = (await db.execute(
+        select(User.token_version)
+        .filter(User.id == payload['uid'], User.login == login)
+    )).first()
+    if row is None or (row.token_version or 0) != payload['ver']:
+        raise http_wrong_token
+    principal = Principal(payload['uid'], login,
+                          bool(payload.get('adm')), payload['exp'])
+
+    validated_tokens.set(token_key, (principal, cached_at))
+    return principal
+
+
+async def get_current_user_with_token(token: Annotated[str, Depends(http_bearer)],
+                     db) -> UserResponse:
+    '''Resolve the token to the database user'''
+    principal = await get_current_principal_with_token(token, db)
+    db_user = await db.scalar(select(User).filter(User.id == principal.id))
 
     if db_user is None:
-        raise credentials_exception
+        raise http_wrong_token
     return db_user
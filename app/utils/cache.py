@@ -0,0 +1,99 @@
+'''Small in-process caches shared by the authorisation helpers'''
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    '''
+    Bounded LRU mapping whose entries expire after ``ttl`` seconds
+    Thread-safe, so it can be shared between the threadpool workers
+    '''
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                self.evictions += 1
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def _store(self, key, value) -> None:
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def set(self, key, value) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._store(key, value)
+
+    def add(self, key, value) -> bool:
+        '''Set the value unless the key has a live entry, atomically'''
+        if self.maxsize <= 0:
+            return True
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] >= time.monotonic():
+                return False
+            self._store(key, value)
+            return True
+
+    def update(self, key, function):
+        '''
+        Replace the value with the first item of function(value), atomically
+        The value is None when missing; returns the second item
+        '''
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[1] < time.monotonic():
+                item = (None, 0)
+            value, result = function(item[0])
+            if self.maxsize > 0:
+                self._store(key, value)
+            return result
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[0]
+
+    def discard_values(self, predicate) -> int:
+        '''Remove every entry whose value matches the predicate'''
+        with self._lock:
+            keys = [key for key, (value, _) in self._data.items()
+                    if predicate(value)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def discard_keys(self, predicate) -> int:
+        '''Remove every entry whose key matches the predicate'''
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -1,3 +1,6 @@
+import threading
+from functools import lru_cache
+
 from pydantic_settings import BaseSettings
 
 
@@ -5,13 +8,122 @@ class Settings(BaseSettings):
     DB_URL: str
     DB_USER: str
     DB_PASSWORD: str
+    # Connection pool, ignored by in-memory SQLite
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    # Milliseconds, PostgreSQL only
+    DB_STATEMENT_TIMEOUT: int = 30000
+    # Read-only routes query the replica when it is set
+    DB_REPLICA_URL: str | None = None
+    # Seconds a user's reads stay on the primary after their own write,
+    # 0 turns read-your-writes off
+    READ_YOUR_WRITES_SECONDS: float = 0
+    # Pragmas run on every new SQLite connection
+    SQLITE_JOURNAL_MODE: str = 'WAL'
+    SQLITE_SYNCHRONOUS: str = 'NORMAL'
+    SQLITE_BUSY_TIMEOUT: int = 5000
+    SQLITE_CACHE_SIZE: int = -64000
+    SQLITE_MMAP_SIZE: int = 268435456
     SECRET_KEY: str
     ACCESS_DAYS: int
     ALGORITHM: str
-
+    AUTH_CACHE_SIZE: int = 1024
+    AUTH_CACHE_TTL: int = 300
+    PASSWORD_WORKERS: int = 4
+    PASSWORD_MAX_QUEUE: int = 64
+    TOKEN_CACHE_SIZE: int = 4096
+    TOKEN_CACHE_TTL: int = 300
+    PAGE_SIZE_DEFAULT: int = 100
+    PAGE_SIZE_MAX: int = 1000
+    EXPORT_BATCH_SIZE: int = 1000
+    BULK_MAX_ITEMS: int = 10000
+    BALANCE_RETRY_ATTEMPTS: int = 5
+    BALANCE_RETRY_DELAY: float = 0.05
+    STATS_CACHE_BACKEND: str = 'memory'
+    STATS_CACHE_SIZE: int = 4096
+    STATS_CACHE_TTL: int = 300
+    STATS_CACHE_PATH: str = 'app/stats_cache.db'
+    IDEMPOTENCY_BACKEND: str = 'memory'
+    IDEMPOTENCY_SIZE: int = 10000
+    IDEMPOTENCY_TTL: int = 86400
+    IDEMPOTENCY_LOCK_TTL: int = 60
+    IDEMPOTENCY_PATH: str = 'app/idempotency.db'
+    # State every worker process must see: user invalidations and recent
+    # writers; the TTL must exceed AUTH_CACHE_TTL and TOKEN_CACHE_TTL
+    SHARED_STATE_BACKEND: str = 'memory'
+    SHARED_STATE_SIZE: int = 100000
+    SHARED_STATE_TTL: int = 86400
+    SHARED_STATE_PATH: str = 'app/shared_state.db'
+    # Token buckets holding BURST requests, refilled at PER_SECOND: per
+    # client address and route, per authenticated user and route, and of
+    # the password checks reaching argon2 per login and per client address
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: str = 'memory'
+    RATE_LIMIT_SIZE: int = 100000
+    RATE_LIMIT_TTL: int = 3600
+    RATE_LIMIT_PATH: str = 'app/rate_limit.db'
+    RATE_LIMIT_CLIENT_BURST: int = 200
+    RATE_LIMIT_CLIENT_PER_SECOND: float = 100
+    RATE_LIMIT_USER_BURST: int = 100
+    RATE_LIMIT_USER_PER_SECOND: float = 50
+    PASSWORD_LOGIN_BURST: int = 10
+    PASSWORD_LOGIN_PER_SECOND: float = 0.2
+    PASSWORD_CLIENT_BURST: int = 30
+    PASSWORD_CLIENT_PER_SECOND: float = 2
+    # Seconds a login is refused from a client after a failed password,
+    # doubling with every failure past the free ones
+    LOGIN_BACKOFF_FREE_FAILURES: int = 3
+    LOGIN_BACKOFF_BASE: float = 1
+    LOGIN_BACKOFF_MAX: float = 300
+    # Run the migrations when a worker starts; turn off when several
+    # workers share the database and `manage migrate` runs once instead
+    DB_UPGRADE_ON_STARTUP: bool = True
+    # Request, SQL and argon2 histograms served on /metrics
+    METRICS_ENABLED: bool = False
 
     class Config:
         env_file = 'app/.env'
         env_file_encoding = 'utf-8'
-# print(__name__)
-settings = Settings()
+
+
+@lru_cache
+def get_settings() -> Settings:
+    '''Settings read from the environment and app/.env on first use'''
+    return Settings()
+
+
+class Lazy:
+    '''
+    Stand-in for an object built by ``factory`` on the first attribute
+    access. The settings and the stores built from them are such
+    stand-ins: importing a module never parses app/.env, the environment
+    can still be changed before the first use, and attributes can be
+    patched as on the object itself
+    '''
+
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_target', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _resolve(self):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    object.__setattr__(self, '_target', self._factory())
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._resolve(), name, value)
+
+    def __len__(self):
+        return len(self._resolve())
+
+
+settings = Lazy(get_settings)
@@ -1,22 +1,34 @@
-from ..database.db import session_local
+'''Creating the administrator, `python -m app.manage create-admin`'''
+
+from sqlalchemy.exc import IntegrityError
+
+from ..database import db as engines
 from ..database.models import User
 from ..utils.config import settings
 from ..utils.authorisation_password import get_password_hash
 
-def create_admin():
-    db = session_local()
+
+def create_admin() -> bool:
+    '''
+    Create the administrator from DB_USER and DB_PASSWORD if missing
+    Safe to run any number of times, also concurrently: the unique login
+    lets only one insert through. Returns whether it was created
+    '''
+    db = engines.session_local()
     try:
         admin = db.query(User).filter(User.login == settings.DB_USER).first()
-        if not admin:
-            hashed_password = get_password_hash(settings.DB_PASSWORD)
-            new_admin = User(
-                login=settings.DB_USER,
-                is_admin = True,
-                password=hashed_password
-            )
-            print(f'admin: ({settings.DB_USER}, {settings.DB_PASSWORD})')
-            db.add(new_admin)
+        if admin:
+            return False
+        db.add(User(
+            login=settings.DB_USER,
+            is_admin=True,
+            password=get_password_hash(settings.DB_PASSWORD)
+        ))
+        try:
             db.commit()
-            db.refresh(new_admin)
+        except IntegrityError:
+            db.rollback()
+            return False
+        return True
     finally:
         db.close()
@@ -0,0 +1,168 @@
+'''
+Request, SQL and password hashing metrics in the Prometheus text format
+
+Every request gets a RequestStats in a context variable; the engine hooks
+add each statement and its time to it, the password service adds the
+time spent waiting for argon2, and the middleware folds it into
+histograms labelled with the route template. With METRICS_ENABLED off
+the middleware passes requests straight through, so the hooks find no
+RequestStats and return at once.
+'''
+
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from .config import Lazy, settings
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+# Label of requests that matched no route, e.g. 404s or replayed responses
+UNMATCHED_ROUTE = 'unmatched'
+
+_current_request = ContextVar('metrics_request', default=None)
+
+
+class RequestStats:
+    '''Statements and time spent in SQL and argon2 by one request'''
+    __slots__ = ('statements', 'sql_seconds', 'password_seconds')
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.password_seconds = 0.0
+
+
+def _label_value(value) -> str:
+    return (str(value).replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+class Histogram:
+    '''Bucket counts, sum and count per label set'''
+
+    def __init__(self, name: str, description: str, labels: tuple,
+                 buckets: tuple):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, values: tuple, amount: float) -> None:
+        index = bisect.bisect_left(self.buckets, amount)
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [
+                    [0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += amount
+
+    def count(self, values: tuple) -> int:
+        with self._lock:
+            series = self._series.get(values)
+            return sum(series[0]) if series else 0
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.description}',
+                 f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((values, list(counts), total)
+                            for values, (counts, total)
+                            in self._series.items())
+        for values, counts, total in series:
+            labels = ','.join(f'{name}="{_label_value(value)}"'
+                              for name, value in zip(self.labels, values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} '
+                             f'{cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+
+class Metrics:
+    '''Histograms of the service and the hooks filling them'''
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.requests = Histogram(
+            'http_request_duration_seconds', 'Request latency',
+            ('method', 'route', 'status'), LATENCY_BUCKETS)
+        self.statements = Histogram(
+            'db_statements_per_request', 'SQL statements run by a request',
+            ('method', 'route'), STATEMENT_BUCKETS)
+        self.sql = Histogram(
+            'db_seconds_per_request', 'Time a request spent in SQL',
+            ('method', 'route'), LATENCY_BUCKETS)
+        self.password = Histogram(
+            'password_hash_duration_seconds',
+            'Argon2 hash and verify calls, queueing included',
+            ('operation',), LATENCY_BUCKETS)
+        self.password_per_request = Histogram(
+            'password_seconds_per_request',
+            'Time a request spent waiting for argon2',
+            ('method', 'route'), LATENCY_BUCKETS)
+
+    def start_request(self):
+        '''Collect the statements of the calling task, returns a token'''
+        return _current_request.set(RequestStats())
+
+    def finish_request(self, token, method: str, route: str, status: int,
+                       seconds: float) -> None:
+        stats = _current_request.get()
+        _current_request.reset(token)
+        self.requests.observe((method, route, str(status)), seconds)
+        self.statements.observe((method, route), stats.statements)
+        self.sql.observe((method, route), stats.sql_seconds)
+        self.password_per_request.observe((method, route),
+                                          stats.password_seconds)
+
+    def observe_password(self, operation: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        self.password.observe((operation,), seconds)
+        if (stats := _current_request.get()) is not None:
+            stats.password_seconds += seconds
+
+    def render(self) -> str:
+        lines = []
+        for histogram in (self.requests, self.statements, self.sql,
+                          self.password, self.password_per_request):
+            lines += histogram.render()
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Lazy(lambda: Metrics(settings.METRICS_ENABLED))
+
+
+def instrument_engine(engine) -> None:
+    '''
+    Count the statements of a blocking or async engine per request
+    Given the Engine class, counts those of every engine
+    '''
+    sync_engine = getattr(engine, 'sync_engine', engine)
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def _before(connection, cursor, statement, parameters, context,
+                executemany):
+        if _current_request.get() is not None:
+            connection.info['metrics_started'] = time.perf_counter()
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def _after(connection, cursor, statement, parameters, context,
+               executemany):
+        if (stats := _current_request.get()) is None:
+            return
+        started = connection.info.pop('metrics_started', None)
+        if started is not None:
+            stats.statements += 1
+            stats.sql_seconds += time.perf_counter() - started
@@ -0,0 +1,60 @@
+'''Keyset pagination with opaque cursors'''
+
+import base64
+import json
+from datetime import date
+
+from fastapi import HTTPException, Response
+from sqlalchemy import tuple_
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+http_wrong_cursor = HTTPException(
+        status_code=400,
+        detail="Invalid cursor"
+    )
+
+
+def encode_cursor(*values) -> str:
+    '''Pack the sort key of the last item into an opaque string'''
+    raw = json.dumps([value.isoformat() if isinstance(value, date) else value
+                      for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, *types) -> list:
+    '''Unpack a cursor into values of the given types'''
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if len(values) != len(types):
+            raise ValueError(cursor)
+        return [date.fromisoformat(value) if kind is date else kind(value)
+                for value, kind in zip(values, types)]
+    except (ValueError, TypeError):
+        raise http_wrong_cursor
+
+
+def paginate(query, key_columns: list, page):
+    '''
+    Apply the keyset condition, ordering and limit of the page
+
+    One extra row is requested to know whether a next page exists;
+    finish_page drops it and sets the X-Next-Cursor header
+    '''
+    if page.cursor:
+        types = [column.type.python_type for column in key_columns]
+        values = decode_cursor(page.cursor, *types)
+        query = query.filter(tuple_(*key_columns) > tuple_(*values))
+    return query.order_by(*key_columns).limit(page.limit + 1)
+
+
+def finish_page(items: list, key_columns: list, page,
+                response: Response) -> list:
+    '''Trim the look-ahead row and expose the cursor of the next page'''
+    if len(items) > page.limit:
+        items = items[:page.limit]
+        last = items[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+            *(getattr(last, column.key) for column in key_columns))
+    return items
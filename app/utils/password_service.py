@@ -0,0 +1,88 @@
+'''Running argon2 hashing and verification outside of the event loop'''
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+http_service_busy = HTTPException(
+        status_code=503,
+        detail="Too many authentication requests, try again later",
+        headers={"Retry-After": "1"},
+    )
+
+
+class PasswordService:
+    '''
+    Async facade over a passlib context
+
+    Hashes are computed on a bounded thread pool (argon2 releases the GIL),
+    so the event loop keeps serving other requests. At most ``workers`` hashes
+    run at once and at most ``max_queue`` more wait for a free worker;
+    anything beyond that is rejected with 503 instead of piling up.
+    ``workers=0`` runs the hashes inline, as before.
+    ``observer(operation, seconds)`` is told how long each call took,
+    waiting for a worker included.
+    '''
+
+    def __init__(self, context, workers: int, max_queue: int,
+                 observer=None):
+        self.context = context
+        self.observer = observer
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = (ThreadPoolExecutor(max_workers=workers,
+                                             thread_name_prefix='argon2')
+                          if workers > 0 else None)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def queue_depth(self) -> int:
+        '''Number of submitted hashes waiting for a free worker'''
+        return max(0, self.in_flight - self.workers)
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'max_queue': self.max_queue,
+            'in_flight': self.in_flight,
+            'queue_depth': self.queue_depth,
+            'completed': self.completed,
+            'rejected': self.rejected,
+        }
+
+    async def _run(self, operation: str, func, *args):
+        with self._lock:
+            if (self._executor is not None
+                    and self.in_flight >= self.workers + self.max_queue):
+                self.rejected += 1
+                raise http_service_busy
+            self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            if self._executor is None:
+                return func(*args)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+            if self.observer is not None:
+                self.observer(operation, time.perf_counter() - started)
+
+    async def hash(self, password: str) -> str:
+        return await self._run('hash', self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run('verify', self.context.verify, password,
+                               hashed_password)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
@@ -0,0 +1,138 @@
+'''
+Token bucket rate limiting and the backoff of failed logins
+
+Every request takes a token from the bucket of its client address and
+route before the dependencies of the route run, an authenticated one
+also from the bucket of its user and route. A password check that would
+reach argon2 takes one from the buckets of the login and of the client,
+and a login that failed more than LOGIN_BACKOFF_FREE_FAILURES times in a
+row from a client is refused there for LOGIN_BACKOFF_BASE seconds,
+doubling with every further failure up to LOGIN_BACKOFF_MAX. A refused
+request gets 429 with Retry-After and costs no argon2 work.
+
+The buckets live in a backend of response_cache chosen by
+RATE_LIMIT_BACKEND; `manage serve` switches it to the sqlite one when it
+starts several workers, so the limits hold across them.
+'''
+
+import math
+import time
+
+from fastapi import Depends, HTTPException, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database.dependencies import get_db
+from .config import Lazy, settings
+from .response_cache import create_backend
+
+limits = Lazy(lambda: create_backend(settings.RATE_LIMIT_BACKEND,
+                                     settings.RATE_LIMIT_SIZE,
+                                     settings.RATE_LIMIT_TTL,
+                                     settings.RATE_LIMIT_PATH))
+
+
+def too_many_requests(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many requests",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+def take_token(key: str, burst: int, per_second: float) -> float:
+    '''
+    Take a token from the bucket of the key, atomically in the backend
+    Returns 0 when taken, otherwise the seconds until one is available
+    '''
+    now = time.time()
+
+    def refill(state):
+        tokens, updated = state or (burst, now)
+        tokens = min(burst, tokens + max(0, now - updated) * per_second)
+        if tokens >= 1:
+            return [tokens - 1, now], 0
+        return [tokens, now], (1 - tokens) / per_second
+
+    return limits.update(key, refill)
+
+
+def check(key: str, burst: int, per_second: float) -> None:
+    '''Raise 429 when the bucket of the key is empty'''
+    retry_after = take_token(key, burst, per_second)
+    if retry_after:
+        raise too_many_requests(retry_after)
+
+
+def client_address(request: Request) -> str:
+    return request.client.host if request.client else ''
+
+
+def route_name(request: Request) -> str:
+    '''Method and path template, every user id shares one bucket'''
+    route = request.scope.get('route')
+    path = route.path if route is not None else request.url.path
+    return f'{request.method} {path}'
+
+
+async def limit_client(request: Request,
+                       db: AsyncSession = Depends(get_db)) -> None:
+    '''
+    Application dependency, runs before the dependencies of the route
+    Tags the session of the request with the client address for the
+    password checks
+    '''
+    client = client_address(request)
+    db.info['client'] = client
+    if settings.RATE_LIMIT_ENABLED:
+        check(f'client:{client}:{route_name(request)}',
+              settings.RATE_LIMIT_CLIENT_BURST,
+              settings.RATE_LIMIT_CLIENT_PER_SECOND)
+
+
+def limit_user(user_id: int, request: Request) -> None:
+    '''Take the token of an authenticated user'''
+    if settings.RATE_LIMIT_ENABLED:
+        check(f'user:{user_id}:{route_name(request)}',
+              settings.RATE_LIMIT_USER_BURST,
+              settings.RATE_LIMIT_USER_PER_SECOND)
+
+
+def backoff_key(login: str, client: str) -> str:
+    return f'backoff:{client}:{login}'
+
+
+def check_password_attempt(login: str, client: str) -> None:
+    '''Raise 429 before a password check the limits do not allow'''
+    if not settings.RATE_LIMIT_ENABLED:
+        return
+    backoff = limits.get(backoff_key(login, client))
+    if backoff is not None and backoff[1] > time.time():
+        raise too_many_requests(backoff[1] - time.time())
+    check(f'password-login:{login}', settings.PASSWORD_LOGIN_BURST,
+          settings.PASSWORD_LOGIN_PER_SECOND)
+    check(f'password-client:{client}', settings.PASSWORD_CLIENT_BURST,
+          settings.PASSWORD_CLIENT_PER_SECOND)
+
+
+def password_failed(login: str, client: str) -> None:
+    '''Count the failure, refuse the next attempts once past the free ones'''
+    if not settings.RATE_LIMIT_ENABLED:
+        return
+    now = time.time()
+
+    def count(state):
+        failures = (state[0] if state else 0) + 1
+        excess = failures - settings.LOGIN_BACKOFF_FREE_FAILURES
+        delay = 0
+        if excess > 0:
+            delay = min(settings.LOGIN_BACKOFF_MAX,
+                        settings.LOGIN_BACKOFF_BASE * 2 ** min(excess - 1, 32))
+        return [failures, now + delay], None
+
+    limits.update(backoff_key(login, client), count)
+
+
+def password_succeeded(login: str, client: str) -> None:
+    '''Forget the failures of the login from the client'''
+    if settings.RATE_LIMIT_ENABLED:
+        limits.delete([backoff_key(login, client)])
@@ -0,0 +1,248 @@
+'''
+Cache of computed responses with pluggable storage
+
+Keys are strings, values anything JSON serialisable; the statistics keys
+start with the id of the user the response belongs to. MemoryBackend
+keeps entries in the process; SQLiteBackend keeps them in a file every
+worker opens, a local stand-in for a shared store such as Redis. The
+backend is chosen by STATS_CACHE_BACKEND: memory, sqlite or none. The
+idempotency middleware, the shared state and the rate limiter use the
+same backends.
+'''
+
+import json
+import sqlite3
+import threading
+import time
+
+from .cache import TTLCache
+from .config import Lazy, settings
+
+
+class MemoryBackend:
+    '''In-process LRU with size and TTL limits'''
+    kind = 'memory'
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize, ttl)
+
+    @property
+    def evictions(self) -> int:
+        return self._cache.evictions
+
+    def get(self, key: str):
+        return self._cache.get(key)
+
+    def set(self, key: str, value) -> None:
+        self._cache.set(key, value)
+
+    def add(self, key: str, value) -> bool:
+        return self._cache.add(key, value)
+
+    def update(self, key: str, function):
+        return self._cache.update(key, function)
+
+    def delete(self, keys) -> int:
+        return sum(self._cache.pop(key) is not None for key in keys)
+
+    def delete_prefix(self, prefix: str) -> int:
+        return self._cache.discard_keys(lambda key: key.startswith(prefix))
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+class SQLiteBackend:
+    '''
+    Entries in a SQLite file shared by every process that opens it
+    Expired entries are dropped when read, the oldest ones when the
+    table grows beyond ``maxsize``.
+    '''
+    kind = 'sqlite'
+
+    def __init__(self, path: str, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=5,
+                                           isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS response_cache ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+            'expires REAL NOT NULL)')
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS ix_response_cache_expires '
+            'ON response_cache (expires)')
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT value, expires FROM response_cache WHERE key = ?',
+                (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                self._connection.execute(
+                    'DELETE FROM response_cache WHERE key = ?', (key,))
+                self.evictions += 1
+                return None
+            return json.loads(row[0])
+
+    def set(self, key: str, value) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO response_cache (key, value, expires) '
+                'VALUES (?, ?, ?)',
+                (key, json.dumps(value), time.time() + self.ttl))
+            self.evictions += self._connection.execute(
+                'DELETE FROM response_cache WHERE key IN ('
+                'SELECT key FROM response_cache ORDER BY expires DESC '
+                'LIMIT -1 OFFSET ?)', (self.maxsize,)).rowcount
+
+    def add(self, key: str, value) -> bool:
+        '''Insert unless the key has a live entry, atomic across processes'''
+        if self.maxsize <= 0:
+            return True
+        with self._lock:
+            self._connection.execute(
+                'DELETE FROM response_cache WHERE key = ? AND expires < ?',
+                (key, time.time()))
+            added = self._connection.execute(
+                'INSERT OR IGNORE INTO response_cache (key, value, expires) '
+                'VALUES (?, ?, ?)',
+                (key, json.dumps(value), time.time() + self.ttl)).rowcount
+            self.evictions += self._connection.execute(
+                'DELETE FROM response_cache WHERE key IN ('
+                'SELECT key FROM response_cache ORDER BY expires DESC '
+                'LIMIT -1 OFFSET ?)', (self.maxsize,)).rowcount
+            return added == 1
+
+    def update(self, key: str, function):
+        '''
+        Replace the value with the first item of function(value), atomic
+        across processes: the write lock is taken before the read
+        '''
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._connection.execute(
+                    'SELECT value, expires FROM response_cache WHERE key = ?',
+                    (key,)).fetchone()
+                current = (json.loads(row[0])
+                           if row is not None and row[1] >= time.time()
+                           else None)
+                value, result = function(current)
+                if self.maxsize > 0:
+                    self._connection.execute(
+                        'INSERT OR REPLACE INTO response_cache '
+                        '(key, value, expires) VALUES (?, ?, ?)',
+                        (key, json.dumps(value), time.time() + self.ttl))
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            return result
+
+    def delete(self, keys) -> int:
+        keys = list(keys)
+        with self._lock:
+            return self._connection.execute(
+                'DELETE FROM response_cache WHERE key IN '
+                f'({", ".join("?" * len(keys))})', keys).rowcount
+
+    def delete_prefix(self, prefix: str) -> int:
+        with self._lock:
+            return self._connection.execute(
+                'DELETE FROM response_cache WHERE key >= ? AND key < ?',
+                (prefix, prefix + '\uffff')).rowcount
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute('DELETE FROM response_cache')
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                'SELECT count(*) FROM response_cache').fetchone()[0]
+
+
+def create_backend(kind: str, maxsize: int, ttl: float, path: str):
+    if kind == 'memory':
+        return MemoryBackend(maxsize, ttl)
+    if kind == 'sqlite':
+        return SQLiteBackend(path, maxsize, ttl)
+    if kind == 'none':
+        return MemoryBackend(0, ttl)
+    raise ValueError(f'Unknown cache backend: {kind}')
+
+
+class ResponseCache:
+    '''Backend with hit, miss and invalidation counters'''
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: str):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value) -> None:
+        self.backend.set(key, value)
+
+    def invalidate(self, keys) -> None:
+        self.invalidations += self.backend.delete(keys)
+
+    def invalidate_prefix(self, prefix: str) -> None:
+        self.invalidations += self.backend.delete_prefix(prefix)
+
+    def stats(self) -> dict:
+        return {
+            'backend': self.backend.kind,
+            'size': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.backend.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+stats_cache = ResponseCache(Lazy(lambda: create_backend(
+    settings.STATS_CACHE_BACKEND, settings.STATS_CACHE_SIZE,
+    settings.STATS_CACHE_TTL, settings.STATS_CACHE_PATH)))
+
+
+def balance_key(user_id: int) -> str:
+    return f'{user_id}:balance'
+
+
+def monthly_key(user_id: int, year: int, month: int) -> str:
+    return f'{user_id}:monthly:{year}-{month:02d}'
+
+
+def invalidate_statistics(user_id: int, days=None) -> None:
+    '''
+    Drop the cached statistics of the user
+    With ``days`` only the balance and the months of these days are
+    dropped, otherwise everything cached for the user.
+    '''
+    if days is None:
+        stats_cache.invalidate_prefix(f'{user_id}:')
+    else:
+        stats_cache.invalidate([balance_key(user_id)] + [
+            monthly_key(user_id, day.year, day.month)
+            for day in set(days)])
@@ -0,0 +1,35 @@
+'''
+State every worker process must see
+
+The caches of verified credentials and validated tokens live in each
+process. When a user's password, token version or account changes, the
+worker handling it stamps the user in the shared state, and a cached
+entry older than the stamp counts as a miss in every worker. With a
+single process the memory backend is enough; `manage serve` switches to
+the sqlite one, a file every worker opens, when it starts several.
+'''
+
+import time
+
+from .config import Lazy, settings
+from .response_cache import create_backend
+
+shared_state = Lazy(lambda: create_backend(settings.SHARED_STATE_BACKEND,
+                                           settings.SHARED_STATE_SIZE,
+                                           settings.SHARED_STATE_TTL,
+                                           settings.SHARED_STATE_PATH))
+
+
+def changed_key(user_id: int) -> str:
+    return f'user-changed:{user_id}'
+
+
+def mark_user_changed(user_id: int) -> None:
+    '''Make every worker drop what it cached about the user before now'''
+    shared_state.set(changed_key(user_id), time.time())
+
+
+def changed_since(user_id: int, cached_at: float) -> bool:
+    '''Whether the user changed after an entry was cached'''
+    changed_at = shared_state.get(changed_key(user_id))
+    return changed_at is not None and changed_at >= cached_at
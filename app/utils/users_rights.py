@@ -1,12 +1,13 @@
 '''Verification functions during user authorization'''
 from fastapi import HTTPException
+from sqlalchemy import select
 
 from .authorisation_password import get_current_user_with_login_and_password
+from .authorisation_token import Principal
 from ..database.models import Account, Transaction, User
 from ..schemas.account import AccountResponse
 from ..schemas.transaction import TransactionResponse
 from ..schemas.user import UserResponse
-from ..utils.authorisation_password import verify_password
 from ..utils.config import settings
 
 http_wrong_rights = HTTPException(
@@ -14,54 +15,48 @@ http_wrong_rights = HTTPException(
         detail="No access rights"
     )
 
-def check_admin_rights(db, login: str, password: str) -> bool:
+async def check_admin_rights(db, login: str, password: str) -> bool:
     '''Check is user admin'''
-    db_user = get_current_user_with_login_and_password(db, login, password)
+    db_user = await get_current_user_with_login_and_password(db, login,
+                                                             password)
     return db_user.is_admin
 
-def is_admin_id(user_id, db):
+async def is_admin_id(user_id, db):
     '''Check is it user's id'''
-    if (db
-        .query(User)
-        .filter(User.id == user_id)
-        .first()
-        .login) == settings.DB_USER:
+    if (await db.scalar(
+            select(User.login)
+            .filter(User.id == user_id))) == settings.DB_USER:
         raise http_wrong_rights
 
-def check_user_exists(id, db) -> UserResponse:
+async def check_user_exists(id, db) -> UserResponse:
     '''Find user by id'''
-    if db_user := db.query(User).filter(User.id == id).first():
+    if db_user := await db.scalar(select(User).filter(User.id == id)):
         return db_user
     raise HTTPException(
         status_code=404,
         detail='User not found'
     )
 
-def check_account_exists(id, db) -> AccountResponse:
+async def check_account_exists(id, db) -> AccountResponse:
     '''Find account by id'''
-    if db_account := db.query(Account).filter(Account.id == id).first():
+    if db_account := await db.scalar(select(Account).filter(Account.id == id)):
         return db_account
     raise HTTPException(
         status_code=404,
         detail='Account not found'
     )
 
-def check_transaction_exists(id, db) -> TransactionResponse:
+async def check_transaction_exists(id, db) -> TransactionResponse:
     '''Find transaction by id'''
-    if db_transaction := (db.query(Transaction)
-            .filter(Transaction.id == id).first()):
+    if db_transaction := await db.scalar(select(Transaction)
+            .filter(Transaction.id == id)):
         return db_transaction
     raise HTTPException(
         status_code=404,
         detail='Transaction not found'
     )
 
-def check_user_rights(db, db_user: User, cred_log, cred_pass):
+def check_user_rights(principal: Principal, db_user: User):
     '''Check rights for editing'''
-    is_admin = check_admin_rights(db, cred_log, cred_pass)
-
-    has_rights = (db_user.login == cred_log
-                  and verify_password(cred_pass, db_user.password))
-
-    if not (is_admin or has_rights):
+    if not (principal.is_admin or principal.id == db_user.id):
         raise http_wrong_rights